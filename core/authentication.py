@@ -0,0 +1,106 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from uuid import UUID
+
+from django.conf import settings
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User
+
+# Tokens carry the token_version of their user, and bumping User.token_version
+# (a password change) revokes every token issued before. Authenticated
+# requests resolve their user from a per-process LRU cache keyed by user id
+# that remembers the token version it was loaded for, so a request with a
+# known token does not query the user row. Saving or deleting a user drops its
+# entry in the process that did it (see core.signals); other processes keep
+# theirs for at most AUTH_USER_CACHE_TTL seconds.
+
+TOKEN_VERSION_CLAIM = 'token_version'
+
+
+class VersionedRefreshToken(RefreshToken):
+    @classmethod
+    def for_user(cls, user: User):
+        token = super().for_user(user)
+        # copied into the access tokens made from it
+        token[TOKEN_VERSION_CLAIM] = user.token_version
+        return token
+
+
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = VersionedRefreshToken
+
+
+class UserCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, user_id: UUID, token_version: int) -> Optional[User]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            version, user, expires_at = entry
+            if version != token_version or expires_at < time.monotonic():
+                return None
+            self.entries.move_to_end(user_id)
+        # each request gets its own instance to cache relations on
+        return copy.copy(user)
+
+    def set(self, user: User):
+        with self.lock:
+            self.entries[user.id] = (user.token_version, copy.copy(user), time.monotonic() + self.ttl)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: UUID):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+
+_user_cache = None
+_user_cache_lock = threading.Lock()
+
+
+def get_user_cache() -> UserCache:
+    global _user_cache
+    if _user_cache is None:
+        with _user_cache_lock:
+            if _user_cache is None:
+                _user_cache = UserCache(
+                    max_size=getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+                    ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 60),
+                )
+    return _user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token) -> User:
+        try:
+            user_id = UUID(str(validated_token[api_settings.USER_ID_CLAIM]))
+        except (KeyError, ValueError):
+            raise InvalidToken('Token contained no recognizable user identification')
+        # tokens issued before versioning count as version 0
+        token_version = validated_token.get(TOKEN_VERSION_CLAIM, 0)
+
+        cache = get_user_cache()
+        user = cache.get(user_id, token_version)
+        if user is not None:
+            return user
+
+        user = super().get_user(validated_token)
+        if user.token_version != token_version:
+            raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        cache.set(user)
+        return user
@@ -0,0 +1,95 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Post, PostLike, Bookmark, VisitRecord, Follow, User
+from .trending import add_event_score, engagement_score, event_score
+
+POST_COUNTER_FIELDS = ['reply_count', 'repost_count', 'like_count', 'view_count', 'bookmark_count']
+FOLLOW_COUNTER_FIELDS = ['follower_count', 'following_count']
+
+
+def increment_post_counters(post_id, **deltas: int):
+    """
+    Applies `deltas` (e.g. like_count=1) to the post row in a single UPDATE.
+    New engagement is added to the trending score in the same statement.
+    """
+    updates = {}
+    for field, delta in deltas.items():
+        if delta >= 0:
+            updates[field] = F(field) + delta
+        else:
+            updates[field] = Greatest(F(field) + delta, Value(0))
+    score = engagement_score(deltas)
+    if score > 0:
+        updates['trending_score'] = add_event_score(F('trending_score'), event_score(score))
+    Post.objects.filter(id=post_id).update(**updates)
+
+
+def bump_post_counters(post: Post, **deltas: int):
+    """
+    Like increment_post_counters, then reloads the counters on `post`. Call it
+    inside the transaction that writes the child row so the counter and the
+    row commit together.
+    """
+    increment_post_counters(post.id, **deltas)
+    post.refresh_from_db(fields=POST_COUNTER_FIELDS)
+
+
+def increment_follow_counters(follower_id, following_id, delta: int):
+    """
+    Applies a follow (delta=1) or unfollow (delta=-1) to the following_count of
+    the follower and the follower_count of the followed user. The rows are
+    updated in id order so concurrent follows between two users cannot
+    deadlock; call it inside the transaction that writes the Follow row.
+    """
+    for user_id, field in sorted([(follower_id, 'following_count'), (following_id, 'follower_count')]):
+        value = F(field) + delta if delta >= 0 else Greatest(F(field) + delta, Value(0))
+        User.objects.filter(id=user_id).update(**{field: value})
+
+
+def _count_subquery(queryset, field: str):
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def reconcile_post_counters() -> int:
+    """Recomputes every post counter from the child tables, returns the number of posts fixed."""
+    expected = Post.objects.annotate(
+        expected_reply_count=_count_subquery(Post.objects.all(), 'reply_parent'),
+        expected_repost_count=_count_subquery(Post.objects.all(), 'repost_parent'),
+        expected_like_count=_count_subquery(PostLike.objects.all(), 'post'),
+        expected_view_count=_count_subquery(VisitRecord.objects.all(), 'post'),
+        expected_bookmark_count=_count_subquery(Bookmark.objects.all(), 'post'),
+    )
+    drifted = expected.exclude(
+        reply_count=F('expected_reply_count'),
+        repost_count=F('expected_repost_count'),
+        like_count=F('expected_like_count'),
+        view_count=F('expected_view_count'),
+        bookmark_count=F('expected_bookmark_count'),
+    )
+
+    fixed = 0
+    for post in drifted.iterator():
+        for field in POST_COUNTER_FIELDS:
+            setattr(post, field, getattr(post, 'expected_' + field))
+        post.save(update_fields=POST_COUNTER_FIELDS)
+        fixed += 1
+    return fixed
+
+
+def reconcile_follow_counters() -> int:
+    """Recomputes every user's follow counters from the Follow table, returns the number of users fixed."""
+    drifted = User.objects.annotate(
+        expected_follower_count=_count_subquery(Follow.objects.all(), 'following'),
+        expected_following_count=_count_subquery(Follow.objects.all(), 'follower'),
+    ).exclude(
+        follower_count=F('expected_follower_count'),
+        following_count=F('expected_following_count'),
+    )
+
+    fixed = 0
+    for user in drifted.iterator():
+        User.objects.filter(id=user.id).update(follower_count=user.expected_follower_count, following_count=user.expected_following_count)
+        fixed += 1
+    return fixed
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from typing import Iterable, List
+from uuid import UUID
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.utils.module_loading import import_string
+
+# Push channel for live updates. Write paths publish small per-user events
+# (new unread count, new post in the home feed) once their transaction
+# commits, and every open event stream of that user receives them. The
+# default LocalBroker only reaches streams served by the same process. Events
+# are also published by other processes (the process_outbox worker creates the
+# notifications), so deployments set EVENT_BROKER to PostgresBroker, which
+# carries them over LISTEN/NOTIFY on the database every process already uses.
+
+STREAM_QUEUE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, user_id: UUID, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+
+    def offer(self, event: dict):
+        # runs on the subscriber's loop; a client that stopped reading loses
+        # the oldest events rather than growing the queue
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class LocalBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+
+    def subscribe(self, user_id: UUID) -> Subscription:
+        """Must be called from the event loop that will read the subscription."""
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self.lock:
+            self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            subscriptions = self.subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscriptions[subscription.user_id]
+
+    def publish(self, user_ids: List[UUID], event: dict):
+        for user_id in user_ids:
+            self.deliver(user_id, event)
+
+    def deliver(self, user_id: UUID, event: dict):
+        # safe to call from any thread, the event is handed to each loop
+        with self.lock:
+            subscriptions = list(self.subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, event)
+            except RuntimeError:
+                # the loop is closed, its stream is gone
+                self.unsubscribe(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publishes with NOTIFY on EVENT_CHANNEL; each process with open streams
+    runs one thread listening on its own connection that delivers the events
+    to its local subscriptions. Events sent while the listener reconnects are
+    lost, streams get the current unread count again when they reconnect.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.channel = getattr(settings, 'EVENT_CHANNEL', 'core_events')
+        self.listener = None
+
+    def subscribe(self, user_id: UUID) -> Subscription:
+        with self.lock:
+            if self.listener is None:
+                self.listener = threading.Thread(target=self.listen, name='event-listener', daemon=True)
+                self.listener.start()
+        return super().subscribe(user_id)
+
+    def publish(self, user_ids: List[UUID], event: dict):
+        # one notification per user, sent in a single round trip
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_notify(%s, json_build_object('user_id', user_id, 'event', %s::json)::text) FROM unnest(%s::text[]) AS user_id",
+                [self.channel, json.dumps(event), [str(user_id) for user_id in user_ids]],
+            )
+
+    def listen(self):
+        while True:
+            try:
+                self.listen_once()
+            except Exception:
+                logger.exception('Event listener failed, reconnecting')
+                time.sleep(1)
+
+    def listen_once(self):
+        database = connections['default']
+        conn = database.get_new_connection(database.get_connection_params())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    message = json.loads(conn.notifies.pop(0).payload)
+                    self.deliver(UUID(message['user_id']), message['event'])
+        finally:
+            conn.close()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'EVENT_BROKER', 'core.events.LocalBroker'))()
+    return _broker
+
+
+def publish_event(user_ids: Iterable[UUID], type: str, **data):
+    """Publishes `{'type': type, **data}` to each user once the current transaction commits."""
+    user_ids = list(user_ids)
+    event = {'type': type, **data}
+
+    def publish():
+        if not user_ids:
+            return
+        try:
+            get_broker().publish(user_ids, event)
+        except Exception:
+            logger.exception('Failed to publish %s event', type)
+
+    transaction.on_commit(publish)
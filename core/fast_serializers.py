@@ -0,0 +1,127 @@
+from operator import attrgetter
+from typing import Iterable, List
+
+from rest_framework import serializers
+
+from .fragments import get_fragment_cache
+from .images import get_image_variants
+from .models import Post, PostImage, User
+from .viewer_state import get_viewer_state
+
+# Renders what AugmentedPostPreviewSerializer renders for a page of posts
+# without the DRF field machinery: posts, parents, authors and images are read
+# as tuple rows (values_list, or attrgetter on the already loaded posts of the
+# page) and turned into dicts with the keys of the serializer in its order,
+# so the JSON is byte for byte the same. The viewer-independent parts come
+# from the fragment cache of core.fragments when their version is current.
+# get_page_response uses it for pages of AugmentedPostPreviewSerializer; a
+# field added to the serializers has to be added here too, core.tests
+# compares the two.
+
+POST_FIELDS = ('id', 'author_id', 'content', 'created_at', 'reply_count', 'repost_count', 'like_count', 'view_count',
+               'bookmark_count', 'repost_parent_id', 'reply_parent_id', 'changed_at')
+USER_FIELDS = ('id', 'username', 'email', 'name', 'date_of_birth', 'created_at', 'profile_image', 'bio', 'location',
+               'website', 'header_photo')
+AUTHOR_FIELDS = ('id', 'profile_changed_at', 'follower_count', 'following_count')
+
+POST_KEYS = ('id', 'author', 'content', 'created_at', 'images', 'liked', 'reply_count', 'repost_count', 'like_count',
+             'view_count', 'bookmark_count', 'bookmarked', 'reposted')
+AUGMENTED_POST_KEYS = POST_KEYS + ('repost_parent', 'reply_parent')
+USER_KEYS = ('id', 'username', 'email', 'name', 'date_of_birth', 'created_at', 'profile_image', 'bio', 'location',
+             'followers', 'following', 'website', 'header_photo', 'is_following')
+
+# the formatting of the serializer fields, following the REST_FRAMEWORK settings
+_datetime = serializers.DateTimeField().to_representation
+_date = serializers.DateField().to_representation
+
+_post_row = attrgetter(*POST_FIELDS)
+
+
+def serialize_post_previews(posts: Iterable[Post], context: dict) -> List[dict]:
+    """The AugmentedPostPreviewSerializer representation of `posts`."""
+    rows = {}
+    page_ids = []
+    for row in map(_post_row, posts):
+        rows[row[0]] = row
+        page_ids.append(row[0])
+    parent_ids = {parent_id for row in rows.values() for parent_id in row[9:11] if parent_id is not None} - rows.keys()
+    if parent_ids:
+        rows.update((row[0], row) for row in Post.objects.filter(id__in=parent_ids).values_list(*POST_FIELDS))
+    author_ids = {row[1] for row in rows.values()}
+    authors = {row[0]: row for row in User.objects.filter(id__in=author_ids).values_list(*AUTHOR_FIELDS)} if author_ids else {}
+
+    request = context['request']
+    viewer_state = get_viewer_state(context)
+    viewer_state.load_post_ids(rows.keys())
+    viewer_state.load_user_ids(authors.keys())
+    image_variants = get_image_variants(context)
+    cache = get_fragment_cache()
+    # the image URLs depend on the requested size and the host
+    variant = (image_variants.size, request.build_absolute_uri('/'))
+
+    cards = {user_id: cache.get(('user', user_id) + variant, author[1]) for user_id, author in authors.items()}
+    missing = [user_id for user_id, card in cards.items() if card is None]
+    if missing:
+        users = list(User.objects.filter(id__in=missing).values_list(*USER_FIELDS))
+        image_variants.load([name for user in users for name in (user[6], user[10])])
+        for user in users:
+            cards[user[0]] = _card(user, image_variants.name_url)
+            # the version read before the row, a change in between is rendered again
+            cache.set(('user', user[0]) + variant, authors[user[0]][1], cards[user[0]])
+
+    fragments = {post_id: cache.get(('post', post_id) + variant, row[11]) for post_id, row in rows.items()}
+    missing = [post_id for post_id, fragment in fragments.items() if fragment is None]
+    if missing:
+        images = {post_id: [] for post_id in missing}
+        for post_id, name in PostImage.objects.filter(post_id__in=missing).values_list('post_id', 'image'):
+            images[post_id].append(name)
+        image_variants.load([name for names in images.values() for name in names])
+        for post_id in missing:
+            row = rows[post_id]
+            fragments[post_id] = (str(post_id), row[2], _datetime(row[3]), tuple(image_variants.name_url(name) for name in images[post_id]))
+            cache.set(('post', post_id) + variant, row[11], fragments[post_id])
+
+    viewer_id = request.user.id
+    liked, bookmarked, reposted, following = viewer_state.liked, viewer_state.bookmarked, viewer_state.reposted, viewer_state.following
+    author_cards = {}
+    for user_id, author in authors.items():
+        card = cards[user_id]
+        author_cards[user_id] = dict(zip(USER_KEYS, card[:9] + author[2:4] + card[9:] + (
+            user_id != viewer_id and user_id in following,
+        )))
+
+    previews = {}
+    for post_id, row in rows.items():
+        fragment = fragments[post_id]
+        previews[post_id] = (
+            fragment[0], author_cards[row[1]], fragment[1], fragment[2], list(fragment[3]),
+            post_id in liked, row[4], row[5], row[6], row[7], row[8], post_id in bookmarked, post_id in reposted,
+        )
+
+    data = []
+    for post_id in page_ids:
+        repost_parent_id, reply_parent_id = rows[post_id][9:11]
+        data.append(dict(zip(AUGMENTED_POST_KEYS, previews[post_id] + (
+            _parent(previews, repost_parent_id),
+            _parent(previews, reply_parent_id),
+        ))))
+    return data
+
+
+def _card(user: tuple, image_url) -> tuple:
+    # the author card without the follow counts and is_following
+    date_of_birth, created_at, profile_image, header_photo = user[4], user[5], user[6], user[10]
+    return (
+        str(user[0]), user[1], user[2], user[3],
+        None if date_of_birth is None else _date(date_of_birth),
+        None if created_at is None else _datetime(created_at),
+        image_url(profile_image) if profile_image else None,
+        user[7], user[8], user[9],
+        image_url(header_photo) if header_photo else None,
+    )
+
+
+def _parent(previews: dict, parent_id):
+    if parent_id is None or parent_id not in previews:
+        return None
+    return dict(zip(POST_KEYS, previews[parent_id]))
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Post, User
+
+# The parts of a post preview that look the same to every viewer (see
+# core.fast_serializers) are kept in a per-process LRU cache, one fragment
+# per post and one per author card, so a post on thousands of timelines is
+# rendered once per process. A fragment is stored with the version it was
+# rendered from, Post.changed_at or User.profile_changed_at, and a lookup
+# with any other version misses. The versions are bumped by the save()
+# methods of the models, and by touch_posts and touch_image_owners for
+# changes made without saving (new post images, new variants). Counters,
+# follow counts and the viewer flags are not part of the fragments and are
+# merged in on every request.
+
+
+class FragmentCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key: tuple, version) -> Optional[tuple]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: tuple, version, fragment: tuple):
+        with self.lock:
+            self.entries[key] = (version, fragment)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_fragment_cache = None
+_fragment_cache_lock = threading.Lock()
+
+
+def get_fragment_cache() -> FragmentCache:
+    global _fragment_cache
+    if _fragment_cache is None:
+        with _fragment_cache_lock:
+            if _fragment_cache is None:
+                _fragment_cache = FragmentCache(max_size=getattr(settings, 'POST_FRAGMENT_CACHE_SIZE', 20000))
+    return _fragment_cache
+
+
+def touch_posts(post_ids: Iterable):
+    post_ids = set(post_ids)
+    if post_ids:
+        Post.objects.filter(id__in=post_ids).update(changed_at=timezone.now())
+
+
+def touch_image_owners(names: Iterable[str]):
+    """Bumps the versions of the posts and users showing one of the stored images `names`."""
+    names = {name for name in names if name}
+    if not names:
+        return
+    Post.objects.filter(images__image__in=names).update(changed_at=timezone.now())
+    User.objects.filter(Q(profile_image__in=names) | Q(header_photo__in=names)).update(profile_changed_at=timezone.now())
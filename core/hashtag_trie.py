@@ -0,0 +1,123 @@
+import heapq
+import threading
+import time
+from collections import namedtuple
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db.models import Count
+
+from .models import HashTag
+
+# Prefix trie over hashtag names for autocomplete. Every tag keeps the number
+# of posts it is attached to, and every node caches the most popular tags below
+# it, so a lookup walks the prefix and returns the cached list. A change to a
+# count only invalidates the caches on the path to that tag; they are refilled
+# by the next lookup. Each worker updates its own trie on the writes it serves
+# and rebuilds it from the database every HASHTAG_TRIE_TTL seconds to pick up
+# changes made by other workers.
+
+HASHTAG_TOP_K = 10
+HASHTAG_MAX_LIMIT = 50
+
+HashtagCount = namedtuple('HashtagCount', ['name', 'related_post_count'])
+
+
+class TrieNode:
+    __slots__ = ('children', 'name', 'count', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.name = None
+        self.count = 0
+        self.top = None
+
+
+class HashtagTrie:
+    def __init__(self, top_k: int = HASHTAG_MAX_LIMIT):
+        self.top_k = top_k
+        self.root = TrieNode()
+        self.lock = threading.RLock()
+        self.built_at = time.monotonic()
+
+    def _path(self, name: str) -> List[TrieNode]:
+        node = self.root
+        path = [node]
+        for char in name:
+            node = node.children.setdefault(char, TrieNode())
+            path.append(node)
+        return path
+
+    def add(self, name: str, delta: int = 0):
+        """Registers `name` and changes its post count by `delta`."""
+        with self.lock:
+            path = self._path(name)
+            tag = path[-1]
+            tag.name = name
+            tag.count = max(tag.count + delta, 0)
+            for node in path:
+                node.top = None
+
+    def load(self, counts: Iterable[tuple]):
+        with self.lock:
+            for name, count in counts:
+                self.add(name, count)
+
+    def _top(self, node: TrieNode) -> List[HashtagCount]:
+        # fills the missing caches below `node` children first, with a stack
+        # instead of recursion so long tags do not hit the recursion limit
+        stack = [(node, False)]
+        while stack:
+            current, expanded = stack.pop()
+            if current.top is not None:
+                continue
+            if not expanded:
+                stack.append((current, True))
+                stack.extend((child, False) for child in current.children.values() if child.top is None)
+                continue
+            candidates = [HashtagCount(current.name, current.count)] if current.name is not None else []
+            for child in current.children.values():
+                candidates.extend(child.top)
+            current.top = heapq.nsmallest(self.top_k, candidates, key=lambda tag: (-tag.related_post_count, tag.name))
+        return node.top
+
+    def search(self, prefix: str, limit: int = HASHTAG_TOP_K) -> List[HashtagCount]:
+        """The `limit` (at most top_k) most used tags starting with `prefix`, most used first."""
+        with self.lock:
+            node = self.root
+            for char in prefix:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            return self._top(node)[:min(limit, self.top_k)]
+
+    def build(self):
+        self.load(HashTag.objects.annotate(post_count=Count('posts')).values_list('name', 'post_count'))
+
+
+_hashtag_trie = None
+_hashtag_trie_lock = threading.Lock()
+
+
+def get_hashtag_trie() -> HashtagTrie:
+    global _hashtag_trie
+    ttl = getattr(settings, 'HASHTAG_TRIE_TTL', 300)
+    trie = _hashtag_trie
+    if trie is None or time.monotonic() - trie.built_at > ttl:
+        with _hashtag_trie_lock:
+            if _hashtag_trie is trie:
+                trie = HashtagTrie()
+                trie.build()
+                _hashtag_trie = trie
+    return _hashtag_trie
+
+
+def update_hashtag_counts(attached: Iterable[str] = (), detached: Iterable[str] = ()):
+    """Applies tag attach/detach to this process's trie if it is loaded."""
+    trie = _hashtag_trie
+    if trie is None:
+        return
+    for name in attached:
+        trie.add(name, 1)
+    for name in detached:
+        trie.add(name, -1)
@@ -0,0 +1,28 @@
+from typing import Iterable, Set, Tuple
+
+from .models import HashTag, Post
+from .utils import HASHTAG_MAX_LENGTH
+
+PostHashTag = HashTag.posts.through
+
+
+def set_post_hashtags(post: Post, tag_names: Iterable[str], created: bool = False) -> Tuple[Set[str], Set[str]]:
+    """
+    Makes `tag_names` the hashtags of `post` with a fixed number of queries:
+    missing tags are inserted in one statement, then the through-rows are
+    added and removed in bulk. Names longer than HASHTAG_MAX_LENGTH are
+    skipped. `created` skips reading the current tags of a post that cannot
+    have any yet. Returns the attached and detached names.
+    """
+    tag_names = {name for name in tag_names if len(name) <= HASHTAG_MAX_LENGTH}
+    current = {} if created else dict(PostHashTag.objects.filter(post=post).values_list('hashtag__name', 'hashtag_id'))
+
+    attached = tag_names - current.keys()
+    detached = current.keys() - tag_names
+    if attached:
+        HashTag.objects.bulk_create([HashTag(name=name) for name in attached], ignore_conflicts=True)
+        tag_ids = HashTag.objects.filter(name__in=attached).values_list('id', flat=True)
+        PostHashTag.objects.bulk_create([PostHashTag(post=post, hashtag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+    if detached:
+        PostHashTag.objects.filter(post=post, hashtag_id__in=[current[name] for name in detached]).delete()
+    return attached, detached
@@ -0,0 +1,38 @@
+from collections import namedtuple
+from io import BytesIO
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+
+# Pillow work of the image variant pipeline (see core.images). Kept free of
+# Django imports so the functions can run in a separate process.
+
+VariantSize = namedtuple('VariantSize', ['width', 'height', 'crop'])
+
+# variants generated for every upload: `thumb` is cropped to exactly its size,
+# the others are scaled down to fit theirs and never scaled up
+VARIANT_SIZES = {
+    'thumb': VariantSize(150, 150, True),
+    'small': VariantSize(480, 480, False),
+    'medium': VariantSize(1080, 1080, False),
+}
+
+WEBP_QUALITY = 80
+
+
+def render_variants(data: bytes, sizes: Dict[str, VariantSize] = VARIANT_SIZES) -> Dict[str, Tuple[bytes, int, int]]:
+    """Encodes `data` as a WebP image per size, returns {size: (webp bytes, width, height)}."""
+    variants = {}
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        for name, size in sizes.items():
+            if size.crop:
+                variant = ImageOps.fit(image, (size.width, size.height), Image.LANCZOS)
+            else:
+                variant = image.copy()
+                variant.thumbnail((size.width, size.height), Image.LANCZOS)
+            output = BytesIO()
+            variant.save(output, 'WEBP', quality=WEBP_QUALITY)
+            variants[name] = (output.getvalue(), variant.width, variant.height)
+    return variants
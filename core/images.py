@@ -0,0 +1,168 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models.fields.files import FieldFile
+
+from .fragments import touch_image_owners
+from .image_processing import VARIANT_SIZES, render_variants
+from .loaders import PageLoader
+from .models import ImageVariant, User
+
+# Uploaded images (post images, profile images, header photos) are kept as
+# they are and get a WebP copy per VARIANT_SIZES, generated when they are
+# uploaded. The resizing runs in a pool of IMAGE_VARIANT_WORKERS processes so
+# it neither holds the GIL of the server process nor blocks its other threads.
+# Serializers return the URL of the variant named by the `size` query
+# parameter, falling back to the original for images without one (uploads
+# from before the pipeline, see the generate_image_variants command, or ones
+# Pillow could not read). Without the parameter the original is returned.
+
+ORIGINAL_SIZE = 'original'
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """The process pool rendering variants, None to render in the calling process."""
+    global _pool
+    workers = getattr(settings, 'IMAGE_VARIANT_WORKERS', 2)
+    if workers == 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawned, forking a server process with running threads is unsafe
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _read(name: str) -> bytes:
+    with default_storage.open(name, 'rb') as file:
+        return file.read()
+
+
+def generate_image_variants(names: Iterable[str]) -> List[ImageVariant]:
+    """Renders and stores the variants of the stored images `names`."""
+    names = [name for name in names if name]
+    # a deduplicated upload may already have its variants
+    names = sorted(set(names) - set(ImageVariant.objects.filter(source__in=names).values_list('source', flat=True)))
+    pool = get_pool()
+    if pool is None:
+        rendered = [(name, _render(name)) for name in names]
+    else:
+        futures = [(name, _submit(pool, name)) for name in names]
+        rendered = [(name, _result(name, future)) for name, future in futures]
+
+    variants = []
+    for name, renders in rendered:
+        stem = os.path.splitext(os.path.basename(name))[0]
+        for size, (data, width, height) in (renders or {}).items():
+            variant = ImageVariant(source=name, size=size, width=width, height=height)
+            variant.file.save(f'{size}_{stem}.webp', ContentFile(data), save=False)
+            variants.append(variant)
+    # saved one by one so the signals of core.signals retain the blobs of the
+    # rows actually inserted; a concurrent call may have stored the same
+    # variant, under the same content-addressed file name
+    inserted = []
+    for variant in variants:
+        try:
+            with transaction.atomic():
+                variant.save()
+        except IntegrityError:
+            continue
+        inserted.append(variant)
+    # cached previews still show the originals
+    touch_image_owners(variant.source for variant in inserted)
+    return inserted
+
+
+def _render(name: str):
+    try:
+        return render_variants(_read(name))
+    except Exception:
+        logger.exception('Failed to render variants of %s', name)
+        return None
+
+
+def _submit(pool: ProcessPoolExecutor, name: str):
+    try:
+        return pool.submit(render_variants, _read(name))
+    except Exception:
+        logger.exception('Failed to render variants of %s', name)
+        return None
+
+
+def _result(name: str, future):
+    if future is None:
+        return None
+    try:
+        return future.result()
+    except Exception:
+        logger.exception('Failed to render variants of %s', name)
+        return None
+
+
+def get_image_size(request) -> str:
+    size = request.query_params.get('size') if hasattr(request, 'query_params') else request.GET.get('size')
+    if size in VARIANT_SIZES:
+        return size
+    return ORIGINAL_SIZE
+
+
+class ImageVariants:
+    """
+    The URLs of the requested image size for everything a serializer renders,
+    loaded with one query per batch and kept for the rest of the request.
+    Lives in the serializer context under `image_variants`.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.size = get_image_size(request)
+        self.loaded = set()
+        self.urls = {}
+
+    def load(self, names: Iterable[str]):
+        if self.size == ORIGINAL_SIZE:
+            return
+        names = {name for name in names if name} - self.loaded
+        if not names:
+            return
+        self.loaded |= names
+        for source, file in ImageVariant.objects.filter(source__in=names, size=self.size).values_list('source', 'file'):
+            self.urls[source] = default_storage.url(file)
+
+    def load_users(self, users: Iterable[User]):
+        names = []
+        for user in users:
+            names.extend((user.profile_image.name, user.header_photo.name))
+        self.load(names)
+
+    def load_page(self, loader: PageLoader):
+        # the loader holds every post image and author the page renders
+        self.load(loader.image_names())
+        self.load_users(loader.users.values())
+
+    def url(self, image: FieldFile) -> str:
+        return self.name_url(image.name)
+
+    def name_url(self, name: str) -> str:
+        self.load([name])
+        return self.request.build_absolute_uri(self.urls.get(name) or default_storage.url(name))
+
+
+def get_image_variants(context: dict) -> ImageVariants:
+    if 'image_variants' not in context:
+        context['image_variants'] = ImageVariants(context['request'])
+    return context['image_variants']
@@ -0,0 +1,76 @@
+from typing import Iterable, List, Optional
+
+from .models import Post, PostImage, User
+
+
+class PageLoader:
+    """
+    The parents, authors and images of every post a serializer is about to
+    render, loaded with one IN query per type however many posts a page has
+    and kept for the rest of the request. Parents and authors are attached to
+    the posts, images are read with `images_of`. Lives in the serializer
+    context under `page_loader`.
+    """
+
+    def __init__(self):
+        self.posts = {}
+        self.users = {}
+        self.images = {}
+
+    def load_posts(self, posts: Iterable[Post]):
+        posts = [post for post in posts if post.id not in self.images]
+        for post in posts:
+            self.posts[post.id] = post
+
+        # the parents render nested, without parents of their own
+        parent_ids = set()
+        for post in posts:
+            for field in ('repost_parent', 'reply_parent'):
+                parent_id = getattr(post, field + '_id')
+                if parent_id is not None and not getattr(Post, field).is_cached(post) and parent_id not in self.posts:
+                    parent_ids.add(parent_id)
+        if parent_ids:
+            self.posts.update(Post.objects.in_bulk(parent_ids))
+
+        rendered = []
+        for post in posts:
+            rendered.append(post)
+            for field in ('repost_parent', 'reply_parent'):
+                parent_id = getattr(post, field + '_id')
+                if parent_id is None:
+                    continue
+                if not getattr(Post, field).is_cached(post):
+                    setattr(post, field, self.posts.get(parent_id))
+                parent = getattr(post, field)
+                if parent is not None and parent.id not in self.images:
+                    self.posts.setdefault(parent.id, parent)
+                    rendered.append(parent)
+        if not rendered:
+            return
+
+        author_ids = {post.author_id for post in rendered if not Post.author.is_cached(post)} - set(self.users)
+        if author_ids:
+            self.users.update(User.objects.in_bulk(author_ids))
+        for post in rendered:
+            if Post.author.is_cached(post):
+                self.users.setdefault(post.author_id, post.author)
+            else:
+                post.author = self.users[post.author_id]
+
+        post_ids = {post.id for post in rendered}
+        for post_id in post_ids:
+            self.images[post_id] = []
+        for image in PostImage.objects.filter(post_id__in=post_ids):
+            self.images[image.post_id].append(image)
+
+    def images_of(self, post: Post) -> Optional[List[PostImage]]:
+        return self.images.get(post.id)
+
+    def image_names(self) -> List[str]:
+        return [image.image.name for images in self.images.values() for image in images]
+
+
+def get_page_loader(context: dict) -> PageLoader:
+    if 'page_loader' not in context:
+        context['page_loader'] = PageLoader()
+    return context['page_loader']
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from core.hashtag_trie import HashtagTrie, HASHTAG_TOP_K
+from core.models import HashTag
+
+
+class Command(BaseCommand):
+    help = 'Compares hashtag autocomplete through the in-memory trie against the COUNT query it replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('prefixes', nargs='*', help='Prefixes to look up, defaults to the first one and two letters of every tag')
+        parser.add_argument('--iterations', type=int, default=20, help='Lookups of each prefix per method')
+        parser.add_argument('--limit', type=int, default=HASHTAG_TOP_K)
+
+    def handle(self, *args, **options):
+        prefixes = options['prefixes']
+        if not prefixes:
+            names = HashTag.objects.values_list('name', flat=True)
+            prefixes = sorted({name[:length] for name in names for length in (1, 2)})
+        if not prefixes:
+            self.stdout.write('No hashtags to search')
+            return
+        iterations, limit = options['iterations'], options['limit']
+
+        started = time.perf_counter()
+        trie = HashtagTrie()
+        trie.build()
+        build_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for prefix in prefixes:
+                list(HashTag.objects.annotate(popularity=Count('posts')).filter(name__startswith=prefix).order_by('-popularity')[:limit].values_list('name', 'popularity'))
+        query_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for prefix in prefixes:
+                trie.search(prefix, limit)
+        trie_time = time.perf_counter() - started
+
+        lookups = iterations * len(prefixes)
+        self.stdout.write(f'{len(prefixes)} prefix(es) x {iterations} iteration(s), top {limit}')
+        self.stdout.write(f'  trie build: {build_time * 1000:.1f} ms')
+        self.stdout.write(f'  query:      {query_time / lookups * 1e6:.1f} us/lookup')
+        self.stdout.write(f'  trie:       {trie_time / lookups * 1e6:.1f} us/lookup')
+        if trie_time > 0:
+            self.stdout.write(self.style.SUCCESS(f'  speedup:    {query_time / trie_time:.0f}x'))
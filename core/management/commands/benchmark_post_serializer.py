@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.fast_serializers import serialize_post_previews
+from core.models import Post, User
+from core.serializers import AugmentedPostPreviewSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares rendering a page of posts through AugmentedPostPreviewSerializer against serialize_post_previews'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--viewer', help='Username of the viewing user, defaults to the first user')
+        parser.add_argument('--page-size', type=int, default=20, help='Posts per page, the newest ones')
+        parser.add_argument('--iterations', type=int, default=50, help='Renders of the page per method')
+        parser.add_argument('--size', help='Image size to render, as the size query parameter')
+
+    def handle(self, *args, **options):
+        if options['viewer'] is not None:
+            viewer = User.objects.filter(username=options['viewer']).first()
+            if viewer is None:
+                raise CommandError(f'No user named {options["viewer"]}')
+        else:
+            viewer = User.objects.order_by('created_at').first()
+        posts = list(Post.objects.order_by('-created_at', '-id')[:options['page_size']])
+        if viewer is None or not posts:
+            self.stdout.write('No posts to render')
+            return
+        iterations = options['iterations']
+        params = {} if options['size'] is None else {'size': options['size']}
+
+        def context():
+            request = APIRequestFactory().get('/api/posts/', params)
+            force_authenticate(request, user=viewer)
+            return {'request': Request(request)}
+
+        renderer = JSONRenderer()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            serializer_json = renderer.render(AugmentedPostPreviewSerializer(posts, many=True, context=context()).data)
+        serializer_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fast_json = renderer.render(serialize_post_previews(posts, context()))
+        fast_time = time.perf_counter() - started
+
+        self.stdout.write(f'{len(posts)} post(s) x {iterations} iteration(s) as {viewer.username}')
+        self.stdout.write(f'  serializer: {serializer_time / iterations * 1000:.2f} ms/page')
+        self.stdout.write(f'  fast:       {fast_time / iterations * 1000:.2f} ms/page')
+        if fast_time > 0:
+            self.stdout.write(f'  speedup:    {serializer_time / fast_time:.1f}x')
+        if fast_json == serializer_json:
+            self.stdout.write(self.style.SUCCESS('  output:     identical'))
+        else:
+            self.stdout.write(self.style.ERROR('  output:     DIFFERENT'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.search_index import SearchIndex, get_snapshot_path
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search index from the database and writes the snapshot loaded by the server processes'
+
+    def handle(self, *args, **options):
+        index = SearchIndex()
+        index.build()
+        path = get_snapshot_path()
+        index.save(path)
+        self.stdout.write(self.style.SUCCESS(f'Indexed {len(index.posts)} post(s) into {path}'))
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.files.storage import storages
+from django.core.management.base import BaseCommand, CommandError
+
+from core.storage import ContentAddressedStorage, delete_unreferenced_blobs, reconcile_blob_references
+
+
+class Command(BaseCommand):
+    help = 'Deletes stored media blobs that no image refers to anymore'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=24, help='Hours a blob is kept after it was last stored')
+        parser.add_argument('--reconcile', action='store_true', help='Recount the references of every blob first')
+
+    def handle(self, *args, **options):
+        storage = storages['default']
+        if not isinstance(storage, ContentAddressedStorage):
+            raise CommandError('The default storage is not a ContentAddressedStorage')
+
+        if options['reconcile']:
+            corrected = reconcile_blob_references()
+            self.stdout.write(f'Corrected the reference counts of {corrected} blob(s)')
+
+        deleted = delete_unreferenced_blobs(storage, timedelta(hours=options['grace']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced blob(s)'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from core.image_processing import VARIANT_SIZES
+from core.images import generate_image_variants
+from core.models import ImageVariant, PostImage, User
+
+
+class Command(BaseCommand):
+    help = 'Generates the missing resized variants of uploaded images (post images, profile images, header photos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Images rendered at a time')
+
+    def handle(self, *args, **options):
+        names = set(PostImage.objects.values_list('image', flat=True))
+        for profile_image, header_photo in User.objects.values_list('profile_image', 'header_photo'):
+            names.update((profile_image, header_photo))
+        names.discard(None)
+        names.discard('')
+
+        # an image is done once it has every size
+        complete = set(
+            ImageVariant.objects.values('source').order_by()
+            .annotate(sizes=Count('size')).filter(sizes=len(VARIANT_SIZES)).values_list('source', flat=True)
+        )
+        names = sorted(names - complete)
+        generated = 0
+        for start in range(0, len(names), options['batch_size']):
+            generated += len(generate_image_variants(names[start:start + options['batch_size']]))
+        self.stdout.write(self.style.SUCCESS(f'Generated {generated} variant(s) of {len(names)} image(s)'))
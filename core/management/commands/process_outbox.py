@@ -0,0 +1,33 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.outbox import process_outbox, purge_outbox
+
+
+class Command(BaseCommand):
+    help = 'Applies the side effects recorded in the outbox (notifications, visits). Runs until stopped unless --once is given'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events applied per transaction')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit')
+        parser.add_argument('--retention', type=float, default=7, help='Days processed events are kept')
+
+    def handle(self, *args, **options):
+        retention = timedelta(days=options['retention'])
+        processed = 0
+        while True:
+            taken = process_outbox(options['batch_size'])
+            processed += taken
+            if taken == options['batch_size']:
+                # a full batch, more events are probably waiting
+                continue
+            purge_outbox(retention)
+            if options['once']:
+                break
+            connection.close()
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} outbox event(s)'))
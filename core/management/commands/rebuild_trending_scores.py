@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.trending import rebuild_trending_scores
+
+
+class Command(BaseCommand):
+    help = 'Recomputes all post trending scores from the post counters, e.g. after changing TRENDING_HALF_LIFE_HOURS'
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_trending_scores()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt trending scores of {rebuilt} post(s)'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import reconcile_follow_counters, reconcile_post_counters
+from core.notifications import reconcile_unread_counts
+
+
+class Command(BaseCommand):
+    help = 'Recomputes denormalized counters from the underlying tables and fixes any drift'
+
+    def handle(self, *args, **options):
+        fixed = reconcile_post_counters()
+        self.stdout.write(self.style.SUCCESS(f'Post counters: fixed {fixed} post(s)'))
+        fixed = reconcile_follow_counters()
+        self.stdout.write(self.style.SUCCESS(f'Follow counters: fixed {fixed} user(s)'))
+        fixed = reconcile_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f'Unread notification counters: fixed {fixed} user(s)'))
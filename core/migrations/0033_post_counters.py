@@ -0,0 +1,60 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_post_counters(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    PostLike = apps.get_model('core', 'PostLike')
+    Bookmark = apps.get_model('core', 'Bookmark')
+    VisitRecord = apps.get_model('core', 'VisitRecord')
+    
+    def count_of(model, field):
+        counts = model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('*')).values('count')
+        return Coalesce(Subquery(counts), Value(0))
+    
+    Post.objects.update(
+        reply_count=count_of(Post, 'reply_parent'),
+        repost_count=count_of(Post, 'repost_parent'),
+        like_count=count_of(PostLike, 'post'),
+        view_count=count_of(VisitRecord, 'post'),
+        bookmark_count=count_of(Bookmark, 'post'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='repost_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='view_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_post_counters, migrations.RunPython.noop),
+    ]
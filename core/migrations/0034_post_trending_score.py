@@ -0,0 +1,39 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:04
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_trending_scores(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    weights = {'like_count': 1.0, 'view_count': 0.2, 'bookmark_count': 1.5, 'reply_count': 2.0, 'repost_count': 2.0}
+    half_life_hours = 24
+    now = timezone.now()
+    
+    posts = []
+    for post in Post.objects.only('id', 'created_at', *weights).iterator():
+        age_hours = (now - post.created_at).total_seconds() / 3600
+        score = (1.0 + sum(weight * getattr(post, field) for field, weight in weights.items())) * 0.5 ** (age_hours / half_life_hours)
+        post.trending_score = score if score > 1e-4 else 0
+        posts.append(post)
+    Post.objects.bulk_update(posts, ['trending_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0033_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='trending_score',
+            field=models.FloatField(default=1.0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-trending_score', '-id'], name='post_trending_idx'),
+        ),
+        migrations.RunPython(backfill_trending_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_conversations(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    parents = dict(Post.objects.values_list('id', 'reply_parent_id'))
+    threads = {}
+    
+    def locate(post_id):
+        # (root id, depth) of a post, walking up iteratively to cope with deep threads
+        chain = []
+        while post_id not in threads and parents.get(post_id) is not None:
+            chain.append(post_id)
+            post_id = parents[post_id]
+        root_id, depth = threads.get(post_id, (post_id, 0))
+        for child_id in reversed(chain):
+            depth += 1
+            threads[child_id] = (root_id, depth)
+        return threads.get(chain[0] if chain else post_id, (root_id, depth))
+    
+    replies = []
+    for post_id, parent_id in parents.items():
+        if parent_id is None:
+            continue
+        root_id, depth = locate(post_id)
+        replies.append(Post(id=post_id, conversation_root_id=root_id, reply_depth=depth))
+    Post.objects.bulk_update(replies, ['conversation_root', 'reply_depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0034_post_trending_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='conversation_root',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='conversation_replies', to='core.post'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='reply_depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['conversation_root', 'reply_depth'], name='post_conversation_idx'),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0035_post_conversation_root'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='visitrecord',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='visitrecord',
+            index=models.Index(fields=['visitor', 'post', '-created_at'], name='visit_visitor_post_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread_counts(apps, schema_editor):
+    User = apps.get_model('core', 'User')
+    Notification = apps.get_model('core', 'Notification')
+    
+    counts = Notification.objects.filter(recipient=OuterRef('pk'), read=False).order_by().values('recipient').annotate(count=Count('*')).values('count')
+    User.objects.update(unread_notification_count=Coalesce(Subquery(counts), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0037_post_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notification_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
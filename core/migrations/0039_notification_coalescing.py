@@ -0,0 +1,86 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_notification_targets(apps, schema_editor):
+    # existing notifications become single-actor aggregates
+    Notification = apps.get_model('core', 'Notification')
+    
+    batch = []
+    notifications = Notification.objects.select_related('like', 'reply', 'repost', 'follow')
+    for notification in notifications.iterator(chunk_size=1000):
+        actor_id = None
+        if notification.type == 'like' and notification.like is not None:
+            notification.target_post_id = notification.like.post_id
+            actor_id = notification.like.user_id
+        elif notification.type == 'repost' and notification.repost is not None:
+            notification.target_post_id = notification.repost.repost_parent_id
+            actor_id = notification.repost.author_id
+        elif notification.type == 'reply' and notification.reply is not None:
+            actor_id = notification.reply.author_id
+        elif notification.type == 'follow' and notification.follow is not None:
+            actor_id = notification.follow.follower_id
+        notification.actors = [str(actor_id)] if actor_id is not None else []
+        notification.window_start = notification.created_at
+        batch.append(notification)
+        if len(batch) == 1000:
+            Notification.objects.bulk_update(batch, ['target_post', 'actors', 'window_start'])
+            batch = []
+    Notification.objects.bulk_update(batch, ['target_post', 'actors', 'window_start'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0038_user_unread_notification_count'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='notification',
+            name='notification_type_check',
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actor_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='actors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='target_post',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='target_notifications', to='core.post'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='window_start',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='follow',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification', to='core.follow'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='like',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification', to='core.postlike'),
+        ),
+        migrations.AlterField(
+            model_name='notification',
+            name='repost',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='repost_notification', to='core.post'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', 'type', 'target_post', '-window_start'], name='notification_coalesce_idx'),
+        ),
+        migrations.RunPython(backfill_notification_targets, migrations.RunPython.noop),
+    ]
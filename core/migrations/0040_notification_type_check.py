@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # separate from 0039 so the constraint is added after the backfill commits
+
+    dependencies = [
+        ('core', '0039_notification_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('type', 'like'), ('target_post__isnull', False)), models.Q(('type', 'reply'), ('reply__isnull', False)), models.Q(('type', 'repost'), ('target_post__isnull', False)), ('type', 'follow'), _connector='OR'), name='notification_type_check'),
+        ),
+    ]
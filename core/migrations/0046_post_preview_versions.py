@@ -0,0 +1,24 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:43
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0045_user_follow_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='profile_changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
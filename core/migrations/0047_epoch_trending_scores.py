@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:20
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import F, Value
+from django.db.models.functions import Greatest, Log, Power
+from django.utils import timezone
+
+# core.trending.TRENDING_EPOCH
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# the old decay flushed scores below this to zero
+MIN_SCORE = 1e-4
+
+
+def half_lives_since_epoch() -> float:
+    return (timezone.now() - TRENDING_EPOCH) / timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24))
+
+
+def to_epoch_scores(apps, schema_editor):
+    # the stored scores were decayed up to now
+    Post = apps.get_model('core', 'Post')
+    Post.objects.update(trending_score=Log(Value(2.0), Greatest(F('trending_score'), Value(MIN_SCORE))) + Value(half_lives_since_epoch()))
+
+
+def to_decayed_scores(apps, schema_editor):
+    Post = apps.get_model('core', 'Post')
+    Post.objects.update(trending_score=Power(Value(2.0), F('trending_score') - Value(half_lives_since_epoch())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0046_post_preview_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_epoch_scores, to_decayed_scores),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+SOURCE_KEYS = {'like': 'like_id', 'reply': 'post_id', 'repost': 'post_id', 'follow': 'follow_id'}
+
+
+def backfill_notified_events(apps, schema_editor):
+    OutboxEvent = apps.get_model('core', 'OutboxEvent')
+    NotifiedEvent = apps.get_model('core', 'NotifiedEvent')
+    
+    # the events already applied by the worker, whichever produced a notification
+    notified = {
+        (event.type, event.payload[SOURCE_KEYS[event.type]])
+        for event in OutboxEvent.objects.filter(processed_at__isnull=False).only('type', 'payload').iterator()
+        if SOURCE_KEYS.get(event.type) in event.payload
+    }
+    NotifiedEvent.objects.bulk_create(
+        [NotifiedEvent(type=type, source_id=source_id) for type, source_id in notified],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0047_epoch_trending_scores'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotifiedEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=20)),
+                ('source_id', models.UUIDField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at'], name='notified_event_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='notifiedevent',
+            constraint=models.UniqueConstraint(fields=('type', 'source_id'), name='unique_notified_event'),
+        ),
+        migrations.RunPython(backfill_notified_events, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,15 @@
 from django.db import models
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MinLengthValidator
+from django.utils import timezone
 import uuid
 import datetime
 
+# the User fields an author card shows, besides the follow counts
+PROFILE_FIELDS = ('username', 'email', 'name', 'date_of_birth', 'profile_image', 'bio', 'location', 'website', 'header_photo')
+
+
 # Create your models here.
 class User(AbstractUser):
     id  = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
@@ -18,6 +24,14 @@ class User(AbstractUser):
     location = models.CharField(max_length=50, blank=True, null=True)
     header_photo = models.ImageField(upload_to='header_photos/', blank=True, null=True)
     website = models.URLField(max_length=100, blank=True, null=True)
+    unread_notification_count = models.PositiveIntegerField(default=0)
+    # denormalized Follow counts, maintained by core.counters
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # embedded in issued tokens, bumping it revokes them (see core.authentication)
+    token_version = models.PositiveIntegerField(default=0)
+    # last change to what the author card of a post preview shows, versions its cached fragment (see core.fragments)
+    profile_changed_at = models.DateTimeField(default=timezone.now)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -25,6 +39,30 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
     
+    def set_password(self, raw_password):
+        super().set_password(raw_password)
+        if not self._state.adding:
+            self.token_version += 1
+    
+    def check_password(self, raw_password):
+        def rehash(raw_password):
+            # the same password with a newer hasher, issued tokens stay valid
+            AbstractUser.set_password(self, raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return check_password(raw_password, self.password, rehash)
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'password' in update_fields:
+            # the version set_password bumped is written with the password
+            update_fields = kwargs['update_fields'] = {*update_fields, 'token_version'}
+        if update_fields is None or set(update_fields) & set(PROFILE_FIELDS):
+            self.profile_changed_at = timezone.now()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'profile_changed_at'}
+        super().save(*args, **kwargs)
+    
 
 class Post(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
@@ -33,12 +71,39 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     reply_parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
     repost_parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='reposts')
+    # top-most post of the reply thread (null for the root itself) and distance from it, see core.threads
+    conversation_root = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='conversation_replies')
+    reply_depth = models.PositiveIntegerField(default=0)
+    # denormalized engagement counters, maintained by core.counters
+    reply_count = models.PositiveIntegerField(default=0)
+    repost_count = models.PositiveIntegerField(default=0)
+    like_count = models.PositiveIntegerField(default=0)
+    view_count = models.PositiveIntegerField(default=0)
+    bookmark_count = models.PositiveIntegerField(default=0)
+    # time-decayed engagement score relative to a fixed epoch, set on creation
+    # (see core.signals) and maintained by core.counters and core.trending
+    trending_score = models.FloatField(default=1.0)
+    # last change to the content or images, versions the cached preview fragment (see core.fragments)
+    changed_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-trending_score', '-id'], name='post_trending_idx'),
+            models.Index(fields=['conversation_root', 'reply_depth'], name='post_conversation_idx'),
+            models.Index(fields=['-created_at', '-id'], name='post_created_idx'),
+        ]
         
     def __str__(self):
         return self.content[:20].replace('\n', ' ')
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.changed_at = timezone.now()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'changed_at'}
+        super().save(*args, **kwargs)
 
 
 class PostImage(models.Model):
@@ -50,6 +115,40 @@ class PostImage(models.Model):
         return str(self.image)
     
     
+class MediaBlob(models.Model):
+    # a stored file of core.storage.ContentAddressedStorage and the number of
+    # image fields naming it
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    stored_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['stored_at'], condition=models.Q(ref_count=0), name='media_blob_unreferenced_idx'),
+        ]
+    
+    def __str__(self):
+        return self.name
+    
+    
+class ImageVariant(models.Model):
+    # resized WebP copy of an uploaded image, see core.images
+    source = models.CharField(max_length=255)
+    size = models.CharField(max_length=10)
+    file = models.ImageField(upload_to='image_variants/', max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'size'], name='unique_image_variant')
+        ]
+    
+    def __str__(self):
+        return str(self.file)
+    
+    
 class PostLike(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='likes')
@@ -109,17 +208,27 @@ class Notification(models.Model):
         ('follow', 'follow'),
         ('repost', 'repost')
     ])
-    like = models.ForeignKey(PostLike, on_delete=models.CASCADE, related_name='notification', null=True, blank=True)
+    like = models.ForeignKey(PostLike, on_delete=models.SET_NULL, related_name='notification', null=True, blank=True)
     reply = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='reply_notification', null=True, blank=True)
-    repost = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='repost_notification', null=True, blank=True)
-    follow = models.ForeignKey(Follow, on_delete=models.CASCADE, related_name='notification', null=True, blank=True)
+    repost = models.ForeignKey(Post, on_delete=models.SET_NULL, related_name='repost_notification', null=True, blank=True)
+    follow = models.ForeignKey(Follow, on_delete=models.SET_NULL, related_name='notification', null=True, blank=True)
+    # likes, reposts and follows on the same target within a time window are
+    # coalesced into one row; like/repost/follow point at the latest event
+    target_post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='target_notifications', null=True, blank=True)
+    actor_count = models.PositiveIntegerField(default=1)
+    actors = models.JSONField(default=list, blank=True)
+    window_start = models.DateTimeField(default=timezone.now)
     read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # the time of the event, which the outbox worker may apply later
+    created_at = models.DateTimeField(default=timezone.now)
     
     
     class Meta:
         constraints = [
-            models.CheckConstraint(check=(models.Q(type='like') & models.Q(like__isnull=False)) | (models.Q(type='reply') & models.Q(reply__isnull=False)) | (models.Q(type='repost') & models.Q(repost__isnull=False)) | (models.Q(type='follow') & models.Q(follow__isnull=False)), name='notification_type_check') 
+            models.CheckConstraint(check=(models.Q(type='like') & models.Q(target_post__isnull=False)) | (models.Q(type='reply') & models.Q(reply__isnull=False)) | (models.Q(type='repost') & models.Q(target_post__isnull=False)) | models.Q(type='follow'), name='notification_type_check') 
+        ]
+        indexes = [
+            models.Index(fields=['recipient', 'type', 'target_post', '-window_start'], name='notification_coalesce_idx'),
         ]
         ordering = ['-created_at']
         
@@ -127,7 +236,13 @@ class Notification(models.Model):
 class VisitRecord(models.Model):
     visitor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='visits')
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='visits')
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set explicitly by core.visits, which writes buffered visits some time after they happened
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['visitor', 'post', '-created_at'], name='visit_visitor_post_idx')
+        ]
     
 class Visitor(models.Model):
     visitorId = models.TextField(blank=False, null=False, unique=True)
@@ -142,4 +257,72 @@ class Log(models.Model):
         ordering = ['-created_at']
         
     def __str__(self):
-        return self.message[:20].replace('\n', ' ')
\ No newline at end of file
+        return self.message[:20].replace('\n', ' ')
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # copied from post.created_at so a feed page never has to touch the post table to sort
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry')
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at'], name='timeline_owner_created_idx')
+        ]
+        ordering = ['-created_at']
+        
+    def __str__(self):
+        return f'{self.post} in timeline of {self.owner}'
+
+
+class OutboxEvent(models.Model):
+    # side effects of an interaction, committed with it and applied by the
+    # process_outbox worker
+    type = models.CharField(max_length=20, choices=[
+        ('like', 'like'),
+        ('reply', 'reply'),
+        ('repost', 'repost'),
+        ('follow', 'follow')
+    ])
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(processed_at__isnull=True), name='outbox_pending_idx'),
+        ]
+
+
+class NotifiedEvent(models.Model):
+    # the likes, replies, reposts and follows the outbox worker has notified,
+    # so an event applied twice is not counted twice in a coalesced row
+    type = models.CharField(max_length=20)
+    source_id = models.UUIDField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['type', 'source_id'], name='unique_notified_event')
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='notified_event_created_idx')
+        ]
+
+
+class StreamTicket(models.Model):
+    # single-use key an EventSource opens the event stream with, since it
+    # cannot send the access token in a header (see core.views.event_views)
+    key = models.CharField(max_length=64, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stream_tickets')
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='stream_ticket_expires_idx')
+        ]
@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+from uuid import UUID
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Notification, Post, PostLike, Follow, User
+from .events import publish_event
+
+# Every user carries the number of their unread notifications so the badge
+# polled by clients is a single-row read instead of a COUNT(*). Notifications
+# are created and marked read through the helpers below, which adjust the
+# counter in the same transaction. Notifications removed by a cascade (unlike,
+# unfollow, post delete) have the counter of their recipients recomputed.
+# Every change of a counter is pushed to the user's open event streams.
+#
+# Likes, reposts and follows are coalesced: an event joins the latest
+# notification of the same type on the same target whose window (starting at
+# its first event) still covers it, so a popular post produces one row per
+# window carrying the number of actors and a small sample of them. The event
+# tables stay the source of truth; retracting an event recomputes its row.
+
+COALESCED_TYPES = ('like', 'repost', 'follow')
+
+
+def get_coalesce_window() -> timedelta:
+    return timedelta(hours=getattr(settings, 'NOTIFICATION_COALESCE_WINDOW_HOURS', 24))
+
+
+def get_actor_sample_size() -> int:
+    return getattr(settings, 'NOTIFICATION_ACTOR_SAMPLE_SIZE', 3)
+
+
+def _event_of(type: str, event):
+    """The actor, target post and creation time of a like, repost or follow."""
+    if type == 'like':
+        return event.user_id, event.post_id, event.created_at
+    if type == 'repost':
+        return event.author_id, event.repost_parent_id, event.created_at
+    return event.follower_id, None, event.created_at
+
+
+def _events(type: str, recipient_id: UUID, target_post_id: Optional[UUID]):
+    if type == 'like':
+        return PostLike.objects.filter(post_id=target_post_id).exclude(user_id=recipient_id), 'user_id'
+    if type == 'repost':
+        return Post.objects.filter(repost_parent_id=target_post_id).exclude(author_id=recipient_id), 'author_id'
+    return Follow.objects.filter(following_id=recipient_id), 'follower_id'
+
+
+def _aggregates(type: str, recipient_id: UUID, target_post_id: Optional[UUID], at: datetime):
+    return Notification.objects.filter(
+        recipient_id=recipient_id, type=type, target_post_id=target_post_id,
+        window_start__gte=at - get_coalesce_window(), window_start__lte=at,
+    ).order_by('-window_start')
+
+
+def _increment_unread(user_id: UUID):
+    User.objects.filter(id=user_id).update(unread_notification_count=F('unread_notification_count') + 1)
+    publish_unread_counts([user_id])
+
+
+def publish_unread_counts(user_ids: Iterable[UUID]):
+    for user_id, count in User.objects.filter(id__in=user_ids).values_list('id', 'unread_notification_count'):
+        publish_event([user_id], 'unread_count', count=count)
+
+
+def notify(type: str, recipient_id: UUID, event) -> Notification:
+    """
+    Notifies `recipient_id` of `event`: the reply Post of a reply, or the
+    PostLike, repost Post or Follow of a coalesced notification.
+    """
+    if type not in COALESCED_TYPES:
+        with transaction.atomic():
+            notification = Notification.objects.create(
+                recipient_id=recipient_id, type=type, reply=event,
+                actors=[str(event.author_id)], created_at=event.created_at,
+            )
+            _increment_unread(recipient_id)
+        return notification
+    
+    actor_id, target_post_id, created_at = _event_of(type, event)
+    with transaction.atomic():
+        notification = _aggregates(type, recipient_id, target_post_id, created_at).select_for_update().first()
+        if notification is None:
+            notification = Notification.objects.create(
+                recipient_id=recipient_id, type=type, target_post_id=target_post_id,
+                actors=[str(actor_id)], window_start=created_at, created_at=created_at, **{type: event},
+            )
+            _increment_unread(recipient_id)
+            return notification
+        
+        was_read = notification.read
+        actors = [str(actor_id)] + [actor for actor in notification.actors if actor != str(actor_id)]
+        notification.actors = actors[:get_actor_sample_size()]
+        notification.actor_count += 1
+        setattr(notification, type, event)
+        notification.read = False
+        notification.created_at = created_at
+        notification.save(update_fields=['actors', 'actor_count', type, 'read', 'created_at'])
+        if was_read:
+            _increment_unread(recipient_id)
+    return notification
+
+
+def retract_notification(type: str, recipient_id: UUID, created_at: datetime, target_post_id: Optional[UUID] = None):
+    """
+    Called after a like, repost or follow created at `created_at` is deleted:
+    recomputes the notification it was coalesced into from the remaining
+    events and deletes it when none are left.
+    """
+    with transaction.atomic():
+        notification = _aggregates(type, recipient_id, target_post_id, created_at).select_for_update().first()
+        if notification is None:
+            return
+        
+        events, actor_field = _events(type, recipient_id, target_post_id)
+        events = events.filter(
+            created_at__gte=notification.window_start,
+            created_at__lte=notification.window_start + get_coalesce_window(),
+        ).order_by('-created_at')
+        actor_count = events.count()
+        if actor_count == 0:
+            notification.delete()
+            if not notification.read:
+                refresh_unread_counts([recipient_id])
+            return
+        
+        latest = list(events[:get_actor_sample_size()])
+        notification.actor_count = actor_count
+        notification.actors = [str(getattr(event, actor_field)) for event in latest]
+        setattr(notification, type, latest[0])
+        notification.created_at = latest[0].created_at
+        notification.save(update_fields=['actor_count', 'actors', type, 'created_at'])
+
+
+def mark_notifications_read(user: User, notifications) -> int:
+    """Marks the unread notifications of `user` in `notifications` read, returns how many changed."""
+    with transaction.atomic():
+        marked = notifications.filter(recipient=user, read=False).update(read=True)
+        if marked:
+            User.objects.filter(id=user.id).update(unread_notification_count=Greatest(F('unread_notification_count') - marked, Value(0)))
+            publish_unread_counts([user.id])
+    return marked
+
+
+def delete_notifications(user: User, notifications) -> int:
+    """Deletes the notifications of `user` in `notifications`, returns how many were deleted."""
+    with transaction.atomic():
+        deleted, _ = notifications.filter(recipient=user).delete()
+        if deleted:
+            refresh_unread_counts([user.id])
+    return deleted
+
+
+def get_unread_count(user: User) -> int:
+    return User.objects.filter(id=user.id).values_list('unread_notification_count', flat=True).first() or 0
+
+
+def _unread_count_subquery():
+    counts = Notification.objects.filter(recipient=OuterRef('pk'), read=False).order_by().values('recipient').annotate(count=Count('*')).values('count')
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def refresh_unread_counts(user_ids: Iterable[UUID]):
+    user_ids = set(user_ids)
+    if user_ids:
+        User.objects.filter(id__in=user_ids).update(unread_notification_count=_unread_count_subquery())
+        publish_unread_counts(user_ids)
+
+
+def post_notification_recipients(post: Post) -> List[UUID]:
+    """
+    Recipients of the notifications that deleting `post` can cascade to: those
+    about the post, its reposts and the posts of its conversation. Read it
+    before the delete and refresh their counters afterwards.
+    """
+    root_id = post.conversation_root_id or post.id
+    posts = Post.objects.filter(Q(id=post.id) | Q(repost_parent=post) | Q(id=root_id) | Q(conversation_root_id=root_id)).values('id')
+    return list(Notification.objects.filter(
+        Q(reply__in=posts) | Q(target_post__in=posts)
+    ).values_list('recipient_id', flat=True).distinct())
+
+
+def reconcile_unread_counts() -> int:
+    """Recomputes the unread counter of every user, returns the number of users fixed."""
+    return User.objects.annotate(expected=_unread_count_subquery()) \
+        .exclude(unread_notification_count=F('expected')) \
+        .update(unread_notification_count=_unread_count_subquery())
@@ -0,0 +1,130 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Follow, NotifiedEvent, OutboxEvent, Post, PostLike
+from .notifications import notify
+from .visits import write_visits
+
+# Side effects of likes, replies, reposts and follows (the notification of the
+# other user and the visit of the post) are not applied by the request. The
+# request writes an OutboxEvent in the transaction that writes the like, post
+# or follow, and the process_outbox worker applies the pending events in
+# batches. An event is marked processed in the transaction that applies it, so
+# an event whose batch fails or whose worker dies is simply picked up again;
+# the handlers read the current rows and do nothing for events that were
+# undone (unlike, unfollow, post delete) before they were processed. Each
+# notified event is recorded as a NotifiedEvent in the savepoint that
+# notifies it, so an event applied again (a duplicate, or a replay after the
+# notification was coalesced with later ones) is not counted twice.
+
+logger = logging.getLogger(__name__)
+
+
+def get_max_attempts() -> int:
+    return getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+
+
+def enqueue(type: str, **payload) -> OutboxEvent:
+    """Records `type` with `payload` for the worker; call inside the transaction writing the event."""
+    return OutboxEvent.objects.create(type=type, payload={key: str(value) for key, value in payload.items()})
+
+
+def _first_notification(type: str, source_id) -> bool:
+    """Records that the `type` event `source_id` is notified, False if it already was."""
+    _, created = NotifiedEvent.objects.get_or_create(type=type, source_id=source_id)
+    return created
+
+
+def _like(payload: dict):
+    like = PostLike.objects.select_related('post').filter(id=payload['like_id']).first()
+    if like is None:
+        return None
+    if like.post.author_id != like.user_id and _first_notification('like', like.id):
+        notify('like', like.post.author_id, like)
+    return like.user_id, like.post_id, like.created_at
+
+
+def _reply(payload: dict):
+    post = Post.objects.select_related('reply_parent').filter(id=payload['post_id']).first()
+    if post is None or post.reply_parent is None:
+        return None
+    if post.reply_parent.author_id != post.author_id and _first_notification('reply', post.id):
+        notify('reply', post.reply_parent.author_id, post)
+    return post.author_id, post.reply_parent_id, post.created_at
+
+
+def _repost(payload: dict):
+    post = Post.objects.select_related('repost_parent').filter(id=payload['post_id']).first()
+    if post is None or post.repost_parent is None:
+        return None
+    if post.repost_parent.author_id != post.author_id and _first_notification('repost', post.id):
+        notify('repost', post.repost_parent.author_id, post)
+    return post.author_id, post.repost_parent_id, post.created_at
+
+
+def _follow(payload: dict):
+    follow = Follow.objects.filter(id=payload['follow_id']).first()
+    if follow is not None and _first_notification('follow', follow.id):
+        notify('follow', follow.following_id, follow)
+    return None
+
+
+HANDLERS = {
+    'like': _like,
+    'reply': _reply,
+    'repost': _repost,
+    'follow': _follow,
+}
+
+
+def process_outbox(batch_size: int = 100) -> int:
+    """
+    Applies up to `batch_size` pending events, oldest first. Several workers
+    may run at once, each locks the events it takes. Returns the number of
+    events taken.
+    """
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.filter(processed_at__isnull=True, attempts__lt=get_max_attempts())
+            .order_by('id').select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not events:
+            return 0
+
+        visits = {}
+        processed = []
+        failed = []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    visit = HANDLERS[event.type](event.payload)
+            except Exception as error:
+                logger.exception('Failed to process outbox event %s', event.id)
+                event.attempts += 1
+                event.last_error = repr(error)
+                failed.append(event)
+                continue
+            if visit is not None:
+                visitor_id, post_id, visited_at = visit
+                visits.setdefault((visitor_id, post_id, visited_at.date()), visited_at)
+            event.attempts += 1
+            event.processed_at = timezone.now()
+            processed.append(event)
+
+        if visits:
+            write_visits(visits)
+        OutboxEvent.objects.bulk_update(processed, ['attempts', 'processed_at'])
+        OutboxEvent.objects.bulk_update(failed, ['attempts', 'last_error'])
+    return len(events)
+
+
+def purge_outbox(older_than: timedelta) -> int:
+    cutoff = timezone.now() - older_than
+    deleted, _ = OutboxEvent.objects.filter(processed_at__lt=cutoff).delete()
+    # the events recorded before then were processed before then, and purged
+    NotifiedEvent.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,194 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from uuid import UUID
+from typing import Callable, Optional, Sequence
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
+
+DEFAULT_ORDERING = ('-created_at', '-id')
+
+
+class CursorPage:
+    def __init__(self, object_list, per_page: int, next_cursor: Optional[str], previous_cursor: Optional[str]):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class CursorPaginator:
+    """
+    Keyset paginator. Pages are addressed by an opaque cursor holding the
+    ordering values of the row next to the page boundary, so fetching a page
+    is an index range scan that costs the same at any depth and never runs a
+    COUNT(*).
+
+    The last field of `ordering` must be unique so every row has a distinct key.
+    Besides querysets it accepts a list already sorted by `ordering`, e.g. ids
+    coming from an in-memory index, whose items expose the ordering fields as
+    attributes; pass the `model` they come from so cursor values are checked
+    against its field types.
+    """
+
+    def __init__(self, queryset, per_page: int, ordering: Sequence[str] = DEFAULT_ORDERING, model=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.descending = [field.startswith('-') for field in self.ordering]
+        model = model if model is not None else getattr(queryset, 'model', None)
+        self.model_fields = None if model is None else [self._model_field(model, field) for field in self.fields]
+
+    @staticmethod
+    def _model_field(model, path: str):
+        *relations, name = path.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def page(self, cursor: Optional[str]) -> CursorPage:
+        values, backwards = self.decode_cursor(cursor) if cursor else (None, False)
+        if isinstance(self.queryset, (list, tuple)):
+            rows = self._sequence_rows(values, backwards)
+        else:
+            rows = self._queryset_rows(values, backwards)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = self.encode_cursor(self._values(rows[-1]), False) if has_next and rows else None
+        previous_cursor = self.encode_cursor(self._values(rows[0]), True) if has_previous and rows else None
+        return CursorPage(rows, self.per_page, next_cursor, previous_cursor)
+
+    def _queryset_rows(self, values, backwards: bool):
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._boundary(values, backwards))
+        ordering = self._reverse_ordering() if backwards else self.ordering
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def _sequence_rows(self, values, backwards: bool):
+        sequence = reversed(self.queryset) if backwards else self.queryset
+        rows = []
+        for row in sequence:
+            if values is None or self._is_past(self._values(row), values, backwards):
+                rows.append(row)
+                if len(rows) > self.per_page:
+                    break
+        return rows
+
+    def _is_past(self, row_values, values, backwards: bool) -> bool:
+        for i, (row_value, value) in enumerate(zip(row_values, values)):
+            if row_value != value:
+                return (row_value < value) == (self.descending[i] != backwards)
+        return False
+
+    def up_to(self, cursor: str) -> Q:
+        """Filter for the rows from the start of the ordering through the row the cursor points at."""
+        values, _ = self.decode_cursor(cursor)
+        return self._boundary(values, True) | Q(**dict(zip(self.fields, values)))
+
+    def _reverse_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else '-' + field for field in self.ordering)
+
+    def _boundary(self, values, backwards: bool) -> Q:
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), with the leading
+        # column also bounded on its own so the planner can use the index range
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            op = 'lt' if self.descending[i] != backwards else 'gt'
+            term = Q(**{f'{field}__{op}': values[i]})
+            for j in range(i):
+                term &= Q(**{self.fields[j]: values[j]})
+            condition |= term
+        op = 'lte' if self.descending[0] != backwards else 'gte'
+        return Q(**{f'{self.fields[0]}__{op}': values[0]}) & condition
+
+    def _values(self, obj):
+        values = []
+        for field in self.fields:
+            value = obj
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def encode_cursor(values, backwards: bool) -> str:
+        encoded = []
+        for value in values:
+            if isinstance(value, datetime):
+                encoded.append(['dt', value.isoformat()])
+            elif isinstance(value, UUID):
+                encoded.append(['uuid', str(value)])
+            else:
+                encoded.append(['v', value])
+        payload = json.dumps({'k': encoded, 'b': backwards}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: str):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            values = []
+            for kind, value in payload['k']:
+                if kind == 'dt':
+                    values.append(datetime.fromisoformat(value))
+                elif kind == 'uuid':
+                    values.append(UUID(value))
+                else:
+                    values.append(value)
+            if len(values) != len(self.fields):
+                raise ValueError('cursor does not match ordering')
+            if self.model_fields is not None:
+                values = [field.to_python(value) for field, value in zip(self.model_fields, values)]
+            if any(isinstance(value, datetime) and value.utcoffset() is None for value in values):
+                raise ValueError('cursor datetimes carry their offset')
+            return values, bool(payload['b'])
+        except (ValueError, TypeError, KeyError, binascii.Error, ValidationError):
+            raise ParseError('Invalid cursor')
+
+
+def paginate(request: Request, queryset, per_page: int, ordering: Sequence[str] = DEFAULT_ORDERING, transform: Optional[Callable] = None,
+             model=None):
+    """
+    Returns a keyset page when the client sends `cursor` (empty for the first
+    page) and a numbered `page` otherwise, so existing clients keep working
+    while they migrate. `transform` maps each row of the page to the object
+    that gets serialized, e.g. a Follow row to the follower. `model` is the
+    model of the items of a list, see CursorPaginator.
+    """
+    if 'cursor' in request.query_params:
+        current_page = CursorPaginator(queryset, per_page, ordering, model).page(request.query_params['cursor'])
+    else:
+        if not isinstance(queryset, (list, tuple)):
+            queryset = queryset.order_by(*ordering)
+        paginator = Paginator(queryset, per_page)
+        current_page = paginator.get_page(request.query_params.get('page', 1))
+
+    if transform is not None:
+        current_page.object_list = [transform(row) for row in current_page.object_list]
+    return current_page
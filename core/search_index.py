@@ -0,0 +1,290 @@
+import bisect
+import logging
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Iterable, List, Optional, Set
+from uuid import UUID
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Post, User
+from .utils import tokenize
+
+# In-process inverted index over post content and author names. A query
+# matches a post when every query term is a prefix of some word of its content,
+# or of its author's name / username. Each worker keeps its own copy: it starts
+# from the on-disk snapshot written by the build_search_index command and is
+# updated directly by the writes it serves. Changes made by other workers are
+# polled for: posts newer than the newest one seen, posts whose changed_at and
+# authors whose profile_changed_at moved since the previous poll, and every
+# SEARCH_INDEX_RECONCILE_INTERVAL seconds the full list of post ids, which
+# drops deleted posts and adds any the incremental polls missed.
+
+SNAPSHOT_VERSION = 2
+# rows are polled again for this long, a change can commit after its timestamp
+CHANGE_POLL_OVERLAP = timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+SearchHit = namedtuple('SearchHit', ['id', 'created_at'])
+
+
+class SearchIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.postings = {}
+        self.author_postings = {}
+        self.author_posts = {}
+        self.posts = {}
+        self.authors = {}
+        self.vocabulary = []
+        self.author_vocabulary = []
+        self.high_water_mark = None
+        self.last_catch_up = 0.0
+        self.changes_polled_at = None
+        self.last_reconcile = None
+
+    # -- updates --------------------------------------------------------------
+
+    def add_post(self, post_id: UUID, author_id: UUID, content: str, created_at: datetime):
+        with self.lock:
+            if post_id in self.posts:
+                self.remove_post(post_id)
+            tokens = tuple(set(tokenize(content)))
+            self.posts[post_id] = (created_at, author_id, tokens)
+            for token in tokens:
+                self._add_posting(self.postings, self.vocabulary, token, post_id)
+            self.author_posts.setdefault(author_id, set()).add(post_id)
+            if self.high_water_mark is None or created_at > self.high_water_mark:
+                self.high_water_mark = created_at
+
+    def remove_post(self, post_id: UUID):
+        with self.lock:
+            entry = self.posts.pop(post_id, None)
+            if entry is None:
+                return
+            _, author_id, tokens = entry
+            for token in tokens:
+                self._remove_posting(self.postings, self.vocabulary, token, post_id)
+            self.author_posts.get(author_id, set()).discard(post_id)
+
+    def set_author(self, author_id: UUID, name: str, username: str):
+        with self.lock:
+            for token in self.authors.pop(author_id, ()):
+                self._remove_posting(self.author_postings, self.author_vocabulary, token, author_id)
+            tokens = tuple(set(tokenize(name) + tokenize(username)))
+            self.authors[author_id] = tokens
+            for token in tokens:
+                self._add_posting(self.author_postings, self.author_vocabulary, token, author_id)
+
+    def index_post(self, post: Post):
+        self.set_author(post.author_id, post.author.name, post.author.username)
+        self.add_post(post.id, post.author_id, post.content, post.created_at)
+
+    @staticmethod
+    def _add_posting(postings: dict, vocabulary: list, token: str, item_id: UUID):
+        if token not in postings:
+            postings[token] = set()
+            bisect.insort(vocabulary, token)
+        postings[token].add(item_id)
+
+    @staticmethod
+    def _remove_posting(postings: dict, vocabulary: list, token: str, item_id: UUID):
+        items = postings.get(token)
+        if items is None:
+            return
+        items.discard(item_id)
+        if not items:
+            del postings[token]
+            vocabulary.pop(bisect.bisect_left(vocabulary, token))
+
+    # -- queries --------------------------------------------------------------
+
+    @staticmethod
+    def _prefix_matches(postings: dict, vocabulary: list, prefix: str) -> Set[UUID]:
+        matches = set()
+        i = bisect.bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            matches |= postings[vocabulary[i]]
+            i += 1
+        return matches
+
+    def _match_all(self, postings: dict, vocabulary: list, terms: List[str]) -> Set[UUID]:
+        matches = None
+        for term in sorted(terms, key=len, reverse=True):
+            term_matches = self._prefix_matches(postings, vocabulary, term)
+            matches = term_matches if matches is None else matches & term_matches
+            if not matches:
+                return set()
+        return matches
+
+    def search(self, query: str, before: Optional[datetime] = None) -> List[SearchHit]:
+        """Matching posts, newest first, as (id, created_at) pairs."""
+        terms = list(set(tokenize(query)))
+        if not terms:
+            return []
+        with self.lock:
+            post_ids = self._match_all(self.postings, self.vocabulary, terms)
+            for author_id in self._match_all(self.author_postings, self.author_vocabulary, terms):
+                post_ids |= self.author_posts.get(author_id, set())
+            hits = [SearchHit(post_id, self.posts[post_id][0]) for post_id in post_ids]
+        if before is not None:
+            if before.tzinfo is None:
+                before = before.replace(tzinfo=dt_timezone.utc)
+            hits = [hit for hit in hits if hit.created_at <= before]
+        hits.sort(key=lambda hit: (hit.created_at, hit.id), reverse=True)
+        return hits
+
+    # -- loading --------------------------------------------------------------
+
+    def load_posts(self, posts: Iterable[dict]):
+        for row in posts:
+            self.set_author(row['author_id'], row['author__name'], row['author__username'])
+            self.add_post(row['id'], row['author_id'], row['content'], row['created_at'])
+
+    def build(self):
+        self.changes_polled_at = timezone.now()
+        self.last_reconcile = time.monotonic()
+        self.load_posts(_post_rows(Post.objects.all()))
+
+    def catch_up(self, min_interval: float = 1.0):
+        now = time.monotonic()
+        if now - self.last_catch_up < min_interval:
+            return
+        self.last_catch_up = now
+        if self.last_reconcile is None or now - self.last_reconcile > getattr(settings, 'SEARCH_INDEX_RECONCILE_INTERVAL', 300):
+            self.last_reconcile = now
+            self.reconcile()
+
+        polled_at = timezone.now()
+        posts = Q()
+        if self.high_water_mark is not None:
+            posts = Q(created_at__gt=self.high_water_mark)
+        if self.changes_polled_at is not None:
+            since = self.changes_polled_at - CHANGE_POLL_OVERLAP
+            posts |= Q(changed_at__gt=since)
+            users = list(User.objects.filter(profile_changed_at__gt=since).values_list('id', 'name', 'username'))
+            with self.lock:
+                renamed = [row for row in users if row[0] in self.authors]
+            for author_id, name, username in renamed:
+                self.set_author(author_id, name, username)
+        self.load_posts(_post_rows(Post.objects.filter(posts)))
+        self.changes_polled_at = polled_at
+
+    def reconcile(self):
+        """Drops the posts deleted since they were indexed and adds the ones missing."""
+        post_ids = set(Post.objects.values_list('id', flat=True).iterator())
+        with self.lock:
+            deleted = self.posts.keys() - post_ids
+            missing = post_ids - self.posts.keys()
+        for post_id in deleted:
+            self.remove_post(post_id)
+        if missing:
+            self.load_posts(_post_rows(Post.objects.filter(id__in=missing)))
+
+    def dumps(self) -> bytes:
+        with self.lock:
+            state = {
+                'version': SNAPSHOT_VERSION,
+                'changes_polled_at': self.changes_polled_at.timestamp() if self.changes_polled_at is not None else None,
+                'posts': [(post_id.bytes, created_at.timestamp(), author_id.bytes, tokens) for post_id, (created_at, author_id, tokens) in self.posts.items()],
+                'authors': [(author_id.bytes, tokens) for author_id, tokens in self.authors.items()],
+            }
+        return zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @classmethod
+    def loads(cls, data: bytes) -> 'SearchIndex':
+        state = pickle.loads(zlib.decompress(data))
+        if state.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported search index snapshot')
+        index = cls()
+        if state['changes_polled_at'] is not None:
+            index.changes_polled_at = datetime.fromtimestamp(state['changes_polled_at'], tz=dt_timezone.utc)
+        for author_id, tokens in state['authors']:
+            author_id = UUID(bytes=author_id)
+            index.authors[author_id] = tokens
+            for token in tokens:
+                index.author_postings.setdefault(token, set()).add(author_id)
+        for post_id, timestamp, author_id, tokens in state['posts']:
+            post_id, author_id = UUID(bytes=post_id), UUID(bytes=author_id)
+            created_at = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+            index.posts[post_id] = (created_at, author_id, tokens)
+            index.author_posts.setdefault(author_id, set()).add(post_id)
+            for token in tokens:
+                index.postings.setdefault(token, set()).add(post_id)
+            if index.high_water_mark is None or created_at > index.high_water_mark:
+                index.high_water_mark = created_at
+        index.vocabulary = sorted(index.postings)
+        index.author_vocabulary = sorted(index.author_postings)
+        return index
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.dumps())
+        os.replace(tmp_path, path)
+
+
+def _post_rows(posts):
+    return posts.values('id', 'content', 'created_at', 'author_id', 'author__name', 'author__username').iterator()
+
+
+def get_top_candidate_limit() -> int:
+    # top search ranks only the newest matches, so a common term does not read
+    # the counters of every post that contains it
+    return getattr(settings, 'SEARCH_TOP_CANDIDATES', 1000)
+
+
+def get_snapshot_path() -> str:
+    return str(getattr(settings, 'SEARCH_INDEX_PATH', settings.BASE_DIR / 'var' / 'search_index.bin'))
+
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    global _search_index
+    if _search_index is None:
+        with _search_index_lock:
+            if _search_index is None:
+                index = None
+                path = get_snapshot_path()
+                if os.path.exists(path):
+                    try:
+                        with open(path, 'rb') as f:
+                            index = SearchIndex.loads(f.read())
+                    except Exception:
+                        logger.exception('Could not load search index snapshot, rebuilding')
+                if index is None:
+                    index = SearchIndex()
+                    index.build()
+                _search_index = index
+    _search_index.catch_up()
+    return _search_index
+
+
+# Write hooks. They only touch an index this process has already loaded; one
+# that is loaded later picks the change up from the database or the snapshot.
+
+def index_post(post: Post):
+    if _search_index is not None:
+        _search_index.index_post(post)
+
+
+def unindex_post(post_id: UUID):
+    if _search_index is not None:
+        _search_index.remove_post(post_id)
+
+
+def index_author(user):
+    if _search_index is not None:
+        _search_index.set_author(user.id, user.name, user.username)
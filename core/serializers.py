@@ -1,9 +1,30 @@
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
-from .models import Post, User, PostImage, PostLike, Bookmark, Notification, HashTag, Log
+from django.db import models
+from .models import Post, User, PostImage, PostLike, Bookmark, Notification, HashTag, Log, Follow
 from typing import *
+from uuid import UUID
 import re
-from .utils import is_hashtag
+from .utils import extract_hashtags
+from .timeline import fan_out_post
+from .viewer_state import get_viewer_state
+from .threads import load_ancestors
+from .search_index import index_post
+from .hashtag_trie import update_hashtag_counts
+from .hashtags import set_post_hashtags
+from .images import get_image_variants
+from .loaders import get_page_loader
+from .fast_serializers import serialize_post_previews
+
+
+class VariantImageField(serializers.ImageField):
+    """An image field rendering the URL of the variant picked by `?size=`, see core.images."""
+    
+    def to_representation(self, value):
+        if not value or 'request' not in self.context:
+            return super().to_representation(value)
+        return get_image_variants(self.context).url(value)
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -28,34 +49,47 @@ class UserLoginSerializer(serializers.Serializer):
     
 
 class CurrentUserSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, models.ImageField: VariantImageField}
+    
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'name', 'date_of_birth', 'created_at', 'profile_image']
         
+class UserProfileListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, models.Manager) else data)
+        get_viewer_state(self.context).load_users(users)
+        get_image_variants(self.context).load_users(users)
+        return super().to_representation(users)
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
-    followers = serializers.SerializerMethodField()
-    following = serializers.SerializerMethodField()
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, models.ImageField: VariantImageField}
+    followers = serializers.IntegerField(source='follower_count', read_only=True)
+    following = serializers.IntegerField(source='following_count', read_only=True)
     is_following = serializers.SerializerMethodField()
     
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'name', 'date_of_birth', 'created_at', 'profile_image', 'bio', 'location', 'followers', 'following', 'website', 'header_photo', 'is_following']
+        list_serializer_class = UserProfileListSerializer
         
-    def get_followers(self, obj) -> int:
-        return obj.followers.count()
-    
-    def get_following(self, obj) -> int:
-        return obj.following.count()
-    
     def get_is_following(self, obj) -> bool:
-        return obj.followers.filter(follower=self.context['request'].user).exists()
+        user = self.context['request'].user
+        if obj.id == user.id:
+            # users cannot follow themselves
+            return False
+        viewer_state = self.context.get('viewer_state')
+        if viewer_state is not None and viewer_state.covers_user(obj):
+            return obj.id in viewer_state.following
+        return obj.followers.filter(follower=user).exists()
 
 
 class PublicUserSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     username = serializers.CharField(max_length=20)
     name = serializers.CharField(max_length=50)
-    profile_image = serializers.ImageField()
+    profile_image = VariantImageField()
         
 
 class PublicQueryUserSerializer(serializers.Serializer):
@@ -78,44 +112,31 @@ class PostSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         post = super().create(validated_data)
+        fan_out_post(post)
+        index_post(post)
         
         # extract hashtags from content
-        content = validated_data['content']
-        seen = set()
-        words = content.split()
-        
-        for word in words:
-            if is_hashtag(word):
-                tag_name = word[1:]
-                if tag_name not in seen:
-                    tag, _ = HashTag.objects.get_or_create(name=tag_name)
-                    tag.posts.add(post)
-                    seen.add(tag_name)
-                    tag.save()
-                    
+        attached, _ = set_post_hashtags(post, extract_hashtags(post.content), created=True)
+        update_hashtag_counts(attached=attached)
         
         return post
     
     def update(self, instance, validated_data):
         instance.content = validated_data.get('content', instance.content)
-        new_tags = set()
-        content = validated_data['content']
-        words = content.split()
-        for word in words:
-            if is_hashtag(word):
-                tag_name = word[1:]
-                new_tags.add(tag_name)
-                tag, _ = HashTag.objects.get_or_create(name=tag_name)
-                tag.posts.add(instance)
-                tag.save()
-        
-        for tag in instance.hashtags.all():
-            if tag.name not in new_tags:
-                tag.posts.remove(instance)
-                tag.save()
-            
+        instance.save(update_fields=['content'])
+        attached, detached = set_post_hashtags(instance, extract_hashtags(instance.content))
+        update_hashtag_counts(attached=attached, detached=detached)
+        index_post(instance)
+        return instance
         
     
+class PostPreviewListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        posts = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.load_posts(posts)
+        return super().to_representation(posts)
+    
+    
 class PostPreviewSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     author = UserProfileSerializer()
@@ -131,38 +152,72 @@ class PostPreviewSerializer(serializers.Serializer):
     bookmarked = serializers.SerializerMethodField()
     reposted = serializers.SerializerMethodField()
     
+    class Meta:
+        list_serializer_class = PostPreviewListSerializer
+    
+    def to_representation(self, instance):
+        if self.root is self:
+            self.load_posts([instance])
+        return super().to_representation(instance)
+    
+    def load_posts(self, posts: List[Post]):
+        page_loader = get_page_loader(self.context)
+        page_loader.load_posts(posts)
+        get_viewer_state(self.context).load_posts(posts)
+        get_image_variants(self.context).load_page(page_loader)
+    
+    def get_viewer_state(self, obj):
+        viewer_state = self.context.get('viewer_state')
+        if viewer_state is not None and viewer_state.covers(obj):
+            return viewer_state
+        return None
+    
     def get_images(self, obj) -> List[str]:
-        images = PostImage.objects.filter(post=obj)
-        request = self.context['request']
-        return [request.build_absolute_uri(image.image.url) for image in images]
+        images = get_page_loader(self.context).images_of(obj)
+        if images is None:
+            images = PostImage.objects.filter(post=obj)
+        image_variants = get_image_variants(self.context)
+        image_variants.load(image.image.name for image in images)
+        return [image_variants.url(image.image) for image in images]
     
     def get_liked(self, obj) -> bool:
+        viewer_state = self.get_viewer_state(obj)
+        if viewer_state is not None:
+            return obj.id in viewer_state.liked
         return obj.likes.filter(user=self.context['request'].user.id).exists()
 
     def get_reply_count(self, obj) -> int:
-        return obj.replies.count()
+        return obj.reply_count
     
     def get_repost_count(self, obj) -> int:
-        return obj.reposts.count()
+        return obj.repost_count
     
     def get_like_count(self, obj) -> int:
-        return obj.likes.count()
+        return obj.like_count
     
     def get_view_count(self, obj) -> int:
-        return obj.visits.count()
+        return obj.view_count
     
     def get_bookmarked(self, obj) -> bool:
+        viewer_state = self.get_viewer_state(obj)
+        if viewer_state is not None:
+            return obj.id in viewer_state.bookmarked
         return obj.bookmarks.filter(user=self.context['request'].user.id).exists()
     
     def get_bookmark_count(self, obj) -> int:
-        return obj.bookmarks.count()
+        return obj.bookmark_count
     
     def get_reposted(self, obj) -> bool:
+        viewer_state = self.get_viewer_state(obj)
+        if viewer_state is not None:
+            return obj.id in viewer_state.reposted
         return obj.reposts.filter(author=self.context['request'].user.id).exists()
     
 class AugmentedPostPreviewSerializer(PostPreviewSerializer):
     repost_parent = PostPreviewSerializer()
     reply_parent = PostPreviewSerializer()
+    # renders pages in get_page_response
+    fast_serializer = staticmethod(serialize_post_previews)
     
 class PostLikeModelSerializer(serializers.ModelSerializer):
     class Meta:
@@ -172,6 +227,14 @@ class PostLikeModelSerializer(serializers.ModelSerializer):
 
 class PostDetailSerializer(AugmentedPostPreviewSerializer):
     reply_parent = serializers.SerializerMethodField()
+    fast_serializer = None
+    
+    def to_representation(self, instance):
+        # the nested parents are serialized by their own PostDetailSerializer,
+        # load the whole chain up front unless an outer one already did
+        if self.root is self and get_page_loader(self.context).images_of(instance) is None:
+            self.load_posts([instance] + load_ancestors(instance))
+        return super().to_representation(instance)
     
     def get_reply_parent(self, obj):
         if obj.reply_parent:
@@ -196,38 +259,108 @@ class NotificationModelSerializer(serializers.ModelSerializer):
         model = Notification
         fields = '__all__'
         
+class NotificationListSerializer(serializers.ListSerializer):
+    """
+    Loads what a page of notifications renders with one query per related
+    table, grouped by notification type, and attaches the shared objects to the
+    notifications so the per-item serializers do not hit the database.
+    """
+    
+    def to_representation(self, data):
+        notifications = list(data.all() if isinstance(data, models.Manager) else data)
+        
+        like_ids, post_ids, follow_ids, actor_ids = set(), set(), set(), set()
+        for notification in notifications:
+            if notification.type == 'like' and notification.like_id is not None:
+                like_ids.add(notification.like_id)
+            elif notification.type == 'reply':
+                post_ids.add(notification.reply_id)
+            elif notification.type == 'repost' and notification.repost_id is not None:
+                post_ids.add(notification.repost_id)
+            elif notification.type == 'follow' and notification.follow_id is not None:
+                follow_ids.add(notification.follow_id)
+            actor_ids.update(UUID(actor) for actor in notification.actors)
+        
+        likes = PostLike.objects.select_related('user').in_bulk(like_ids) if like_ids else {}
+        post_ids.update(like.post_id for like in likes.values())
+        posts = Post.objects.in_bulk(post_ids) if post_ids else {}
+        follows = Follow.objects.select_related('follower').in_bulk(follow_ids) if follow_ids else {}
+        self.context['notification_actors'] = User.objects.in_bulk(actor_ids) if actor_ids else {}
+        page_loader = get_page_loader(self.context)
+        page_loader.load_posts(posts.values())
+        get_viewer_state(self.context).load_posts(posts.values())
+        image_variants = get_image_variants(self.context)
+        image_variants.load_page(page_loader)
+        users = [like.user for like in likes.values()] + [follow.follower for follow in follows.values()]
+        get_viewer_state(self.context).load_users(users)
+        image_variants.load_users(users + list(self.context['notification_actors'].values()))
+        
+        for like in likes.values():
+            like.post = posts[like.post_id]
+        # events deleted since the page was read render as None
+        for notification in notifications:
+            if notification.type == 'like' and notification.like_id is not None:
+                notification.like = likes.get(notification.like_id)
+            elif notification.type == 'reply' and notification.reply_id is not None:
+                notification.reply = posts.get(notification.reply_id)
+            elif notification.type == 'repost' and notification.repost_id is not None:
+                notification.repost = posts.get(notification.repost_id)
+            elif notification.type == 'follow' and notification.follow_id is not None:
+                notification.follow = follows.get(notification.follow_id)
+        return super().to_representation(notifications)
+
+
 class NotificationSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     created_at = serializers.DateTimeField()
     type = serializers.CharField()
     data = serializers.SerializerMethodField()
+    actor_count = serializers.IntegerField()
+    actors = serializers.SerializerMethodField()
     read = serializers.BooleanField()
     
+    class Meta:
+        list_serializer_class = NotificationListSerializer
+    
     def get_data(self, obj):
         if obj.type == 'like':
+            if obj.like is None:
+                return None
             serializer = PostLikeSerializer(obj.like, context=self.context)
             return serializer.data
         elif obj.type == 'reply':
             post = obj.reply
+            if post is None:
+                return None
             serializer = AugmentedPostPreviewSerializer(post, context=self.context)
             return serializer.data
         elif obj.type == 'repost':
             post = obj.repost
+            if post is None:
+                return None
             serializer = AugmentedPostPreviewSerializer(post, context=self.context)
             return serializer.data
         elif obj.type == 'follow':
             follow = obj.follow
+            if follow is None:
+                return None
             serializer = UserProfileSerializer(follow.follower, context=self.context)
             return serializer.data
         else:
             return None
+    
+    def get_actors(self, obj):
+        # the most recent actors, newest first
+        users = self.context.get('notification_actors', {})
+        missing = [UUID(actor) for actor in obj.actors if UUID(actor) not in users]
+        if missing:
+            users = {**users, **User.objects.in_bulk(missing)}
+        actors = [users[UUID(actor)] for actor in obj.actors if UUID(actor) in users]
+        return PublicUserSerializer(actors, many=True, context=self.context).data
 
 class HashtagSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=1000)
-    related_post_count = serializers.SerializerMethodField()
-    
-    def get_related_post_count(self, obj):
-        return obj.posts.count()
+    related_post_count = serializers.IntegerField()
 
 
 class LogSerializer(serializers.ModelSerializer):
@@ -0,0 +1,85 @@
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Follow, ImageVariant, Post, PostImage, User
+from .authentication import get_user_cache
+from .fragments import touch_posts
+from .storage import release_blobs, retain_blobs
+from .trending import initial_trending_score
+
+# Keeps MediaBlob.ref_count in step with the image fields saved and deleted
+# through the ORM, see core.storage. Queryset update() and bulk_create() skip
+# these handlers; their callers adjust the counts themselves.
+
+IMAGE_FIELDS = {
+    PostImage: ('image',),
+    User: ('profile_image', 'header_photo'),
+    ImageVariant: ('file',),
+}
+
+
+def _names(instance) -> list:
+    # an upload that is not saved yet has no blob
+    return [file.name if file and file._committed else None for file in (getattr(instance, field) for field in IMAGE_FIELDS[type(instance)])]
+
+
+@receiver(pre_save, sender=PostImage)
+@receiver(pre_save, sender=User)
+@receiver(pre_save, sender=ImageVariant)
+def remember_blobs(sender, instance, update_fields=None, **kwargs):
+    fields = IMAGE_FIELDS[sender]
+    instance._previous_blobs = [None] * len(fields)
+    if instance._state.adding or (update_fields is not None and not set(fields) & set(update_fields)):
+        return
+    # what the row names before this save, the instance may have been loaded long ago
+    previous = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+    if previous is not None:
+        instance._previous_blobs = list(previous)
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=ImageVariant)
+def count_saved_blobs(sender, instance, update_fields=None, **kwargs):
+    fields = IMAGE_FIELDS[sender]
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return
+    changed = [(old, new) for old, new in zip(instance._previous_blobs, _names(instance)) if old != new]
+    retain_blobs(new for _, new in changed)
+    release_blobs(old for old, _ in changed)
+
+
+@receiver(post_delete, sender=PostImage)
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=ImageVariant)
+def release_deleted_blobs(sender, instance, **kwargs):
+    release_blobs(_names(instance))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    get_user_cache().invalidate(instance.id)
+
+
+@receiver(pre_delete, sender=User)
+def release_follow_counts(sender, instance, **kwargs):
+    # the follows of a deleted user go with it, in the same transaction
+    followers = Follow.objects.filter(following=instance).values('follower_id')
+    following = Follow.objects.filter(follower=instance).values('following_id')
+    User.objects.filter(id__in=followers).update(following_count=Greatest(F('following_count') - 1, Value(0)))
+    User.objects.filter(id__in=following).update(follower_count=Greatest(F('follower_count') - 1, Value(0)))
+
+
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def touch_image_post(sender, instance, **kwargs):
+    touch_posts([instance.post_id])
+
+
+@receiver(pre_save, sender=Post)
+def set_initial_trending_score(sender, instance, **kwargs):
+    if instance._state.adding:
+        instance.trending_score = initial_trending_score()
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import tempfile
+from collections import Counter
+from datetime import timedelta
+from typing import Iterable
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ImageVariant, MediaBlob, PostImage, User
+
+# Media storage that keeps every distinct upload once. A file is hashed while
+# it is streamed to a temporary file and then moved to blobs/ under its
+# SHA-256 digest, so uploading the same image again (a reposted meme, a
+# profile picture set twice) reuses the stored blob. Every blob has a
+# MediaBlob row counting the PostImage.image, User.profile_image,
+# User.header_photo and ImageVariant.file values naming it; the counts are
+# kept by the signal handlers in core.signals and recomputed by the
+# clean_media_blobs command, which deletes blobs nobody refers to anymore.
+# Deleting a file through the storage leaves shared blobs alone.
+
+BLOB_DIR = 'blobs'
+BLOB_TEMP_DIR = os.path.join(BLOB_DIR, 'tmp')
+
+
+def is_blob(name: str) -> bool:
+    return bool(name) and name.startswith(BLOB_DIR + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # the stored name is derived from the content in _save, equal names hold equal files
+        return name
+
+    def _save(self, name, content):
+        extension = os.path.splitext(name)[1].lower()
+        temp_dir = self.path(BLOB_TEMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+
+            hexdigest = digest.hexdigest()
+            blob_name = f'{BLOB_DIR}/{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{extension}'
+            # the row is locked until the file is in place, so clean_media_blobs
+            # cannot remove a blob that is being stored again
+            with transaction.atomic():
+                MediaBlob.objects.update_or_create(name=blob_name, defaults={'size': size, 'stored_at': timezone.now()})
+                path = self.path(blob_name)
+                if not os.path.exists(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return blob_name
+
+    def delete(self, name):
+        if is_blob(name):
+            return
+        super().delete(name)
+
+    def delete_blob(self, name):
+        super().delete(name)
+
+
+def retain_blobs(names: Iterable[str]):
+    for count, names in _by_count(names).items():
+        MediaBlob.objects.filter(name__in=names).update(ref_count=F('ref_count') + count)
+
+
+def release_blobs(names: Iterable[str]):
+    for count, names in _by_count(names).items():
+        MediaBlob.objects.filter(name__in=names).update(ref_count=Greatest(F('ref_count') - count, 0))
+
+
+def _by_count(names: Iterable[str]) -> dict:
+    counts = {}
+    for name, count in Counter(name for name in names if is_blob(name)).items():
+        counts.setdefault(count, []).append(name)
+    return counts
+
+
+def referenced_blobs() -> Counter:
+    """How many times each blob is referenced, counted from the referencing tables."""
+    references = Counter()
+    references.update(PostImage.objects.values_list('image', flat=True).iterator())
+    for profile_image, header_photo in User.objects.values_list('profile_image', 'header_photo').iterator():
+        references.update((profile_image, header_photo))
+    references.update(ImageVariant.objects.values_list('file', flat=True).iterator())
+    return Counter({name: count for name, count in references.items() if is_blob(name)})
+
+
+def reconcile_blob_references() -> int:
+    """Recomputes every MediaBlob.ref_count, returns the number of corrected rows."""
+    references = referenced_blobs()
+    corrected = []
+    for blob in MediaBlob.objects.iterator():
+        if blob.ref_count != references[blob.name]:
+            blob.ref_count = references[blob.name]
+            corrected.append(blob)
+    MediaBlob.objects.bulk_update(corrected, ['ref_count'], batch_size=1000)
+    return len(corrected)
+
+
+def delete_unreferenced_blobs(storage: ContentAddressedStorage, grace: timedelta) -> int:
+    """
+    Deletes the blobs without references that were last stored more than
+    `grace` ago, along with the variants of the deleted images. Returns the
+    number of deleted blobs.
+    """
+    cutoff = timezone.now() - grace
+    unreferenced = MediaBlob.objects.filter(ref_count=0, stored_at__lt=cutoff)
+    # the variants of an unreferenced image go too, which releases their blobs
+    for variant in ImageVariant.objects.filter(source__in=unreferenced.values('name')).iterator():
+        variant.delete()
+
+    deleted = 0
+    for name in unreferenced.values_list('name', flat=True).iterator():
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name, ref_count=0, stored_at__lt=cutoff).first()
+            if blob is None:
+                continue
+            storage.delete_blob(blob.name)
+            blob.delete()
+            deleted += 1
+    return deleted
@@ -1,4 +1,1263 @@
-from django.test import TestCase
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import uuid
+from collections import Counter
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import Count, Q
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
 
+from .authentication import CachedJWTAuthentication, VersionedRefreshToken, get_user_cache
+from .counters import increment_follow_counters, increment_post_counters
+from .events import LocalBroker, publish_event
+from .fast_serializers import serialize_post_previews
+from .hashtag_trie import HashtagTrie
+from .hashtags import set_post_hashtags
+from .images import generate_image_variants
+from .loaders import PageLoader
+from .models import (Bookmark, Follow, HashTag, ImageVariant, MediaBlob, Notification, OutboxEvent, Post, PostImage, PostLike,
+                     StreamTicket, TimelineEntry, User, VisitRecord)
+from .notifications import mark_notifications_read, notify, retract_notification
+from .outbox import enqueue, process_outbox
+from .pagination import CursorPaginator
+from .search_index import SearchIndex
+from .serializers import AugmentedPostPreviewSerializer, NotificationSerializer
+from .threads import attach_reply, get_reply_thread_ids
+from .timeline import get_timeline
+from .trending import event_score, get_half_life
+from .utils import HASHTAG_MAX_LENGTH, RATING_COUNTER_FIELDS, RATING_TOLERANCE, extract_hashtags, rank_post_ids, sigmoid
+from .viewer_state import ViewerState
+from .views.event_views import authenticate as authenticate_stream
+from .views.media_views import lookup, serve_media
+from .visits import VisitBuffer
+
+
+def png(color: str) -> SimpleUploadedFile:
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(data, 'PNG')
+    return SimpleUploadedFile(f'{color}.png', data.getvalue(), content_type='image/png')
+
+
+def create_user(username: str, **fields) -> User:
+    return User.objects.create_user(username=username, email=f'{username}@example.com', password='password',
+                                    name=username.title(), date_of_birth='2000-01-01', **fields)
+
+
+def client_for(user: User) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class FastPostPreviewSerializerTests(TestCase):
+    """serialize_post_previews renders the same JSON as AugmentedPostPreviewSerializer."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root, IMAGE_VARIANT_WORKERS=0)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.alice = self.create_user('alice', bio='Hello', website='https://example.com', profile_image=png('blue'))
+        self.bob = self.create_user('bob', location='Somewhere', header_photo=png('green'))
+        self.carol = self.create_user('carol')
+
+    def create_user(self, username: str, **fields) -> User:
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password='password',
+                                        name=username.title(), date_of_birth='2000-01-01', **fields)
+        generate_image_variants([user.profile_image.name, user.header_photo.name])
+        return user
+
+    def create_post(self, author: User, content: str = 'post', images=(), **fields) -> Post:
+        post = Post.objects.create(author=author, content=content, **fields)
+        for image in images:
+            PostImage.objects.create(post=post, image=image)
+        generate_image_variants(image.image.name for image in post.images.all())
+        return post
+
+    def follow(self, follower: User, following: User):
+        Follow.objects.create(follower=follower, following=following)
+        increment_follow_counters(follower.id, following.id, 1)
+
+    def request(self, viewer: User, **params) -> Request:
+        request = APIRequestFactory().get('/api/posts/', params)
+        force_authenticate(request, user=viewer)
+        return Request(request)
+
+    def assertSameJSON(self, posts, viewer: User, **params):
+        posts = list(posts)
+        expected = AugmentedPostPreviewSerializer(posts, many=True, context={'request': self.request(viewer, **params)}).data
+        # the second time from the fragment cache
+        for _ in range(2):
+            rendered = serialize_post_previews(posts, {'request': self.request(viewer, **params)})
+            self.assertEqual(JSONRenderer().render(rendered), JSONRenderer().render(expected))
+
+    def feed(self):
+        return Post.objects.order_by('-created_at', '-id')
+
+    def test_empty_page(self):
+        self.assertSameJSON([], self.alice)
+
+    def test_plain_posts(self):
+        self.create_post(self.alice, 'first')
+        self.create_post(self.bob, '')
+        self.create_post(self.carol, 'with "quotes" and ünïcode\n')
+        self.assertSameJSON(self.feed(), self.alice)
+        self.assertSameJSON(self.feed(), self.carol)
+
+    def test_reposts_and_replies(self):
+        original = self.create_post(self.alice, 'original')
+        reply = self.create_post(self.bob, 'reply', reply_parent=original)
+        self.create_post(self.carol, 'reply to reply', reply_parent=reply)
+        self.create_post(self.bob, '', repost_parent=original)
+        self.create_post(self.carol, 'quote', repost_parent=reply)
+        self.assertSameJSON(self.feed(), self.alice)
+        # parents that are not on the page
+        self.assertSameJSON(self.feed().exclude(id__in=[original.id, reply.id]), self.bob)
+
+    def test_images(self):
+        original = self.create_post(self.alice, 'pictures', images=[png('red'), png('yellow')])
+        self.create_post(self.bob, 'same picture', images=[png('red')])
+        self.create_post(self.carol, '', repost_parent=original)
+        for size in (None, 'thumb', 'small', 'medium', 'unknown'):
+            params = {} if size is None else {'size': size}
+            with self.subTest(size=size):
+                self.assertSameJSON(self.feed(), self.carol, **params)
+
+    def test_images_without_variants(self):
+        with self.assertLogs('core.images', 'ERROR'):
+            self.create_post(self.alice, 'broken', images=[SimpleUploadedFile('broken.png', b'not an image')])
+        self.assertSameJSON(self.feed(), self.bob, size='small')
+
+    def test_viewer_state(self):
+        original = self.create_post(self.alice, 'original')
+        other = self.create_post(self.bob, 'other')
+        self.create_post(self.carol, '', repost_parent=original)
+        PostLike.objects.create(user=self.carol, post=original)
+        Bookmark.objects.create(user=self.carol, post=other)
+        self.follow(self.carol, self.alice)
+        self.follow(self.alice, self.carol)
+        for viewer in (self.alice, self.bob, self.carol):
+            with self.subTest(viewer=viewer.username):
+                self.assertSameJSON(self.feed(), viewer)
+
+    def test_counters(self):
+        post = self.create_post(self.alice, 'popular')
+        Post.objects.filter(id=post.id).update(reply_count=3, repost_count=2, like_count=10, view_count=100, bookmark_count=1)
+        self.assertSameJSON(self.feed(), self.bob)
+
+    def test_changes_after_caching(self):
+        original = self.create_post(self.alice, 'original')
+        self.create_post(self.bob, 'reply', reply_parent=original)
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+
+        original.content = 'edited'
+        original.save(update_fields=['content'])
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+
+        PostImage.objects.create(post=original, image=png('red'))
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+        generate_image_variants(image.image.name for image in original.images.all())
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+
+        self.alice.bio = 'Changed'
+        self.alice.header_photo = png('yellow')
+        self.alice.save()
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+        generate_image_variants([self.alice.header_photo.name])
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+
+        Post.objects.filter(id=original.id).update(like_count=5, view_count=9)
+        self.follow(self.carol, self.alice)
+        self.assertSameJSON(self.feed(), self.carol, size='small')
+
+    def test_page_response(self):
+        original = self.create_post(self.alice, 'original', images=[png('red')])
+        self.create_post(self.bob, 'reply', reply_parent=original)
+        self.create_post(self.carol, '', repost_parent=original)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        response = client.get(f'/api/users/{self.alice.username}/posts/')
+        self.assertEqual(response.status_code, 200)
+        posts = [post for post in self.feed() if post.author_id == self.alice.id]
+        expected = AugmentedPostPreviewSerializer(posts, many=True, context={'request': self.request(self.bob)}).data
+        self.assertEqual(JSONRenderer().render(response.data['results']), JSONRenderer().render(expected))
+
+
+class HashtagTrieTests(SimpleTestCase):
+    def test_long_tags(self):
+        trie = HashtagTrie()
+        trie.add('a' * 5000, 3)
+        trie.add('ab', 5)
+        self.assertEqual([tag.name for tag in trie.search('a')], ['ab', 'a' * 5000])
+        self.assertEqual([tag.name for tag in trie.search('')], ['ab', 'a' * 5000])
+
+    def test_limit_is_clamped_to_top_k(self):
+        trie = HashtagTrie(top_k=5)
+        for count in range(10):
+            trie.add(f'tag{count}', count)
+        self.assertEqual([tag.related_post_count for tag in trie.search('tag', 100)], [9, 8, 7, 6, 5])
+        self.assertEqual([tag.related_post_count for tag in trie.search('tag', 2)], [9, 8])
+
+    def test_counts_update_cached_tops(self):
+        trie = HashtagTrie()
+        trie.add('cat', 2)
+        trie.add('car', 1)
+        self.assertEqual([tag.name for tag in trie.search('ca')], ['cat', 'car'])
+        trie.add('car', 5)
+        self.assertEqual([tag.name for tag in trie.search('ca')], ['car', 'cat'])
+
+    def test_extract_skips_long_tags(self):
+        long_tag = 'a' * (HASHTAG_MAX_LENGTH + 1)
+        self.assertEqual(extract_hashtags(f'#short #{long_tag} #short'), ['short'])
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='trender', email='trender@example.com', password='password',
+                                             name='Trender', date_of_birth='2000-01-01')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_scores_order_like_decayed_scores(self):
+        now = timezone.now()
+        half_life = get_half_life()
+        # 4 two half-lives ago decayed to 1, less than 2 now and more than 0.5 now
+        self.assertLess(event_score(4, now - 2 * half_life), event_score(2, now))
+        self.assertGreater(event_score(4, now - 2 * half_life), event_score(0.5, now))
+        self.assertAlmostEqual(event_score(4, now - 2 * half_life), event_score(1, now))
+
+    def test_engagement_raises_score(self):
+        post = Post.objects.create(author=self.user, content='post')
+        initial = Post.objects.get(id=post.id).trending_score
+        increment_post_counters(post.id, like_count=1)
+        # the creation (1) and the like (1) at about the same time
+        self.assertAlmostEqual(Post.objects.get(id=post.id).trending_score, initial + 1, places=3)
+
+    def test_event_on_a_long_forgotten_post(self):
+        post = Post.objects.create(author=self.user, content='post')
+        Post.objects.filter(id=post.id).update(trending_score=event_score(1) - 5000)
+        increment_post_counters(post.id, like_count=1)
+        self.assertAlmostEqual(Post.objects.get(id=post.id).trending_score, event_score(1), places=3)
+
+    def test_cursor_pages_stay_disjoint(self):
+        posts = [Post.objects.create(author=self.user, content=f'post {i}') for i in range(40)]
+        for i, post in enumerate(posts):
+            increment_post_counters(post.id, like_count=i % 7, reply_count=i % 3)
+
+        first = self.client.get('/api/top-rated/', {'cursor': ''}).data
+        # engagement on a post that was already shown
+        increment_post_counters(first['results'][5]['id'], like_count=3)
+        second = self.client.get('/api/top-rated/', {'cursor': first['next']}).data
+
+        first_ids = [post['id'] for post in first['results']]
+        second_ids = [post['id'] for post in second['results']]
+        self.assertEqual(len(first_ids), 20)
+        self.assertEqual(len(second_ids), 20)
+        self.assertEqual(set(first_ids) | set(second_ids), {str(post.id) for post in posts})
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', email='writer@example.com', password='password',
+                                             name='Scribe', date_of_birth='2000-01-01')
+        self.kept = Post.objects.create(author=self.user, content='apples and pears')
+        self.edited = Post.objects.create(author=self.user, content='apples')
+        self.deleted = Post.objects.create(author=self.user, content='apples too')
+        self.index = SearchIndex()
+        self.index.build()
+
+    def search(self, query: str) -> set:
+        return {hit.id for hit in self.index.search(query)}
+
+    @override_settings(SEARCH_INDEX_RECONCILE_INTERVAL=0)
+    def test_catch_up_with_other_workers(self):
+        # changes made without this index being told
+        self.deleted.delete()
+        self.edited.content = 'oranges'
+        self.edited.save(update_fields=['content'])
+        self.user.name = 'Novelist'
+        self.user.save()
+        created = Post.objects.create(author=self.user, content='fresh apples')
+
+        self.index.catch_up(min_interval=0)
+        self.assertEqual(self.search('apples'), {self.kept.id, created.id})
+        self.assertEqual(self.search('oranges'), {self.edited.id})
+        self.assertEqual(self.search('novelist'), {self.kept.id, self.edited.id, created.id})
+        self.assertEqual(self.search('scribe'), set())
+        self.assertEqual(self.search('writer'), {self.kept.id, self.edited.id, created.id})
+
+    @override_settings(SEARCH_TOP_CANDIDATES=2)
+    def test_top_search_ranks_the_newest_matches(self):
+        popular = Post.objects.create(author=self.user, content='apples', like_count=100)
+        Post.objects.filter(id=popular.id).update(created_at=timezone.now() - timedelta(days=1))
+        self.index.build()
+        newest = [hit.id for hit in self.index.search('apples')][:2]
+        with mock.patch('core.views.search_views.get_search_index', return_value=self.index):
+            response = client_for(self.user).get('/api/search/top/', {'q': 'apples'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({post['id'] for post in response.data['results']}, {str(post_id) for post_id in newest})
+
+    def test_prefix_matching(self):
+        self.assertEqual(self.search('app'), {self.kept.id, self.edited.id, self.deleted.id})
+        self.assertEqual(self.search('pples'), set())
+
+    def test_snapshot_keeps_poll_time(self):
+        loaded = SearchIndex.loads(self.index.dumps())
+        self.assertEqual(loaded.changes_polled_at.timestamp(), self.index.changes_polled_at.timestamp())
+        self.edited.content = 'oranges'
+        self.edited.save(update_fields=['content'])
+        loaded.catch_up(min_interval=0)
+        self.assertEqual({hit.id for hit in loaded.search('oranges')}, {self.edited.id})
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.author, self.fan, self.other_fan = [
+            User.objects.create_user(username=username, email=f'{username}@example.com', password='password',
+                                     name=username.title(), date_of_birth='2000-01-01')
+            for username in ('author', 'fan', 'otherfan')
+        ]
+        self.post = Post.objects.create(author=self.author, content='post')
+
+    def like(self, user: User) -> PostLike:
+        like = PostLike.objects.create(post=self.post, user=user)
+        enqueue('like', like_id=like.id)
+        process_outbox()
+        return like
+
+    def unread_count(self) -> int:
+        return User.objects.get(id=self.author.id).unread_notification_count
+
+    def test_replayed_like_is_not_counted_twice(self):
+        first = self.like(self.fan)
+        self.like(self.other_fan)
+        mark_notifications_read(self.author, Notification.objects.all())
+
+        # the row points at the latest like, the first one is applied again
+        enqueue('like', like_id=first.id)
+        process_outbox()
+        notification = Notification.objects.get(recipient=self.author)
+        self.assertEqual(notification.actor_count, 2)
+        self.assertTrue(notification.read)
+        self.assertEqual(self.unread_count(), 0)
+        self.assertFalse(OutboxEvent.objects.filter(processed_at__isnull=True).exists())
+
+    def test_replayed_follow_is_not_counted_twice(self):
+        follow = Follow.objects.create(follower=self.fan, following=self.author)
+        enqueue('follow', follow_id=follow.id)
+        enqueue('follow', follow_id=follow.id)
+        process_outbox()
+        self.assertEqual(Notification.objects.get(recipient=self.author, type='follow').actor_count, 1)
+        self.assertEqual(self.unread_count(), 1)
+
+
+class CursorPaginatorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pager', email='pager@example.com', password='password',
+                                             name='Pager', date_of_birth='2000-01-01')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        now = timezone.now()
+        for i in range(25):
+            post = Post.objects.create(author=self.user, content=f'post {i}')
+            # pairs of posts share a created_at, the id breaks the tie
+            Post.objects.filter(id=post.id).update(created_at=now - timedelta(minutes=i // 2))
+        self.ordered = list(Post.objects.order_by('-created_at', '-id'))
+
+    def pages(self, paginator: CursorPaginator) -> list:
+        pages = [paginator.page('')]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        backwards = [pages[-1]]
+        while backwards[-1].has_previous():
+            backwards.append(paginator.page(backwards[-1].previous_cursor))
+        self.assertEqual([list(page) for page in backwards], [list(page) for page in reversed(pages)])
+        return [post for page in pages for post in page]
+
+    def test_round_trip(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        values = [self.ordered[3].created_at, self.ordered[3].id]
+        self.assertEqual(paginator.decode_cursor(paginator.encode_cursor(values, True)), (values, True))
+
+    def test_pages_cover_every_row_once(self):
+        self.assertEqual(self.pages(CursorPaginator(Post.objects.all(), 4)), self.ordered)
+        self.assertEqual(self.pages(CursorPaginator(self.ordered, 4, model=Post)), self.ordered)
+
+    def test_up_to_includes_the_cursor_row(self):
+        paginator = CursorPaginator(Post.objects.all(), 10)
+        cursor = paginator.encode_cursor([self.ordered[6].created_at, self.ordered[6].id], False)
+        self.assertEqual(set(Post.objects.filter(paginator.up_to(cursor))), set(self.ordered[:7]))
+
+    def test_invalid_cursors_are_rejected(self):
+        def encode(payload) -> str:
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        post = self.ordered[0]
+        cursors = [
+            'not a cursor',
+            encode({'k': [['v', 'x'], ['v', 'y']], 'b': False}),
+            encode({'k': [['v', {}], ['v', []]], 'b': False}),
+            encode({'k': [['dt', post.created_at.isoformat()]], 'b': False}),
+            encode({'k': [['dt', '2024-01-01T00:00:00'], ['uuid', str(post.id)]], 'b': False}),
+            encode([1, 2]),
+        ]
+        for cursor in cursors:
+            response = self.client.get(f'/api/users/{self.user.username}/posts/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+        response = self.client.get(f'/api/users/{self.user.username}/posts/', {'cursor': encode({
+            'k': [['dt', post.created_at.isoformat()], ['uuid', str(post.id)]], 'b': False,
+        })})
+        self.assertEqual(response.status_code, 200)
+
+
+class ImageVariantTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root, IMAGE_VARIANT_WORKERS=0)
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def test_concurrent_calls_retain_blobs_once(self):
+        user = User.objects.create_user(username='painter', email='painter@example.com', password='password',
+                                        name='Painter', date_of_birth='2000-01-01', profile_image=png('red'))
+        variants = generate_image_variants([user.profile_image.name])
+        self.assertTrue(variants)
+        # a call that looked for existing variants before the first one stored them
+        with mock.patch.object(ImageVariant.objects, 'filter', return_value=ImageVariant.objects.none()):
+            self.assertEqual(generate_image_variants([user.profile_image.name]), [])
+        # sizes that render the same bytes share a blob
+        references = Counter(variant.file.name for variant in variants)
+        self.assertEqual(dict(MediaBlob.objects.filter(name__in=references).values_list('name', 'ref_count')), references)
+
+    def test_notification_actors(self):
+        author = create_user('sculptor')
+        fan = create_user('patron', profile_image=png('red'))
+        generate_image_variants([fan.profile_image.name])
+        post = Post.objects.create(author=author, content='statue')
+        notify('like', author.id, PostLike.objects.create(post=post, user=fan))
+        thumb = ImageVariant.objects.get(source=fan.profile_image.name, size='thumb')
+
+        response = client_for(author).get('/api/notifications/', {'size': 'thumb'})
+        actors = response.data['results'][0]['actors']
+        self.assertEqual(actors[0]['profile_image'], 'http://testserver' + thumb.file.url)
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW_HOURS=24, NOTIFICATION_ACTOR_SAMPLE_SIZE=3)
+class NotificationCoalescingTests(TestCase):
+    def setUp(self):
+        self.author, *self.fans = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='password',
+                                     name=f'User {i}', date_of_birth='2000-01-01')
+            for i in range(6)
+        ]
+        self.post = Post.objects.create(author=self.author, content='post')
+        self.start = timezone.now() - timedelta(days=3)
+
+    def like(self, fan: User, hours: float) -> PostLike:
+        like = PostLike.objects.create(post=self.post, user=fan)
+        PostLike.objects.filter(id=like.id).update(created_at=self.start + timedelta(hours=hours))
+        like.refresh_from_db()
+        notify('like', self.author.id, like)
+        return like
+
+    def unlike(self, like: PostLike):
+        like.delete()
+        retract_notification('like', self.author.id, like.created_at, target_post_id=self.post.id)
+
+    def notifications(self) -> list:
+        return list(Notification.objects.filter(recipient=self.author).order_by('window_start'))
+
+    def unread_count(self) -> int:
+        return User.objects.get(id=self.author.id).unread_notification_count
+
+    def actors(self, *fans: User) -> list:
+        return [str(fan.id) for fan in fans]
+
+    def test_likes_in_a_window_coalesce(self):
+        self.like(self.fans[0], 0)
+        self.like(self.fans[1], 1)
+        self.like(self.fans[2], 2)
+        latest = self.like(self.fans[3], 3)
+        [notification] = self.notifications()
+        self.assertEqual(notification.actor_count, 4)
+        self.assertEqual(notification.actors, self.actors(self.fans[3], self.fans[2], self.fans[1]))
+        self.assertEqual(notification.like_id, latest.id)
+        self.assertEqual(notification.created_at, latest.created_at)
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_like_after_the_window_starts_a_new_row(self):
+        self.like(self.fans[0], 0)
+        self.like(self.fans[1], 25)
+        self.assertEqual([notification.actor_count for notification in self.notifications()], [1, 1])
+        self.assertEqual(self.unread_count(), 2)
+
+    def test_read_row_is_unread_again_when_it_grows(self):
+        self.like(self.fans[0], 0)
+        mark_notifications_read(self.author, Notification.objects.all())
+        self.assertEqual(self.unread_count(), 0)
+        self.like(self.fans[1], 1)
+        self.assertFalse(self.notifications()[0].read)
+        self.assertEqual(self.unread_count(), 1)
+        self.like(self.fans[2], 2)
+        self.assertEqual(self.unread_count(), 1)
+
+    def test_retract_recounts_the_row(self):
+        first = self.like(self.fans[0], 0)
+        second = self.like(self.fans[1], 1)
+        latest = self.like(self.fans[2], 2)
+        self.unlike(latest)
+        [notification] = self.notifications()
+        self.assertEqual(notification.actor_count, 2)
+        self.assertEqual(notification.actors, self.actors(self.fans[1], self.fans[0]))
+        self.assertEqual(notification.like_id, second.id)
+        self.assertEqual(notification.created_at, second.created_at)
+
+        self.unlike(first)
+        self.unlike(second)
+        self.assertEqual(self.notifications(), [])
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_retract_only_touches_the_window_of_the_event(self):
+        self.like(self.fans[0], 0)
+        self.like(self.fans[1], 23)
+        late = self.like(self.fans[2], 30)
+        self.like(self.fans[3], 40)
+        self.assertEqual([notification.actor_count for notification in self.notifications()], [2, 2])
+        mark_notifications_read(self.author, Notification.objects.filter(window_start=self.start))
+
+        self.unlike(late)
+        first, second = self.notifications()
+        self.assertEqual((first.actor_count, first.read), (2, True))
+        self.assertEqual(second.actors, self.actors(self.fans[3]))
+        self.assertEqual(self.unread_count(), 1)
+
+        # the last event of an unread row takes its unread count with it
+        self.unlike(PostLike.objects.get(user=self.fans[3]))
+        self.assertEqual(self.notifications(), [first])
+        self.assertEqual(self.unread_count(), 0)
+
+
+class TokenVersionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='keyholder', email='keyholder@example.com', password='password',
+                                             name='Keyholder', date_of_birth='2000-01-01')
+
+    def stored_version(self) -> int:
+        return User.objects.get(id=self.user.id).token_version
+
+    def test_rehash_keeps_the_version(self):
+        stale = PBKDF2PasswordHasher().encode('password', 'saltsaltsalt', iterations=1000)
+        User.objects.filter(id=self.user.id).update(password=stale)
+        user = User.objects.get(id=self.user.id)
+        self.assertTrue(user.check_password('password'))
+        self.assertNotEqual(User.objects.get(id=user.id).password, stale)
+        self.assertEqual((user.token_version, self.stored_version()), (0, 0))
+
+    def test_password_change_writes_the_version(self):
+        self.user.set_password('new password')
+        self.user.save(update_fields=['password'])
+        self.assertEqual((self.user.token_version, self.stored_version()), (1, 1))
+
+
+class EventBrokerTests(TestCase):
+    def test_one_publish_reaches_every_user(self):
+        broker = LocalBroker()
+        user_ids = [uuid.uuid4() for _ in range(3)]
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+
+        async def subscribe():
+            return [broker.subscribe(user_id) for user_id in user_ids[:2]]
+
+        subscriptions = loop.run_until_complete(subscribe())
+        with mock.patch('core.events.get_broker', return_value=broker), self.captureOnCommitCallbacks(execute=True):
+            publish_event(user_ids, 'new_post', post_id='1')
+        # let the loop run the handed over offers
+        loop.run_until_complete(asyncio.sleep(0))
+        for subscription in subscriptions:
+            self.assertEqual(subscription.queue.get_nowait(), {'type': 'new_post', 'post_id': '1'})
+
+
+class StreamTicketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='listener', email='listener@example.com', password='password',
+                                             name='Listener', date_of_birth='2000-01-01')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ticket(self) -> str:
+        response = self.client.post('/api/events/ticket/')
+        self.assertEqual(response.status_code, 201)
+        return response.data['ticket']
+
+    def authenticate(self, **params):
+        return authenticate_stream(APIRequestFactory().get('/api/events/', params))
+
+    def test_ticket_works_once(self):
+        ticket = self.ticket()
+        self.assertEqual(self.authenticate(ticket=ticket), self.user)
+        self.assertIsNone(self.authenticate(ticket=ticket))
+
+    def test_expired_ticket_is_rejected(self):
+        ticket = self.ticket()
+        StreamTicket.objects.filter(key=ticket).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIsNone(self.authenticate(ticket=ticket))
+
+    def test_access_token_is_not_taken_from_the_query_string(self):
+        self.assertIsNone(self.authenticate(token=str(AccessToken.for_user(self.user))))
+
+
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.reader, self.alice, self.bob = [create_user(username) for username in ('reader', 'alice', 'bobby')]
+        self.clients = {user: client_for(user) for user in (self.reader, self.alice, self.bob)}
+
+    def post(self, author: User, content: str = 'post', path: str = '/api/posts/') -> Post:
+        response = self.clients[author].post(path, {'content': content})
+        self.assertEqual(response.status_code, 201)
+        return Post.objects.get(id=response.data['id'])
+
+    def follow(self, follower: User, following: User):
+        self.assertEqual(self.clients[follower].post(f'/api/users/{following.username}/follow/').status_code, 200)
+
+    def unfollow(self, follower: User, following: User):
+        self.assertEqual(self.clients[follower].delete(f'/api/users/{following.username}/follow/').status_code, 200)
+
+    def timeline(self, owner: User) -> set:
+        return set(TimelineEntry.objects.filter(owner=owner).values_list('post_id', flat=True))
+
+    def test_fan_out_on_create(self):
+        self.follow(self.reader, self.alice)
+        post = self.post(self.alice)
+        self.assertIn(post.id, self.timeline(self.reader))
+        self.assertIn(post.id, self.timeline(self.alice))
+        self.assertNotIn(post.id, self.timeline(self.bob))
+
+    def test_backfill_on_follow_and_prune_on_unfollow(self):
+        posts = {self.post(self.alice).id for _ in range(3)}
+        own = self.post(self.reader).id
+        self.follow(self.reader, self.alice)
+        self.assertEqual(self.timeline(self.reader), posts | {own})
+        self.unfollow(self.reader, self.alice)
+        self.assertEqual(self.timeline(self.reader), {own})
+
+    def test_prune_on_post_delete(self):
+        self.follow(self.reader, self.alice)
+        post = self.post(self.alice)
+        self.assertEqual(self.clients[self.alice].delete(f'/api/posts/{post.id}/').status_code, 204)
+        self.assertEqual(self.timeline(self.reader), set())
+        self.assertEqual(self.timeline(self.alice), set())
+
+    def test_feed_matches_the_follow_join(self):
+        self.post(self.alice, 'before the follow')
+        self.follow(self.reader, self.alice)
+        self.follow(self.alice, self.bob)
+        parent = self.post(self.bob, 'parent')
+        self.post(self.alice, 'reply', f'/api/posts/{parent.id}/replies/')
+        self.post(self.alice, 'repost', f'/api/posts/{parent.id}/reposts/')
+        self.post(self.reader, 'own post')
+        self.post(self.bob, 'not followed')
+
+        for user in (self.reader, self.alice, self.bob):
+            # the query the timeline replaced
+            expected = list(Post.objects.filter(Q(author__followers__follower=user) | Q(author=user)).distinct()
+                            .order_by('-created_at').values_list('id', 'created_at'))
+            feed = [(entry.post_id, entry.created_at) for entry in get_timeline(user)]
+            self.assertEqual(set(feed), set(expected))
+            self.assertEqual([created_at for _, created_at in feed], [created_at for _, created_at in expected])
+
+            response = self.clients[user].get('/api/following-posts/', {'cursor': ''})
+            self.assertEqual([post['id'] for post in response.data['results']], [str(post_id) for post_id, _ in feed])
+            response = self.clients[user].get('/api/following-posts-range/', {'from': 0, 'to': timezone.now().timestamp() + 1})
+            self.assertEqual({post['id'] for post in response.data}, {str(post_id) for post_id, _ in expected})
+
+
+class PostCounterTests(TestCase):
+    def setUp(self):
+        self.author, self.fan = create_user('author'), create_user('fan')
+        self.client = client_for(self.fan)
+        self.post = Post.objects.create(author=self.author, content='post')
+
+    def assertCountersMatch(self):
+        # view_count follows the visit buffer, which flushes on its own schedule
+        expected = Post.objects.annotate(
+            expected_likes=Count('likes', distinct=True), expected_bookmarks=Count('bookmarks', distinct=True),
+            expected_replies=Count('replies', distinct=True), expected_reposts=Count('reposts', distinct=True),
+        )
+        for post in expected:
+            self.assertEqual(
+                (post.like_count, post.bookmark_count, post.reply_count, post.repost_count),
+                (post.expected_likes, post.expected_bookmarks, post.expected_replies, post.expected_reposts),
+                post.content,
+            )
+
+    def test_interactions_keep_counters_exact(self):
+        path = f'/api/posts/{self.post.id}'
+        self.assertEqual(self.client.post(f'{path}/likes/').status_code, 201)
+        self.assertEqual(self.client.post(f'{path}/bookmarks/').status_code, 201)
+        reply = self.client.post(f'{path}/replies/', {'content': 'reply'}).data['id']
+        repost = self.client.post(f'{path}/reposts/', {'content': 'repost'}).data['id']
+        self.assertCountersMatch()
+        self.assertEqual(Post.objects.get(id=self.post.id).like_count, 1)
+
+        self.assertEqual(self.client.delete(f'{path}/likes/').status_code, 200)
+        self.assertEqual(self.client.delete(f'{path}/bookmarks/').status_code, 200)
+        self.assertCountersMatch()
+        self.assertEqual(self.client.delete(f'/api/posts/{reply}/').status_code, 204)
+        self.assertEqual(self.client.delete(f'/api/posts/{repost}/').status_code, 204)
+        self.assertCountersMatch()
+        self.assertEqual(Post.objects.get(id=self.post.id).reply_count, 0)
+
+        # repeated requests do not count twice
+        self.client.post(f'{path}/likes/')
+        self.client.post(f'{path}/likes/')
+        self.client.delete(f'{path}/bookmarks/')
+        self.assertCountersMatch()
+
+    def test_reconcile_repairs_drift(self):
+        PostLike.objects.create(post=self.post, user=self.fan)
+        Post.objects.filter(id=self.post.id).update(like_count=5, reply_count=2)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertCountersMatch()
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.like_count, post.reply_count), (1, 0))
+
+
+class FollowCounterTests(TestCase):
+    def setUp(self):
+        self.users = [create_user(username) for username in ('anna', 'benn', 'cleo', 'dora')]
+        self.clients = {user: client_for(user) for user in self.users}
+
+    def follow(self, follower: User, following: User, method: str = 'post'):
+        return getattr(self.clients[follower], method)(f'/api/users/{following.username}/follow/')
+
+    def assertCountersMatch(self):
+        expected = User.objects.annotate(
+            expected_followers=Count('followers', distinct=True), expected_following=Count('following', distinct=True),
+        )
+        for user in expected:
+            self.assertEqual((user.follower_count, user.following_count), (user.expected_followers, user.expected_following),
+                             user.username)
+
+    def test_follow_and_unfollow(self):
+        anna, benn, cleo, dora = self.users
+        for follower, following in ((anna, benn), (cleo, benn), (benn, anna), (dora, anna)):
+            self.assertEqual(self.follow(follower, following).status_code, 200)
+        self.assertEqual(self.follow(anna, benn).status_code, 400)
+        self.assertCountersMatch()
+        self.assertEqual(User.objects.get(id=benn.id).follower_count, 2)
+
+        self.assertEqual(self.follow(anna, benn, 'delete').status_code, 200)
+        self.assertEqual(self.follow(anna, benn, 'delete').status_code, 400)
+        self.assertCountersMatch()
+
+    def test_user_deletion(self):
+        anna, benn, cleo, dora = self.users
+        for follower, following in ((anna, benn), (benn, cleo), (cleo, benn), (dora, benn)):
+            self.follow(follower, following)
+        User.objects.get(id=benn.id).delete()
+        self.assertCountersMatch()
+        self.assertEqual(User.objects.get(id=cleo.id).follower_count, 0)
+        self.assertEqual(User.objects.get(id=anna.id).following_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        anna, benn, _, _ = self.users
+        self.follow(anna, benn)
+        User.objects.filter(id=benn.id).update(follower_count=7)
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assertCountersMatch()
+
+
+class PageQueryCountTests(TestCase):
+    """Rendering a page of posts costs the same number of queries whatever its size."""
+
+    def setUp(self):
+        self.viewer = create_user('viewer')
+        self.authors = [create_user(f'author{i}') for i in range(4)]
+        parents = [Post.objects.create(author=author, content='parent') for author in self.authors]
+        self.posts = []
+        for i in range(20):
+            author, parent = self.authors[i % 4], parents[(i + 1) % 4]
+            fields = [{}, {'reply_parent': parent}, {'repost_parent': parent}][i % 3]
+            self.posts.append(Post.objects.create(author=author, content=f'post {i}', **fields))
+        PostLike.objects.create(post=self.posts[1], user=self.viewer)
+        Bookmark.objects.create(post=parents[0], user=self.viewer)
+        Follow.objects.create(follower=self.viewer, following=self.authors[2])
+
+    def page(self, size: int) -> list:
+        # fresh instances, as a page query returns them
+        return list(Post.objects.filter(id__in=[post.id for post in self.posts[:size]]))
+
+    def test_viewer_state(self):
+        for size in (3, 20):
+            posts = self.page(size)
+            viewer_state = ViewerState(self.viewer)
+            # follows, likes, bookmarks, reposts
+            with self.assertNumQueries(4):
+                viewer_state.load_posts(posts)
+            self.assertEqual(viewer_state.liked, {self.posts[1].id} & viewer_state.post_ids)
+            self.assertIn(self.authors[2].id, viewer_state.following)
+
+    def test_page_loader(self):
+        for size in (3, 20):
+            posts = self.page(size)
+            loader = PageLoader()
+            # parents, authors, images
+            with self.assertNumQueries(3):
+                loader.load_posts(posts)
+            with self.assertNumQueries(0):
+                for post in posts:
+                    for parent in (post.reply_parent, post.repost_parent):
+                        if parent is not None:
+                            self.assertIn(parent.author, self.authors)
+                    self.assertEqual(loader.images_of(post), [])
+
+    def test_serializer_page(self):
+        counts = []
+        for size in (3, 20):
+            request = APIRequestFactory().get('/api/posts/')
+            force_authenticate(request, user=self.viewer)
+            with CaptureQueriesContext(connection) as queries:
+                AugmentedPostPreviewSerializer(self.page(size), many=True, context={'request': Request(request)}).data
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class ReplyThreadTests(TestCase):
+    def setUp(self):
+        self.user = create_user('talker')
+        self.client = client_for(self.user)
+        self.start = timezone.now() - timedelta(hours=1)
+        self.root = Post.objects.create(author=self.user, content='root')
+
+    def reply(self, parent: Post, minutes: int) -> Post:
+        post = Post(author=self.user, content=f'reply at {minutes}')
+        attach_reply(post, parent)
+        post.save()
+        Post.objects.filter(id=post.id).update(created_at=self.start + timedelta(minutes=minutes))
+        return Post.objects.get(id=post.id)
+
+    def walk(self, post: Post, timestamp) -> list:
+        # the per-hop walk get_reply_thread_ids replaced
+        reply_list = list(post.replies.all().filter(created_at__lte=timestamp))
+        for reply in reply_list[:]:
+            next_reply = reply.replies.all().filter(created_at__lte=timestamp).order_by('-created_at').first()
+            while next_reply:
+                reply_list.append(next_reply)
+                next_reply = next_reply.replies.all().filter(created_at__lte=timestamp).order_by('-created_at').first()
+        return [reply.id for reply in reply_list]
+
+    def assertSameThread(self, post: Post, timestamp):
+        walked = self.walk(post, timestamp)
+        self.assertEqual(get_reply_thread_ids(post, timestamp), walked)
+        return walked
+
+    def test_thread_matches_the_recursive_walk(self):
+        first, second = self.reply(self.root, 1), self.reply(self.root, 2)
+        self.reply(first, 3)
+        latest = self.reply(first, 4)
+        self.reply(latest, 5)
+        branch = self.reply(second, 6)
+        self.reply(branch, 30)
+        self.reply(self.reply(self.root, 7), 8)
+
+        timestamp = self.start + timedelta(minutes=20)
+        walked = self.assertSameThread(self.root, timestamp)
+        self.assertEqual(len(walked), 7)
+        self.assertSameThread(first, timestamp)
+        self.assertSameThread(self.root, timezone.now())
+
+        response = self.client.get(f'/api/posts/{self.root.id}/replies/', {'cursor': ''})
+        self.assertEqual([post['id'] for post in response.data['results']],
+                         [str(post_id) for post_id in Post.objects.filter(id__in=self.walk(self.root, timezone.now())).values_list('id', flat=True)])
+
+    def test_reply_under_a_deleted_reply(self):
+        first = self.reply(self.root, 1)
+        earlier = self.reply(first, 2)
+        deleted = self.reply(first, 3)
+        self.reply(deleted, 4)
+        self.reply(earlier, 5)
+        deleted.delete()
+        # the chain under `first` now follows the earlier reply
+        walked = self.assertSameThread(self.root, timezone.now())
+        self.assertEqual(len(walked), 3)
+
+
+class PostHashtagTests(TestCase):
+    def setUp(self):
+        self.user = create_user('tagger')
+
+    def tags(self, post: Post) -> set:
+        return set(post.hashtags.values_list('name', flat=True))
+
+    def queries(self, post: Post, names, **kwargs) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            set_post_hashtags(post, names, **kwargs)
+        self.assertEqual(self.tags(post), {name for name in names if len(name) <= HASHTAG_MAX_LENGTH})
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_tags(self):
+        few = [f'few{i}' for i in range(3)]
+        many = [f'many{i}' for i in range(60)] + ['many1', 'many2', 'x' * (HASHTAG_MAX_LENGTH + 1)]
+        self.assertEqual(
+            self.queries(Post.objects.create(author=self.user, content='few'), few, created=True),
+            self.queries(Post.objects.create(author=self.user, content='many'), many, created=True),
+        )
+
+    def test_edits_attach_and_detach_in_bulk(self):
+        small, large = (Post.objects.create(author=self.user, content=content) for content in ('small', 'large'))
+        set_post_hashtags(small, ['a', 'b', 'c'], created=True)
+        set_post_hashtags(large, [f'tag{i}' for i in range(60)], created=True)
+        # keep some, drop some, add some, with repeats
+        edit_small = self.queries(small, ['b', 'c', 'd', 'd'])
+        edit_large = self.queries(large, [f'tag{i}' for i in range(30, 90)] + ['tag40', 'tag40'])
+        self.assertEqual(edit_small, edit_large)
+        # the detached tags stay for other posts
+        self.assertTrue(HashTag.objects.filter(name='a').exists())
+        self.assertEqual(self.queries(small, ['b', 'c', 'd']), 1)
+
+
+class NotificationApiTests(TestCase):
+    def setUp(self):
+        self.user, self.other, self.replier = create_user('recipient'), create_user('bystander'), create_user('replier')
+        self.client = client_for(self.user)
+        post = Post.objects.create(author=self.user, content='post')
+        other_post = Post.objects.create(author=self.other, content='other post')
+        self.notifications = [self.reply(post, i) for i in range(6)]
+        self.foreign = self.reply(other_post, 0)
+
+    def reply(self, parent: Post, i: int) -> Notification:
+        reply = Post(author=self.replier, content=f'reply {i}')
+        attach_reply(reply, parent)
+        reply.save()
+        return notify('reply', parent.author_id, reply)
+
+    def ids(self, *notifications: Notification) -> list:
+        return [str(notification.id) for notification in notifications]
+
+    def assertUnreadCount(self, count: int):
+        for user in (self.user, self.other):
+            expected = Notification.objects.filter(recipient=user, read=False).count()
+            self.assertEqual(User.objects.get(id=user.id).unread_notification_count, expected)
+        self.assertEqual(self.client.get('/api/notifications/', {'prefetch': 'true'}).data['count'], count)
+
+    def test_bulk_mark_read_with_mixed_ids(self):
+        self.assertUnreadCount(6)
+        first, second, third = self.notifications[:3]
+        response = self.client.patch('/api/notifications/', {'ids': self.ids(first, second)}, format='json')
+        self.assertEqual((response.data['updated'], response.data['unread_count']), (2, 4))
+        # already read, unread and someone else's
+        response = self.client.patch('/api/notifications/', {'ids': self.ids(first, third, self.foreign)}, format='json')
+        self.assertEqual((response.data['updated'], response.data['unread_count']), (1, 3))
+        self.assertFalse(Notification.objects.get(id=self.foreign.id).read)
+        self.assertUnreadCount(3)
+
+        response = self.client.patch('/api/notifications/', {}, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertUnreadCount(0)
+
+    def test_bulk_delete_with_mixed_ids(self):
+        first, second, third = self.notifications[:3]
+        self.client.patch('/api/notifications/', {'ids': self.ids(first)}, format='json')
+        response = self.client.delete('/api/notifications/', {'ids': self.ids(first, second, self.foreign)}, format='json')
+        self.assertEqual((response.data['deleted'], response.data['unread_count']), (2, 4))
+        self.assertTrue(Notification.objects.filter(id=self.foreign.id).exists())
+        self.assertUnreadCount(4)
+
+        response = self.client.delete('/api/notifications/', {'ids': self.ids(third, third)}, format='json')
+        self.assertEqual(response.data['deleted'], 1)
+        self.assertUnreadCount(3)
+
+    def test_cursor_selection(self):
+        page = self.client.get('/api/notifications/', {'cursor': ''}).data
+        # everything from the newest through the third newest
+        cursor = CursorPaginator(Notification.objects.all(), 20).encode_cursor(
+            [Notification.objects.get(id=page['results'][2]['id']).created_at, uuid.UUID(page['results'][2]['id'])], False)
+        response = self.client.patch('/api/notifications/', {'cursor': cursor}, format='json')
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(set(Notification.objects.filter(read=True).values_list('id', flat=True)),
+                         {uuid.UUID(result['id']) for result in page['results'][:3]})
+        self.assertUnreadCount(3)
+
+    def test_invalid_selections_are_rejected(self):
+        for data in ({'ids': ['not-a-uuid']}, {'ids': 'not-a-list'}, {'ids': [None]}, {'cursor': 'bad'}, {'timestamp': 'soon'}):
+            for method in (self.client.patch, self.client.delete):
+                self.assertEqual(method('/api/notifications/', data, format='json').status_code, 400, data)
+        self.assertUnreadCount(6)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = create_user('bearer')
+        get_user_cache().invalidate(self.user.id)
+
+    def authenticate(self, token):
+        request = APIRequestFactory().get('/api/get-current-user/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        user, _ = CachedJWTAuthentication().authenticate(request)
+        return user
+
+    def token(self):
+        return VersionedRefreshToken.for_user(User.objects.get(id=self.user.id)).access_token
+
+    def test_known_token_skips_the_database(self):
+        token = self.token()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(token), self.user)
+        with self.assertNumQueries(0):
+            first, second = self.authenticate(token), self.authenticate(token)
+        # each request gets its own copy
+        self.assertIsNot(first, second)
+
+    def test_profile_save_drops_the_cached_user(self):
+        token = self.token()
+        self.authenticate(token)
+        self.user.bio = 'Changed'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(token).bio, 'Changed')
+
+    def test_bumped_version_revokes_old_tokens(self):
+        old = self.token()
+        self.authenticate(old)
+        self.user.set_password('new password')
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(old)
+        self.assertEqual(self.authenticate(self.token()), self.user)
+
+
+class NotificationHydrationTests(TestCase):
+    def setUp(self):
+        self.user, self.fan = create_user('celebrity'), create_user('admirer')
+        self.post = Post.objects.create(author=self.user, content='post')
+        self.like = PostLike.objects.create(post=self.post, user=self.fan)
+        notify('like', self.user.id, self.like)
+        self.repost = Post.objects.create(author=self.fan, content='', repost_parent=self.post)
+        notify('repost', self.user.id, self.repost)
+        reply = Post(author=self.fan, content='reply')
+        attach_reply(reply, self.post)
+        reply.save()
+        notify('reply', self.user.id, reply)
+
+    def render(self, notifications) -> dict:
+        request = APIRequestFactory().get('/api/notifications/')
+        force_authenticate(request, user=self.user)
+        data = NotificationSerializer(notifications, many=True, context={'request': Request(request)}).data
+        return {notification['type']: notification['data'] for notification in data}
+
+    def test_page(self):
+        data = self.render(Notification.objects.filter(recipient=self.user))
+        self.assertEqual(data['like']['id'], str(self.like.id))
+        self.assertEqual(data['repost']['id'], str(self.repost.id))
+        self.assertEqual(data['reply']['content'], 'reply')
+
+    def test_deleted_like_and_repost(self):
+        self.like.delete()
+        self.repost.delete()
+        data = self.render(Notification.objects.filter(recipient=self.user))
+        self.assertIsNone(data['like'])
+        self.assertIsNone(data['repost'])
+
+    def test_deleted_while_the_page_renders(self):
+        notifications = list(Notification.objects.filter(recipient=self.user))
+        PostLike.objects.filter(id=self.like.id).delete()
+        Post.objects.filter(id__in=[self.repost.id] + [n.reply_id for n in notifications if n.reply_id]).delete()
+        data = self.render(notifications)
+        self.assertEqual(data, {'like': None, 'repost': None, 'reply': None})
+
+
+class MediaViewTests(TestCase):
+    digest = 'ab' * 32
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.media_root = os.path.join(cls.root, 'media')
+        cls.blob = f'blobs/ab/ab/{cls.digest}.png'
+        for name, content in [(os.path.join(cls.root, 'secret.txt'), b'secret'),
+                              (os.path.join(cls.media_root, cls.blob), b'blob'),
+                              (os.path.join(cls.media_root, 'profile_images', 'old photo.png'), b'legacy')]:
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+            with open(name, 'wb') as file:
+                file.write(content)
+        cls.settings_override = override_settings(MEDIA_ROOT=cls.media_root, MEDIA_ACCEL_REDIRECT='/protected-media/')
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def get(self, path: str, **headers):
+        return serve_media(RequestFactory().get('/media/' + path, **headers), path)
+
+    def test_path_traversal(self):
+        for path in ['../secret.txt', 'profile_images/../../secret.txt', os.path.join(self.root, 'secret.txt')]:
+            self.assertIsNone(lookup(path))
+            with self.assertRaises(Http404):
+                self.get(path)
+
+    def test_unreferenced_blob(self):
+        MediaBlob.objects.create(name=self.blob, size=4, ref_count=0)
+        self.assertIsNone(lookup(self.blob))
+        with self.assertRaises(Http404):
+            self.get(self.blob)
+        with self.assertRaises(Http404):
+            self.get('blobs/tmp/upload')
+
+    def test_blob(self):
+        MediaBlob.objects.create(name=self.blob, size=4, ref_count=1)
+        response = self.get(self.blob)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.blob)
+        self.assertEqual(response['ETag'], f'"{self.digest}"')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response.content, b'')
+
+        response = self.get(self.blob, HTTP_IF_NONE_MATCH=f'"{self.digest}"')
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    def test_legacy_file(self):
+        response = self.get('profile_images/old photo.png')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/profile_images/old%20photo.png')
+        self.assertTrue(response['ETag'].startswith('W/'))
+        with self.assertRaises(Http404):
+            self.get('profile_images')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT=None)
+    def test_without_accel_redirect(self):
+        MediaBlob.objects.create(name=self.blob, size=4, ref_count=1)
+        response = self.get(self.blob)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(b''.join(response.streaming_content), b'blob')
+        response.close()
+
+
+class VisitBufferTests(TestCase):
+    def setUp(self):
+        self.visitor, self.author = create_user('visitor'), create_user('poster')
+        self.post = Post.objects.create(author=self.author, content='post')
+        self.other_post = Post.objects.create(author=self.author, content='other post')
+        self.buffer = VisitBuffer(max_size=100, flush_interval=3600)
+        # midday, so a few minutes either way stay on the same day
+        self.now = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+    def view_count(self, post: Post) -> int:
+        return Post.objects.get(id=post.id).view_count
+
+    def test_dedupes_per_visitor_post_and_day(self):
+        for minutes in (0, 1, 2):
+            self.buffer.record(self.visitor.id, self.post.id, self.now - timedelta(days=2, minutes=minutes))
+        self.buffer.record(self.visitor.id, self.other_post.id, self.now - timedelta(days=2))
+        self.buffer.record(self.visitor.id, self.post.id, self.now)
+        self.assertEqual(len(self.buffer.pending), 3)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.pending, {})
+        self.assertEqual(VisitRecord.objects.filter(post=self.post).count(), 2)
+        self.assertEqual(self.view_count(self.post), 2)
+        self.assertEqual(self.view_count(self.other_post), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_flush_skips_visits_recorded_within_a_day(self):
+        VisitRecord.objects.create(visitor=self.visitor, post=self.post, created_at=self.now - timedelta(hours=1))
+        self.buffer.record(self.visitor.id, self.post.id, self.now)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.view_count(self.post), 0)
+
+    def test_full_buffer_flushes_on_record(self):
+        buffer = VisitBuffer(max_size=2, flush_interval=3600)
+        buffer.record(self.visitor.id, self.post.id, self.now)
+        self.assertEqual(VisitRecord.objects.count(), 0)
+        buffer.record(self.visitor.id, self.other_post.id, self.now)
+        self.assertEqual(buffer.pending, {})
+        self.assertEqual(VisitRecord.objects.count(), 2)
+
+    def test_post_views(self):
+        client = client_for(self.visitor)
+        with mock.patch('core.utils.get_visit_buffer', return_value=self.buffer):
+            for _ in range(3):
+                self.assertEqual(client.get(f'/api/posts/{self.post.id}/').status_code, 200)
+            client.get(f'/api/posts/{self.other_post.id}/')
+        self.assertEqual(len(self.buffer.pending), 2)
+        self.assertEqual(self.view_count(self.post), 0)
+
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(self.view_count(self.post), 1)
+        self.assertEqual(self.view_count(self.other_post), 1)
+
+
+class PostRatingTests(TestCase):
+    def setUp(self):
+        self.author = create_user('rated')
+        rng = random.Random(5)
+        for _ in range(60):
+            post = Post.objects.create(author=self.author, content='post')
+            # small counts tie often, large ones saturate the sigmoid
+            counts = {field: rng.choice([0, 1, 2, rng.randint(0, 50), rng.randint(0, 10 ** 6)])
+                      for field in RATING_COUNTER_FIELDS}
+            Post.objects.filter(id=post.id).update(**counts)
+        self.posts = Post.objects.order_by('-created_at', '-id')
+
+    def old_ratings(self, posts) -> dict:
+        # the per-post formula rank_post_ids replaced
+        posts = list(posts)
+        scores = [[sigmoid(getattr(post, field)) for field in RATING_COUNTER_FIELDS] for post in posts]
+        max_scores = [max(max(column), 0) for column in zip(*scores)]
+        ratings = {}
+        for i, (post, row) in enumerate(zip(posts, scores)):
+            normalized = [score / max_score if max_score > 0 else 0 for score, max_score in zip(row, max_scores)]
+            ratings[post.id] = sum(score * 0.1 for score in normalized) + (len(posts) - i) / len(posts) * 0.5
+        return ratings
+
+    def test_ranking_matches_the_old_formula(self):
+        ratings = self.old_ratings(self.posts)
+        ranked = rank_post_ids(self.posts)
+        self.assertEqual(sorted(ranked), sorted(ratings))
+        for better, worse in zip(ranked, ranked[1:]):
+            self.assertGreaterEqual(ratings[better], ratings[worse] - RATING_TOLERANCE)
+
+    def test_without_engagement_recency_decides(self):
+        self.assertEqual(rank_post_ids(Post.objects.none()), [])
+        Post.objects.update(**{field: 0 for field in RATING_COUNTER_FIELDS})
+        self.assertEqual(rank_post_ids(self.posts), list(self.posts.values_list('id', flat=True)))
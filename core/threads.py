@@ -0,0 +1,78 @@
+from datetime import datetime
+from typing import List
+from uuid import UUID
+
+from django.db.models import Q
+
+from .models import Post
+
+# Every reply records the root post of its conversation and its depth below
+# it, so a whole thread (or the ancestors of any reply in it) is fetched with
+# one indexed query on (conversation_root, reply_depth) and the tree is then
+# walked in memory instead of one query per hop.
+
+
+def attach_reply(post: Post, parent: Post):
+    post.reply_parent = parent
+    post.conversation_root_id = parent.conversation_root_id or parent.id
+    post.reply_depth = parent.reply_depth + 1
+
+
+def _conversation(post: Post):
+    root_id = post.conversation_root_id or post.id
+    return Post.objects.filter(Q(conversation_root_id=root_id) | Q(id=root_id))
+
+
+def get_reply_thread_ids(post: Post, timestamp: datetime) -> List[UUID]:
+    """
+    Ids of the direct replies of `post` (newest first) followed, for each of
+    them in turn, by the chain formed by always following the latest reply.
+    """
+    rows = _conversation(post).filter(reply_depth__gt=post.reply_depth, created_at__lte=timestamp) \
+        .values_list('id', 'reply_parent_id', 'created_at')
+
+    latest_reply = {}
+    direct_replies = []
+    for post_id, parent_id, created_at in rows:
+        if parent_id == post.id:
+            direct_replies.append((created_at, post_id))
+        current = latest_reply.get(parent_id)
+        if current is None or created_at > current[1]:
+            latest_reply[parent_id] = (post_id, created_at)
+    direct_replies = [reply_id for _, reply_id in sorted(direct_replies, reverse=True)]
+
+    thread = list(direct_replies)
+    for reply_id in direct_replies:
+        next_reply = latest_reply.get(reply_id)
+        while next_reply is not None:
+            thread.append(next_reply[0])
+            next_reply = latest_reply.get(next_reply[0])
+    return thread
+
+
+def load_ancestors(post: Post) -> List[Post]:
+    """
+    Loads the reply chain above `post` (parent first) with two queries and
+    caches each `reply_parent` on the instances so walking up the chain
+    afterwards does not hit the database.
+    """
+    if post.reply_parent_id is None:
+        return []
+
+    parents = dict(_conversation(post).filter(reply_depth__lt=post.reply_depth).values_list('id', 'reply_parent_id'))
+    chain_ids = []
+    parent_id = post.reply_parent_id
+    while parent_id is not None and parent_id in parents:
+        chain_ids.append(parent_id)
+        parent_id = parents[parent_id]
+
+    loaded = Post.objects.in_bulk(chain_ids)
+    ancestors = []
+    child = post
+    for ancestor_id in chain_ids:
+        if ancestor_id not in loaded:
+            break
+        child.reply_parent = loaded[ancestor_id]
+        child = loaded[ancestor_id]
+        ancestors.append(child)
+    return ancestors
@@ -0,0 +1,31 @@
+from .models import Post, Follow, TimelineEntry, User
+from .events import publish_event
+
+# Home timelines are materialized on write: every post is copied into the
+# timeline of its author and of each of the author's followers, so reading a
+# feed page is a range scan on (owner, created_at) instead of a join through
+# the follow graph.
+
+BULK_BATCH_SIZE = 1000
+
+
+def fan_out_post(post: Post):
+    owner_ids = [post.author_id]
+    owner_ids += Follow.objects.filter(following_id=post.author_id).values_list('follower_id', flat=True)
+    entries = [TimelineEntry(owner_id=owner_id, post_id=post.id, created_at=post.created_at) for owner_id in owner_ids]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+    publish_event(owner_ids[1:], 'new_post', post_id=str(post.id), author_id=str(post.author_id))
+
+
+def backfill_timeline(owner: User, author: User):
+    posts = Post.objects.filter(author=author).values_list('id', 'created_at')
+    entries = [TimelineEntry(owner_id=owner.id, post_id=post_id, created_at=created_at) for post_id, created_at in posts]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+
+def prune_timeline(owner: User, author: User):
+    TimelineEntry.objects.filter(owner=owner, post__author=author).delete()
+
+
+def get_timeline(owner: User):
+    return TimelineEntry.objects.filter(owner=owner).select_related('post').order_by('-created_at', '-id')
@@ -0,0 +1,82 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Optional
+
+from django.conf import settings
+from django.db.models import Value
+from django.db.models.functions import Greatest, Least, Log, Power
+from django.utils import timezone
+
+from .models import Post
+
+# A trending score is the sum of the weights of the engagement events of a
+# post (its creation counting TRENDING_BASE_SCORE), each halved every
+# half-life since it happened. Scores are stored as log2 of that sum measured
+# at the fixed TRENDING_EPOCH instead of now, i.e. log2(weight) plus the
+# half-lives from the epoch to the event. The difference to the decayed score
+# of today is log2 and the same offset for every post, so ordering by the
+# stored value is ordering by the decayed score at any moment, while a stored
+# value only changes when the post gains engagement (see
+# core.counters.increment_post_counters). Nothing has to decay the rows and
+# a cursor over TRENDING_ORDERING stays valid. Changing
+# TRENDING_HALF_LIFE_HOURS needs a rebuild_trending_scores run.
+
+TRENDING_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+TRENDING_BASE_SCORE = 1.0
+TRENDING_WEIGHTS = {
+    'like_count': 1.0,
+    'view_count': 0.2,
+    'bookmark_count': 1.5,
+    'reply_count': 2.0,
+    'repost_count': 2.0,
+}
+TRENDING_ORDERING = ('-trending_score', '-id')
+
+
+def get_half_life() -> timedelta:
+    return timedelta(hours=getattr(settings, 'TRENDING_HALF_LIFE_HOURS', 24))
+
+
+def epoch_half_lives(at: datetime) -> float:
+    return (at - TRENDING_EPOCH) / get_half_life()
+
+
+def event_score(weight: float, at: Optional[datetime] = None) -> float:
+    """The stored score of a single event of `weight` happening `at` (now by default)."""
+    return math.log2(weight) + epoch_half_lives(at or timezone.now())
+
+
+def initial_trending_score(at: Optional[datetime] = None) -> float:
+    return event_score(TRENDING_BASE_SCORE, at)
+
+
+def add_event_score(current, score: float):
+    """An expression adding the event `score` to the stored score `current`, log2(2 ** a + 2 ** b)."""
+    high = Greatest(current, Value(score))
+    low = Least(current, Value(score))
+    # 2 ** -1000 adds nothing to 1.0 already, and the float8 power of
+    # PostgreSQL raises an underflow error for gaps past about -1075
+    return high + Log(Value(2.0), Value(1.0) + Power(Value(2.0), Greatest(low - high, Value(-1000.0))))
+
+
+def engagement_score(deltas: dict) -> float:
+    return sum(TRENDING_WEIGHTS[field] * delta for field, delta in deltas.items() if field in TRENDING_WEIGHTS and delta > 0)
+
+
+def rebuild_trending_scores(batch_size: int = 1000) -> int:
+    """
+    Recomputes every score from the post counters, counting all engagement
+    at the creation of the post since the timing of individual events is not
+    stored.
+    """
+    fields = ['id', 'created_at'] + list(TRENDING_WEIGHTS)
+    batch = []
+    rebuilt = 0
+    for row in Post.objects.values(*fields).iterator(chunk_size=batch_size):
+        score = event_score(TRENDING_BASE_SCORE + engagement_score(row), row['created_at'])
+        batch.append(Post(id=row['id'], trending_score=score))
+        if len(batch) >= batch_size:
+            rebuilt += Post.objects.bulk_update(batch, ['trending_score'])
+            batch = []
+    rebuilt += Post.objects.bulk_update(batch, ['trending_score'])
+    return rebuilt
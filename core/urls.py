@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import auth_views, user_views, post_views, search_views, notification_views, debug_views
+from .views import auth_views, user_views, post_views, search_views, notification_views, debug_views, event_views
 from rest_framework_simplejwt.views import TokenObtainPairView
 
 urlpatterns = [
@@ -27,6 +27,8 @@ urlpatterns = [
     path('search/hashtags/', search_views.SearchHashtagView.as_view()),
     path('notifications/', notification_views.NotificationListView.as_view()),
     path('notifications/<uuid:notificationId>/', notification_views.NotificationView.as_view()),
+    path('events/', event_views.event_stream),
+    path('events/ticket/', event_views.EventTicketView.as_view()),
     path('bookmarks/', post_views.BookmarkListView.as_view()),
     path('debug/', debug_views.DebugView.as_view()),
     path('debug/user-input/', debug_views.UserInputView.as_view()),
@@ -1,9 +1,13 @@
 from .models import Post, User, VisitRecord, PostLike
+from .pagination import CursorPage
+from .visits import get_visit_buffer
 from datetime import datetime
 from django.core.paginator import Paginator, Page
 from rest_framework.serializers import Serializer
 from rest_framework.request import Request
-from typing import Optional, Union
+from typing import List, Optional, Union
+from uuid import UUID
+import numpy as np
 import math
 from datetime import timezone
 import re
@@ -17,22 +21,24 @@ def is_valid_utc_timestamp(timestamp: Union[str, float, int]):
         return False  # ValueError indicates an invalid timestamp
 
 def add_visit_record(visitor, post):
-    now = datetime.now(timezone.utc)
-    last_visit = VisitRecord.objects.filter(visitor=visitor, post=post).order_by('-created_at').first()
-    if last_visit:
-      duration = now - last_visit.created_at
-      if duration.days > 0:
-        VisitRecord.objects.create(visitor=visitor, post=post)
-    else:
-      VisitRecord.objects.create(visitor=visitor, post=post)
+    get_visit_buffer().record(visitor.id, post.id)
     
     
-def get_page_response(page: Page, request: Request, serializer_class: Optional[Serializer] = None):
+def get_page_response(page: Union[Page, CursorPage], request: Request, serializer_class: Optional[Serializer] = None):
     data = None
     if serializer_class is None:
       data = page.object_list
+    elif getattr(serializer_class, 'fast_serializer', None) is not None:
+      data = serializer_class.fast_serializer(page.object_list, {'request': request})
     else:
       data = serializer_class(page.object_list, many=True, context={'request': request}).data
+    if isinstance(page, CursorPage):
+      return {
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+        'results': data,
+        'page_size': page.per_page
+      }
     return {
       'count': page.paginator.count,
       'total_pages': page.paginator.num_pages,
@@ -47,59 +53,80 @@ def sigmoid(x):
     return 2000 / (1 + math.exp(-0.005 * x)) - 1000
 
 
-def sort_posts_by_rating(posts):
-    post_meta = []
+RATING_COUNTER_FIELDS = ['like_count', 'view_count', 'bookmark_count', 'reply_count', 'repost_count']
+RATING_TOLERANCE = 1e-9
+
+
+def rank_post_ids(posts) -> List[UUID]:
+    """
+    Ranks a queryset of posts, given in recency order, by engagement and
+    returns their ids best first. The counters of the whole candidate set are
+    read with one query and scored as arrays.
+    """
+    rows = list(posts.values_list('id', *RATING_COUNTER_FIELDS))
+    if len(rows) == 0:
+      return []
+    
+    ids = [row[0] for row in rows]
+    counts = np.array([row[1:] for row in rows], dtype=np.int64)
+    n = len(rows)
+    
+    # sigmoid as one array operation; np.exp may round differently from
+    # math.exp in the last bit, so ratings agree with the scalar formula to
+    # within RATING_TOLERANCE and only posts rated that close can swap places
+    scores = 2000 / (1 + np.exp(-0.005 * counts)) - 1000
     
-    max_like_score = 0
-    max_view_score = 0
-    max_bookmark_score = 0
-    max_comment_score = 0
-    max_repost_score = 0
-    i = 0
-    for post in posts:
-      likes = post.likes.count()
-      views = post.visits.count()
-      bookmarks = post.bookmarks.count()
-      comments = post.replies.count()
-      reposts = post.reposts.count()
-      time_score = len(posts) - i
-      likes_score = sigmoid(likes)
-      views_score = sigmoid(views)
-      bookmarks_score = sigmoid(bookmarks)
-      comments_score = sigmoid(comments)
-      reposts_score = sigmoid(reposts)
-      
-      max_like_score = max(max_like_score, likes_score)
-      max_view_score = max(max_view_score, views_score)
-      max_bookmark_score = max(max_bookmark_score, bookmarks_score)
-      max_comment_score = max(max_comment_score, comments_score)
-      max_repost_score = max(max_repost_score, reposts_score)
-      
-      post_meta.append({
-        'post': post,
-        'like_score': likes_score,
-        'view_score': views_score,
-        'bookmark_score': bookmarks_score,
-        'comment_score': comments_score,
-        'repost_score': reposts_score,
-        'time_score': time_score
-      })
-      i += 1
-      
     # normalize the scores
-    for meta in post_meta:
-      meta['like_score'] = meta['like_score'] / max_like_score if max_like_score > 0 else 0
-      meta['view_score'] = meta['view_score'] / max_view_score if max_view_score > 0 else 0
-      meta['bookmark_score'] = meta['bookmark_score'] / max_bookmark_score if max_bookmark_score > 0 else 0
-      meta['comment_score'] = meta['comment_score'] / max_comment_score if max_comment_score > 0 else 0
-      meta['repost_score'] = meta['repost_score'] / max_repost_score if max_repost_score > 0 else 0
-      meta['time_score'] = meta['time_score'] / len(posts) if len(posts) > 0 else 0
-      
-    sorted_post_meta = sorted(post_meta, key=lambda x: x['like_score'] * 0.1 + x['view_score'] * 0.1 + x['bookmark_score'] * 0.1 + x['comment_score'] * 0.1 + x['repost_score'] * 0.1 + x['time_score'] * 0.5, reverse=True)
+    max_scores = np.maximum(scores.max(axis=0), 0)
+    normalized = np.where(max_scores > 0, scores / np.where(max_scores > 0, max_scores, 1), 0.0)
+    time_scores = (n - np.arange(n)) / n
     
-    return [meta['post'] for meta in sorted_post_meta]
+    like_scores, view_scores, bookmark_scores, comment_scores, repost_scores = normalized.T
+    ratings = like_scores * 0.1 + view_scores * 0.1 + bookmark_scores * 0.1 + comment_scores * 0.1 + repost_scores * 0.1 + time_scores * 0.5
+    
+    order = np.argsort(-ratings, kind='stable')
+    return [ids[i] for i in order]
+
+
+def hydrate_posts(ids: List[UUID]) -> List[Post]:
+    posts = Post.objects.in_bulk(ids)
+    return [posts[id] for id in ids if id in posts]
+
+
+def sort_posts_by_rating(posts):
+    return hydrate_posts(rank_post_ids(posts))
       
 def is_hashtag(text: str)->bool:
     pattern = r'^#\b[A-Za-z][A-Za-z0-9]*\b$'
     match = re.match(pattern, text)
-    return match is not None
\ No newline at end of file
+    return match is not None
+
+# One pass over the text yields both the hashtags (`#` followed by a letter and
+# alphanumerics, standing alone between whitespace, same rule as is_hashtag)
+# and the plain words, so hashtag extraction and search indexing agree on what
+# a token is.
+TOKEN_PATTERN = re.compile(r'(?<!\S)#(?P<hashtag>[A-Za-z][A-Za-z0-9]*)(?!\S)|(?P<word>\w+)')
+
+
+def iter_tokens(text: str):
+    for match in TOKEN_PATTERN.finditer(text or ''):
+      if match.group('hashtag') is not None:
+        yield 'hashtag', match.group('hashtag')
+      else:
+        yield 'word', match.group('word')
+
+
+# longer tags are not extracted
+HASHTAG_MAX_LENGTH = 100
+
+
+def extract_hashtags(text: str) -> List[str]:
+    tags = []
+    for kind, value in iter_tokens(text):
+      if kind == 'hashtag' and len(value) <= HASHTAG_MAX_LENGTH and value not in tags:
+        tags.append(value)
+    return tags
+
+
+def tokenize(text: str) -> List[str]:
+    return [value.lower() for _, value in iter_tokens(text)]
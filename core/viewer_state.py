@@ -0,0 +1,67 @@
+from typing import Iterable
+
+from .models import Post, PostLike, Bookmark, Follow, User
+
+
+class ViewerState:
+    """
+    Viewer-dependent flags (liked / bookmarked / reposted) for every post and
+    is_following for every user a serializer is about to render, resolved
+    with one query per relation and kept in memory for the rest of the
+    request. Lives in the serializer context under `viewer_state`.
+    """
+
+    def __init__(self, user: User):
+        self.user = user
+        self.post_ids = set()
+        self.liked = set()
+        self.bookmarked = set()
+        self.reposted = set()
+        self.user_ids = set()
+        self.following = set()
+
+    def load_posts(self, posts: Iterable[Post]):
+        post_ids = set()
+        author_ids = set()
+        for post in posts:
+            # nested parents are rendered too, their ids are known without a query
+            post_ids.update(filter(None, (post.id, post.repost_parent_id, post.reply_parent_id)))
+            author_ids.add(post.author_id)
+            for field in ('repost_parent', 'reply_parent'):
+                if getattr(Post, field).is_cached(post) and getattr(post, field) is not None:
+                    author_ids.add(getattr(post, field).author_id)
+        self.load_user_ids(author_ids)
+        self.load_post_ids(post_ids)
+
+    def load_post_ids(self, post_ids: Iterable):
+        post_ids = set(post_ids) - self.post_ids
+        if not post_ids:
+            return
+
+        self.post_ids |= post_ids
+        self.liked.update(PostLike.objects.filter(user=self.user, post_id__in=post_ids).values_list('post_id', flat=True))
+        self.bookmarked.update(Bookmark.objects.filter(user=self.user, post_id__in=post_ids).values_list('post_id', flat=True))
+        self.reposted.update(Post.objects.filter(author=self.user, repost_parent_id__in=post_ids).values_list('repost_parent_id', flat=True))
+
+    def load_users(self, users: Iterable[User]):
+        self.load_user_ids(user.id for user in users)
+
+    def load_user_ids(self, user_ids: Iterable):
+        user_ids = set(user_ids) - self.user_ids
+        if not user_ids:
+            return
+
+        self.user_ids |= user_ids
+        self.following.update(Follow.objects.filter(follower=self.user, following_id__in=user_ids).values_list('following_id', flat=True))
+
+    def covers(self, post: Post) -> bool:
+        return post.id in self.post_ids
+
+    def covers_user(self, user: User) -> bool:
+        return user.id in self.user_ids
+
+
+def get_viewer_state(context: dict) -> ViewerState:
+    if 'viewer_state' not in context:
+        context['viewer_state'] = ViewerState(context['request'].user)
+    return context['viewer_state']
@@ -2,10 +2,11 @@ from rest_framework.generics import get_object_or_404, GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.tokens import RefreshToken
 
 from core.models import User
 from core.serializers import UserSerializer, UserLoginSerializer
+from core.images import generate_image_variants
+from core.authentication import VersionedRefreshToken
 
 class UserLogin(TokenObtainPairView):
     serializer_class = UserLoginSerializer
@@ -30,8 +31,9 @@ class UserCreate(TokenObtainPairView):
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        serializer.save()
-        refresh = RefreshToken.for_user(serializer.instance)
+        user = serializer.save()
+        generate_image_variants([user.profile_image.name])
+        refresh = VersionedRefreshToken.for_user(serializer.instance)
         return Response({
           'refresh': str(refresh),
           'access': str(refresh.access_token),
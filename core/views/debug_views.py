@@ -5,7 +5,7 @@ from rest_framework import status
 from core.models import Post, User, PostImage, Visitor, Log
 from ..serializers import AugmentedPostPreviewSerializer, UserProfileSerializer, LogSerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from ..authentication import CachedJWTAuthentication
 from django.db.models import Q
 
 import os
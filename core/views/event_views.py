@@ -0,0 +1,121 @@
+import asyncio
+import json
+import secrets
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.generics import GenericAPIView
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from ..authentication import CachedJWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from ..events import get_broker
+from ..models import StreamTicket
+from ..notifications import get_unread_count
+
+# Server-sent events stream for the current user:
+#   event: unread_count  data: {"type": "unread_count", "count": 3}
+#   event: new_posts     data: {"type": "new_posts", "count": 2, "post_id": "..."}
+# The unread count is sent once on connect and then on every change;
+# new_posts counts the posts added to the home feed since the stream opened.
+# An open stream only waits on its queue, so idle clients cost no queries.
+# Streams end after MAX_STREAM_AGE seconds and EventSource reconnects on its
+# own, so a stream whose client vanished without the server noticing does not
+# hold its subscription forever.
+#
+# EventSource cannot set headers, and query strings end up in access logs, so
+# a browser does not put its access token in the URL: it POSTs to
+# /api/events/ticket/ with the token in the header and opens the stream with
+# ?ticket=, a key that works once within STREAM_TICKET_TTL seconds.
+
+KEEPALIVE_INTERVAL = 15
+MAX_STREAM_AGE = 300
+RETRY_MILLISECONDS = 5000
+STREAM_TICKET_TTL = 30
+
+
+def issue_stream_ticket(user) -> str:
+  now = timezone.now()
+  StreamTicket.objects.filter(expires_at__lt=now).delete()
+  ticket = StreamTicket.objects.create(key=secrets.token_urlsafe(32), user=user, expires_at=now + timedelta(seconds=STREAM_TICKET_TTL))
+  return ticket.key
+
+
+def redeem_stream_ticket(key: str):
+  with transaction.atomic():
+    ticket = StreamTicket.objects.select_for_update().select_related('user').filter(key=key, expires_at__gt=timezone.now()).first()
+    if ticket is None:
+      return None
+    ticket.delete()
+  return ticket.user if ticket.user.is_active else None
+
+
+def authenticate(request):
+  ticket = request.GET.get('ticket')
+  if ticket is not None:
+    return redeem_stream_ticket(ticket)
+  authentication = CachedJWTAuthentication()
+  header = authentication.get_header(request)
+  raw_token = authentication.get_raw_token(header) if header is not None else None
+  if raw_token is None:
+    return None
+  return authentication.get_user(authentication.get_validated_token(raw_token))
+
+
+class EventTicketView(GenericAPIView):
+  permission_classes = [IsAuthenticated]
+  authentication_classes = [CachedJWTAuthentication]
+  
+  def post(self, request):
+    return Response({'ticket': issue_stream_ticket(request.user), 'expires_in': STREAM_TICKET_TTL}, status=status.HTTP_201_CREATED)
+
+
+def format_event(event: dict) -> str:
+  return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream_events(user, unread_count: int):
+  loop = asyncio.get_running_loop()
+  broker = get_broker()
+  subscription = broker.subscribe(user.id)
+  new_posts = 0
+  closes_at = loop.time() + MAX_STREAM_AGE
+  try:
+    yield f'retry: {RETRY_MILLISECONDS}\n\n'
+    yield format_event({'type': 'unread_count', 'count': unread_count})
+    while loop.time() < closes_at:
+      try:
+        timeout = min(KEEPALIVE_INTERVAL, closes_at - loop.time())
+        event = await asyncio.wait_for(subscription.get(), timeout=timeout)
+      except asyncio.TimeoutError:
+        yield ': keepalive\n\n'
+        continue
+      if event['type'] == 'new_post':
+        new_posts += 1
+        event = {'type': 'new_posts', 'count': new_posts, 'post_id': event['post_id']}
+      yield format_event(event)
+  finally:
+    broker.unsubscribe(subscription)
+
+
+async def event_stream(request):
+  if request.method != 'GET':
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+  try:
+    user = await sync_to_async(authenticate)(request)
+  except (InvalidToken, AuthenticationFailed):
+    user = None
+  if user is None:
+    return JsonResponse({'error': 'Authentication credentials were not provided or are invalid'}, status=401)
+
+  unread_count = await sync_to_async(get_unread_count)(user)
+  response = StreamingHttpResponse(stream_events(user, unread_count), content_type='text/event-stream')
+  response['Cache-Control'] = 'no-cache'
+  # let nginx pass events through as they are written
+  response['X-Accel-Buffering'] = 'no'
+  return response
@@ -0,0 +1,67 @@
+import mimetypes
+import os
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+
+from ..models import MediaBlob
+from ..storage import BLOB_DIR, BLOB_TEMP_DIR, is_blob
+
+# Uploaded media. The view only decides whether a file may be served and what
+# its validators are; with MEDIA_ACCEL_REDIRECT set, nginx sends the bytes
+# from its internal location (sendfile, byte ranges) and the server worker is
+# free as soon as the headers are written. Blobs are named by the digest of
+# their content, so the digest is their ETag and they can be cached forever;
+# a blob nothing refers to anymore is not served. Files stored before the
+# blob storage get a size/mtime ETag and a shorter lifetime.
+
+BLOB_MAX_AGE = 60 * 60 * 24 * 365
+LEGACY_MAX_AGE = 60 * 60 * 24
+
+
+def lookup(path: str):
+  """The ETag and Cache-Control of the media file at `path`, None if it is not served."""
+  if is_blob(path):
+    if path.startswith(BLOB_TEMP_DIR + '/') or not MediaBlob.objects.filter(name=path, ref_count__gt=0).exists():
+      return None
+    digest = os.path.splitext(os.path.basename(path))[0]
+    return f'"{digest}"', f'public, max-age={BLOB_MAX_AGE}, immutable'
+
+  if path.startswith(BLOB_DIR + '/'):
+    return None
+  try:
+    stat = os.stat(safe_join(settings.MEDIA_ROOT, path))
+  except (OSError, ValueError, SuspiciousFileOperation):
+    return None
+  if not S_ISREG(stat.st_mode):
+    return None
+  return f'W/"{stat.st_size:x}-{int(stat.st_mtime):x}"', f'public, max-age={LEGACY_MAX_AGE}'
+
+
+def serve_media(request, path):
+  if request.method not in ('GET', 'HEAD'):
+    return HttpResponseNotAllowed(['GET', 'HEAD'])
+  validators = lookup(path)
+  if validators is None:
+    raise Http404('Media not found')
+  etag, cache_control = validators
+
+  # a matching If-None-Match is answered here, without nginx
+  response = get_conditional_response(request, etag=etag)
+  if response is None:
+    accel_redirect = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if accel_redirect is not None:
+      # nginx keeps Content-Type and Cache-Control and fills in the body
+      response = HttpResponse(content_type=content_type)
+      response['X-Accel-Redirect'] = accel_redirect + quote(path)
+    else:
+      response = FileResponse(open(safe_join(settings.MEDIA_ROOT, path), 'rb'), content_type=content_type)
+  response['ETag'] = etag
+  response['Cache-Control'] = cache_control
+  return response
@@ -5,68 +5,111 @@ from rest_framework import status
 from core.models import PostImage, Post, User, PostImage, Bookmark, Notification
 from ..serializers import NotificationModelSerializer, NotificationSerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from ..authentication import CachedJWTAuthentication
 from django.db.models import Q
 from django.utils import timezone
 from datetime import datetime
 from ..utils import is_valid_utc_timestamp, get_page_response
 from django.core.paginator import Paginator
+from ..pagination import paginate, CursorPaginator
+from ..notifications import get_unread_count, mark_notifications_read, delete_notifications
+from uuid import UUID
+
+def select_notifications(request, notifications):
+  """
+  Narrows `notifications` by the request: `ids` (a list of notification ids),
+  `cursor` (a cursor from the list, selecting everything from the newest
+  notification through the one it points at), `timestamp` (everything created
+  up to that UTC timestamp), or nothing for all of them.
+  Returns the queryset and an error message.
+  """
+  data = request.data if request.data else request.query_params
+  
+  if 'ids' in data:
+    ids = data.getlist('ids') if hasattr(data, 'getlist') else data['ids']
+    if not isinstance(ids, list):
+      return None, 'Invalid ids'
+    try:
+      ids = [UUID(str(id)) for id in ids]
+    except ValueError:
+      return None, 'Invalid ids'
+    return notifications.filter(id__in=ids), None
+  
+  if 'cursor' in data:
+    return notifications.filter(CursorPaginator(notifications, 20).up_to(str(data['cursor']))), None
+  
+  if 'timestamp' in data:
+    timestamp_str = str(data['timestamp'])
+    if not is_valid_utc_timestamp(timestamp_str):
+      return None, 'Invalid timestamp'
+    return notifications.filter(created_at__lte=datetime.utcfromtimestamp(float(timestamp_str))), None
+  
+  return notifications, None
+
 
 class NotificationListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = NotificationModelSerializer
   
   def get(self, request):
     prefetch = request.query_params.get('prefetch', 'false')
     
     if prefetch == 'true':
-      unread_count = Notification.objects.filter(recipient=request.user, read=False).count()
+      unread_count = get_unread_count(request.user)
       return Response({
         "count": unread_count
       }, status=status.HTTP_200_OK)
     
-    page = request.query_params.get('page', 1)
     timestamp_str = request.query_params.get('timestamp', None)
     if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
       return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
     timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-    notifications = Notification.objects.filter(recipient=request.user).filter(created_at__lte=timestamp).order_by('-created_at')
-    paginator = Paginator(notifications, 20)
-    page = paginator.page(page)
+    notifications = Notification.objects.filter(recipient=request.user).filter(created_at__lte=timestamp)
+    page = paginate(request, notifications, 20)
     response = get_page_response(page, request, NotificationSerializer)
     return Response(response, status=status.HTTP_200_OK)
   
   def patch(self, request):
-    notifications = Notification.objects.filter(recipient=request.user)
-    for notification in notifications:
-      notification.is_seen = True
-      notification.save()
-    return Response({'message': 'All notifications marked as seen'}, status=status.HTTP_200_OK)
+    notifications, error = select_notifications(request, Notification.objects.filter(recipient=request.user))
+    if error is not None:
+      return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    updated = mark_notifications_read(request.user, notifications)
+    return Response({
+      'message': 'Notifications marked as read',
+      'updated': updated,
+      'unread_count': get_unread_count(request.user),
+    }, status=status.HTTP_200_OK)
     
   def delete(self, request):
-    notifications = Notification.objects.filter(recipient=request.user)
-    notifications.delete()
-    return Response({'message': 'All notifications deleted'}, status=status.HTTP_200_OK)
+    notifications, error = select_notifications(request, Notification.objects.filter(recipient=request.user))
+    if error is not None:
+      return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    deleted = delete_notifications(request.user, notifications)
+    return Response({
+      'message': 'Notifications deleted',
+      'deleted': deleted,
+      'unread_count': get_unread_count(request.user),
+    }, status=status.HTTP_200_OK)
   
 class NotificationView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = NotificationModelSerializer
   
   def patch(self, request, notificationId):
     notification = get_object_or_404(Notification, id=notificationId)
     if notification.recipient != request.user:
       return Response({'error': 'You are not authorized to mark this notification as seen'}, status=status.HTTP_403_FORBIDDEN)
-    notification.read = True
-    notification.save()
+    if mark_notifications_read(request.user, Notification.objects.filter(id=notification.id)):
+      notification.read = True
     serializer = NotificationSerializer(notification, context={'request': request})
     return Response(serializer.data, status=status.HTTP_200_OK)
   
 
 # class NotificationPrefetch(GenericAPIView):
 #   permission_classes = [IsAuthenticated]
-#   authentication_classes = [JWTAuthentication]
+#   authentication_classes = [CachedJWTAuthentication]
 #   serializer_class = NotificationModelSerializer
   
 #   def get(self, request):
@@ -2,21 +2,29 @@ from rest_framework.generics import get_object_or_404, GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from core.models import PostImage, Post, User, PostImage, Bookmark, Notification
+from core.models import PostImage, Post, User, Bookmark, Notification, PostLike
 from ..serializers import PostSerializer, PostPreviewSerializer, PostLikeModelSerializer, \
-  PostDetailSerializer, AugmentedPostPreviewSerializer, BookmarkSerializer, \
-  NotificationModelSerializer
+  PostDetailSerializer, AugmentedPostPreviewSerializer, BookmarkSerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.db.models import Q
-from ..utils import add_visit_record, get_page_response, is_valid_utc_timestamp, sort_posts_by_rating
+from ..authentication import CachedJWTAuthentication
+from ..utils import add_visit_record, get_page_response, is_valid_utc_timestamp
+from ..timeline import get_timeline
+from ..pagination import paginate
+from ..counters import bump_post_counters
+from ..trending import TRENDING_ORDERING
+from ..threads import attach_reply, get_reply_thread_ids
+from ..search_index import unindex_post
+from ..hashtag_trie import update_hashtag_counts
+from ..outbox import enqueue
+from ..images import ImageVariants, generate_image_variants
+from ..notifications import refresh_unread_counts, post_notification_recipients, retract_notification
+from django.db import transaction
 from django.utils import timezone
-from django.core.paginator import Paginator
 from datetime import datetime
 
 class PostView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = PostSerializer
   
   def post(self, request):
@@ -34,8 +42,8 @@ class PostView(GenericAPIView):
       serializer.is_valid(raise_exception=True)
       post = serializer.save()
       
-      for image in images:
-        PostImage.objects.create(post=post, image=image)
+      post_images = [PostImage.objects.create(post=post, image=image) for image in images]
+      generate_image_variants(post_image.image.name for post_image in post_images)
         
       serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
       
@@ -46,17 +54,15 @@ class PostView(GenericAPIView):
       if timestamp_str is not None and not is_valid_utc_timestamp(float(timestamp_str)):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
-      posts = Post.objects.order_by('-created_at').filter((Q(author__followers__follower=request.user) | Q(author=request.user)) & Q(created_at__lte=timestamp)).distinct()
-      paginator = Paginator(posts, 20)
-      current_page = paginator.get_page(page)
+      entries = get_timeline(request.user).filter(created_at__lte=timestamp)
+      current_page = paginate(request, entries, 20, transform=lambda entry: entry.post)
       response = get_page_response(current_page, request, AugmentedPostPreviewSerializer)
       return Response(response, status=status.HTTP_200_OK)
     
     
 class UserPostsView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = AugmentedPostPreviewSerializer
   lookup_url_kwarg = 'username'
   
@@ -66,39 +72,33 @@ class UserPostsView(GenericAPIView):
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
-      posts = Post.objects.filter(author=author).filter(created_at__lte=timestamp).order_by('-created_at')
-      paginator = Paginator(posts, 20)
-      current_page = paginator.get_page(page)
+      posts = Post.objects.filter(author=author).filter(created_at__lte=timestamp)
+      current_page = paginate(request, posts, 20)
       response = get_page_response(current_page, request, self.serializer_class)
       return Response(response, status=status.HTTP_200_OK)
     
 
 class UserLikedPostsView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = AugmentedPostPreviewSerializer
   lookup_url_kwarg = 'username'
   
   def get(self, request, username):
       author = get_object_or_404(User, username=username)
-      likes = author.likes.all().order_by('-created_at')
-      posts = [like.post for like in likes]
       timestamp_str = request.query_params.get('timestamp', None)
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
-      filtered_posts = list(filter(lambda post: post.created_at <= timestamp, posts))
-      paginator = Paginator(filtered_posts, 20)
-      current_page = paginator.get_page(page)
+      likes = author.likes.filter(post__created_at__lte=timestamp).select_related('post')
+      current_page = paginate(request, likes, 20, transform=lambda like: like.post)
       response = get_page_response(current_page, request, self.serializer_class)
       return Response(response, status=status.HTTP_200_OK)
     
 
 class UserMediaView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = PostPreviewSerializer
   lookup_url_kwarg = 'username'
   
@@ -108,26 +108,19 @@ class UserMediaView(GenericAPIView):
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
-      post_images = PostImage.objects.filter(post__author=author).filter(post__created_at__lte=timestamp).order_by('-post__created_at')
-      paginator = Paginator(post_images, 30)
-      current_page = paginator.get_page(page)
-      images = [request.build_absolute_uri(image.image.url) for image in current_page.object_list]
-      
-      response = {
-        'count': paginator.count,
-        'next': current_page.next_page_number() if current_page.has_next() else None,
-        'previous': current_page.previous_page_number() if current_page.has_previous() else None,
-        'results': images,
-        'total_pages': paginator.num_pages,
-      }
+      post_images = PostImage.objects.filter(post__author=author).filter(post__created_at__lte=timestamp).select_related('post')
+      current_page = paginate(request, post_images, 30, ordering=('-post__created_at', '-id'), transform=lambda image: image.image)
+      image_variants = ImageVariants(request)
+      image_variants.load(image.name for image in current_page.object_list)
+      current_page.object_list = [image_variants.url(image) for image in current_page.object_list]
+      response = get_page_response(current_page, request)
       
       return Response(response, status=status.HTTP_200_OK)
     
     
 class PostDetailView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'postId'
   queryset = Post.objects.all()
   
@@ -143,36 +136,37 @@ class PostDetailView(GenericAPIView):
       if post.author != request.user:
           return Response(status=status.HTTP_403_FORBIDDEN)
       
-      post.delete()
+      with transaction.atomic():
+        if post.reply_parent is not None:
+          bump_post_counters(post.reply_parent, reply_count=-1)
+        if post.repost_parent is not None:
+          bump_post_counters(post.repost_parent, repost_count=-1)
+        post_id = post.id
+        tag_names = list(post.hashtags.values_list('name', flat=True))
+        recipients = post_notification_recipients(post)
+        post.delete()
+        refresh_unread_counts(recipients)
+        if post.repost_parent is not None:
+          retract_notification('repost', post.repost_parent.author_id, post.created_at, target_post_id=post.repost_parent_id)
+      unindex_post(post_id)
+      update_hashtag_counts(detached=tag_names)
       return Response(status=status.HTTP_204_NO_CONTENT)
     
 class PostReplyListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'postId'
   queryset = Post.objects.all()
   serializer_class = AugmentedPostPreviewSerializer
   
   def get(self, request, postId):
       post = self.get_object()
-      page = request.query_params.get('page', 1)
       timestamp_str = request.query_params.get('timestamp', None)
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      replies = post.replies.all().filter(created_at__lte=timestamp)
-      reply_list = list(replies)
-      reply_list_len = len(reply_list)
-      
-      for i in range(reply_list_len):
-        reply = reply_list[i]
-        next_reply = reply.replies.all().filter(created_at__lte=timestamp).order_by('-created_at').first()
-        while next_reply:
-          reply_list.append(next_reply)
-          next_reply = next_reply.replies.all().filter(created_at__lte=timestamp).order_by('-created_at').first()
-      reply_list.sort(key=lambda reply: reply.created_at, reverse=True)
-      paginator = Paginator(reply_list, 20)
-      current_page = paginator.get_page(page)
+      replies = Post.objects.filter(id__in=get_reply_thread_ids(post, timestamp))
+      current_page = paginate(request, replies, 20)
       response = get_page_response(current_page, request, self.serializer_class)
       return Response(response, status=status.HTTP_200_OK)
     
@@ -193,23 +187,15 @@ class PostReplyListView(GenericAPIView):
     serializer.is_valid(raise_exception=True)
     post = serializer.save()
     
-    for image in images:
-        PostImage.objects.create(post=post, image=image)
+    post_images = [PostImage.objects.create(post=post, image=image) for image in images]
+    generate_image_variants(post_image.image.name for post_image in post_images)
         
-    post.reply_parent = parent_post
-    post.save()
+    with transaction.atomic():
+      attach_reply(post, parent_post)
+      post.save()
+      bump_post_counters(parent_post, reply_count=1)
+      enqueue('reply', post_id=post.id)
     
-    if parent_post.author != request.user:
-      notification = {
-        'recipient': parent_post.author.id,
-        'type': 'reply',
-        'reply': post.id,
-      }
-      
-      noti_serializer = NotificationModelSerializer(data=notification)
-      noti_serializer.is_valid(raise_exception=True)
-      noti_serializer.save()
-    add_visit_record(request.user, parent_post)
     serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
     
     return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -217,7 +203,7 @@ class PostReplyListView(GenericAPIView):
 
 class PostLikeView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'postId'
   queryset = Post.objects.all()
   
@@ -225,27 +211,24 @@ class PostLikeView(GenericAPIView):
       post = self.get_object()
       like = PostLikeModelSerializer(data={'post': post.id, 'user': request.user.id})
       like.is_valid(raise_exception=True)
-      like.save()
+      with transaction.atomic():
+        like.save()
+        bump_post_counters(post, like_count=1)
+        enqueue('like', like_id=like.instance.id)
       
-      if post.author.id != request.user.id:
-        notification = {
-          'recipient': post.author.id,
-          'type': 'like',
-          'like': like.data['id'],
-        }
-        
-        noti_serializer = NotificationModelSerializer(data=notification)
-        noti_serializer.is_valid(raise_exception=True)
-        noti_serializer.save()
-      add_visit_record(request.user, post)
       serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
       return Response(serializer.data, status=status.HTTP_201_CREATED)
     
   def delete(self, request, *args, **kwargs):
       post = self.get_object()
-      like = post.likes.filter(user=request.user)
-      if like.exists():
+      with transaction.atomic():
+        like = post.likes.filter(user=request.user).first()
+        unliked = like is not None
+        if unliked:
           like.delete()
+          bump_post_counters(post, like_count=-1)
+          retract_notification('like', post.author_id, like.created_at, target_post_id=post.id)
+      if unliked:
           serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
           return Response(serializer.data, status=status.HTTP_200_OK)
       
@@ -254,7 +237,7 @@ class PostLikeView(GenericAPIView):
 
 class PostBookmarkView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'postId'
   queryset = Post.objects.all()
   
@@ -266,7 +249,9 @@ class PostBookmarkView(GenericAPIView):
               
       serializer = BookmarkSerializer(data={'user': request.user.id, 'post': post.id})
       serializer.is_valid(raise_exception=True)
-      serializer.save()
+      with transaction.atomic():
+        serializer.save()
+        bump_post_counters(post, bookmark_count=1)
       add_visit_record(request.user, post)
       serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
       return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -276,31 +261,31 @@ class PostBookmarkView(GenericAPIView):
       if not Bookmark.objects.filter(user=request.user, post=post).exists():
           return Response({'message': 'Post not bookmarked'}, status=status.HTTP_400_BAD_REQUEST)
         
-      bookmark = Bookmark.objects.filter(user=request.user, post=post).first()
-      bookmark.delete()
+      with transaction.atomic():
+        _, deleted_per_model = Bookmark.objects.filter(user=request.user, post=post).delete()
+        if deleted_per_model.get(Bookmark._meta.label, 0) > 0:
+          bump_post_counters(post, bookmark_count=-1)
       
       serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
       return Response(serializer.data, status=status.HTTP_200_OK)
     
 class BookmarkListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request):
-      page = request.query_params.get('page', 1)
       timestamp_str = request.query_params.get('timestamp', None)
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      bookmarks = Bookmark.objects.filter(user=request.user).filter(post__created_at__lte=timestamp).order_by('-post__created_at')
-      posts = [bookmark.post for bookmark in bookmarks]
-      paginator = Paginator(posts, 20)
-      response = get_page_response(paginator.get_page(page), request, AugmentedPostPreviewSerializer)
+      bookmarks = Bookmark.objects.filter(user=request.user).filter(post__created_at__lte=timestamp).select_related('post')
+      current_page = paginate(request, bookmarks, 20, ordering=('-post__created_at', '-id'), transform=lambda bookmark: bookmark.post)
+      response = get_page_response(current_page, request, AugmentedPostPreviewSerializer)
       return Response(response, status=status.HTTP_200_OK)
 
 class PostRepostView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = PostSerializer
   lookup_url_kwarg = 'postId'
   
@@ -321,24 +306,15 @@ class PostRepostView(GenericAPIView):
       serializer.is_valid(raise_exception=True)
       post = serializer.save()
       
-      for image in images:
-        PostImage.objects.create(post=post, image=image)
+      post_images = [PostImage.objects.create(post=post, image=image) for image in images]
+      generate_image_variants(post_image.image.name for post_image in post_images)
           
-      post.repost_parent = parent_post
-      post.save()
-      
-      if parent_post.author != request.user:
-        notification = {
-          'recipient': parent_post.author.id,
-          'type': 'repost',
-          'repost': post.id,
-        }
-        
-        noti_serializer = NotificationModelSerializer(data=notification)
-        noti_serializer.is_valid(raise_exception=True)
-        noti_serializer.save()
+      with transaction.atomic():
+        post.repost_parent = parent_post
+        post.save()
+        bump_post_counters(parent_post, repost_count=1)
+        enqueue('repost', post_id=post.id)
       
-      add_visit_record(request.user, parent_post)
       serializer = AugmentedPostPreviewSerializer(post, context={'request': request})
       
       return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -346,23 +322,21 @@ class PostRepostView(GenericAPIView):
     
 class TopRatedPostListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request):
       timestamp_str = request.query_params.get('timestamp', None)
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
       posts = Post.objects.filter(created_at__lte=timestamp)
-      posts = sort_posts_by_rating(posts)
-      paginator = Paginator(posts, 20)
-      response = get_page_response(paginator.page(page), request, AugmentedPostPreviewSerializer)
+      current_page = paginate(request, posts, 20, ordering=TRENDING_ORDERING)
+      response = get_page_response(current_page, request, AugmentedPostPreviewSerializer)
       return Response(response, status=status.HTTP_200_OK)
     
 class TopRatedPostRangeView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request):
       from_timestamp_str = request.query_params.get('from', None)
@@ -372,29 +346,27 @@ class TopRatedPostRangeView(GenericAPIView):
       
       from_timestamp = datetime.utcfromtimestamp(float(from_timestamp_str))
       to_timestamp = datetime.utcfromtimestamp(float(to_timestamp_str))
-      posts = Post.objects.filter(created_at__gt=from_timestamp).filter(created_at__lte=to_timestamp)
-      posts = sort_posts_by_rating(posts)
+      posts = Post.objects.filter(created_at__gt=from_timestamp).filter(created_at__lte=to_timestamp).order_by(*TRENDING_ORDERING)
       return Response(AugmentedPostPreviewSerializer(posts, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
     
 
 class FollowingPostListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request):    
       timestamp_str = request.query_params.get('timestamp', None)
       if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
         return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
       timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-      page = request.query_params.get('page', 1)
-      posts = Post.objects.filter((Q(author__followers__follower=request.user) | Q(author=request.user)) & Q(created_at__lte=timestamp)).distinct()
-      paginator = Paginator(posts, 20)
-      response = get_page_response(paginator.page(page), request, AugmentedPostPreviewSerializer)
+      entries = get_timeline(request.user).filter(created_at__lte=timestamp)
+      current_page = paginate(request, entries, 20, transform=lambda entry: entry.post)
+      response = get_page_response(current_page, request, AugmentedPostPreviewSerializer)
       return Response(response, status=status.HTTP_200_OK)
 
 class FollowingPostRangeView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request):
       from_timestamp_str = request.query_params.get('from', None)
@@ -404,5 +376,6 @@ class FollowingPostRangeView(GenericAPIView):
       
       from_timestamp = datetime.utcfromtimestamp(float(from_timestamp_str))
       to_timestamp = datetime.utcfromtimestamp(float(to_timestamp_str))
-      posts = Post.objects.filter((Q(author__followers__follower=request.user) | Q(author=request.user)) & Q(created_at__gt=from_timestamp) & Q(created_at__lte=to_timestamp)).distinct()
+      entries = get_timeline(request.user).filter(created_at__gt=from_timestamp, created_at__lte=to_timestamp)
+      posts = [entry.post for entry in entries]
       return Response(AugmentedPostPreviewSerializer(posts, many=True, context={'request': request}).data, status=status.HTTP_200_OK)
\ No newline at end of file
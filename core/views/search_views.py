@@ -2,17 +2,20 @@ from rest_framework.generics import get_object_or_404, GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.postgres.search import TrigramSimilarity
-from django.db.models import Count
 
-from core.models import Post, User, HashTag
+from core.models import Post, User, HashTag, PostImage
 from ..serializers import AugmentedPostPreviewSerializer, UserProfileSerializer, HashtagSerializer
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from ..authentication import CachedJWTAuthentication
 from django.db.models import Q
 from django.utils import timezone
 from datetime import datetime
-from ..utils import is_valid_utc_timestamp, get_page_response, sort_posts_by_rating
+from ..utils import is_valid_utc_timestamp, get_page_response, rank_post_ids, hydrate_posts
 from django.core.paginator import Paginator
+from ..pagination import paginate
+from ..search_index import get_search_index, get_top_candidate_limit
+from ..hashtag_trie import get_hashtag_trie, HASHTAG_TOP_K, HASHTAG_MAX_LIMIT
+from ..images import ImageVariants
 from django.db.models import TextField
 from django.db.models.functions import Length
 
@@ -22,7 +25,7 @@ TextField.register_lookup(TrigramSimilarity, 'similarity')
       
 class SearchTopView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request, *args, **kwargs):
     query = request.query_params.get('q', None)
@@ -37,10 +40,11 @@ class SearchTopView(GenericAPIView):
     if query is None or len(query) == 0:
       return Response(empty_response, status=status.HTTP_200_OK)
     # Search post by post content
-    filtered_posts = Post.objects.filter(Q(content__icontains=query) | Q(author__name__icontains=query) | Q(author__username__icontains=query)).filter(created_at__lte=timestamp)
-    filtered_posts = sort_posts_by_rating(filtered_posts)
-    paginator = Paginator(filtered_posts, 20)
+    hits = get_search_index().search(query, before=timestamp)[:get_top_candidate_limit()]
+    filtered_posts = Post.objects.filter(id__in=[hit.id for hit in hits]).order_by('-created_at', '-id')
+    paginator = Paginator(rank_post_ids(filtered_posts), 20)
     page = paginator.page(page)
+    page.object_list = hydrate_posts(page.object_list)
     response_body = get_page_response(page, request, AugmentedPostPreviewSerializer)
     
     return Response(response_body, status=status.HTTP_200_OK)
@@ -48,7 +52,7 @@ class SearchTopView(GenericAPIView):
 
 class SearchLatestView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request, *args, **kwargs):
     query = request.query_params.get('q', None)
@@ -56,23 +60,27 @@ class SearchLatestView(GenericAPIView):
     if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
       return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
     timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-    page = request.query_params.get('page', 1)
     
     empty_response = get_page_response(Paginator([], 1).page(1), request)
     
     if query is None or len(query) == 0:
       return Response(empty_response, status=status.HTTP_200_OK)
     # Search post by post content
-    filtered_posts = Post.objects.filter(Q(content__icontains=query) | Q(author__name__icontains=query) | Q(author__username__icontains=query)).filter(created_at__lte=timestamp)
-    paginator = Paginator(filtered_posts, 20)
-    page = paginator.page(page)
+    search_index = get_search_index()
+    hits = search_index.search(query, before=timestamp)
+    page = paginate(request, hits, 20, model=Post)
+    page_ids = [hit.id for hit in page.object_list]
+    page.object_list = hydrate_posts(page_ids)
+    # drop posts deleted through another process
+    for post_id in set(page_ids) - {post.id for post in page.object_list}:
+      search_index.remove_post(post_id)
     response_body = get_page_response(page, request, AugmentedPostPreviewSerializer)
     return Response(response_body, status=status.HTTP_200_OK)
   
 
 class SearchPeopleView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request, *args, **kwargs):
     query = request.query_params.get('q', None)
@@ -100,7 +108,7 @@ class SearchPeopleView(GenericAPIView):
 
 class SearchMediaView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request, *args, **kwargs):
     query = request.query_params.get('q', None)
@@ -116,18 +124,29 @@ class SearchMediaView(GenericAPIView):
       return Response(empty_response, status=status.HTTP_200_OK)
     
     # Search post by post content
-    filtered_posts = Post.objects.filter(Q(content__icontains=query) | Q(author__name__icontains=query) | Q(author__username__icontains=query)).filter(created_at__lte=timestamp)
+    hits = get_search_index().search(query, before=timestamp)
     filtered_media = []
     
-    for post in filtered_posts:
-      images = post.images.all()
-      for image in images:
-        filtered_media.append(request.build_absolute_uri(image.image.url))
+    # only the first 20 images are returned, so load the images of the newest
+    # matches a chunk at a time instead of the images of every match
+    for start in range(0, len(hits), 100):
+      post_ids = [hit.id for hit in hits[start:start + 100]]
+      images_by_post = {}
+      for image in PostImage.objects.filter(post_id__in=post_ids):
+        images_by_post.setdefault(image.post_id, []).append(image)
+      for post_id in post_ids:
+        for image in images_by_post.get(post_id, []):
+          filtered_media.append(image.image)
+          if len(filtered_media) == 20:
+            break
         if len(filtered_media) == 20:
           break
       if len(filtered_media) == 20:
         break
       
+    image_variants = ImageVariants(request)
+    image_variants.load(image.name for image in filtered_media)
+    filtered_media = [image_variants.url(image) for image in filtered_media]
     paginator = Paginator(filtered_media, 20)
     page = paginator.page(page)
     response_body = get_page_response(page, request)
@@ -137,15 +156,16 @@ class SearchMediaView(GenericAPIView):
       
 class SearchHashtagView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   
   def get(self, request, *args, **kwargs):
-    query = request.query_params.get('q', None)
+    query = request.query_params.get('q', '')
+    limit = request.query_params.get('limit', str(HASHTAG_TOP_K))
+    if not limit.isdigit() or not 0 < int(limit) <= HASHTAG_MAX_LIMIT:
+      return Response({'error': 'Invalid limit'}, status=status.HTTP_400_BAD_REQUEST)
     
-    # Search hashtag by name
-    filtered_hashtags = HashTag.objects.annotate(
-      popularity=Count('posts'),
-    ).filter(name__startswith=query).order_by('-popularity')
+    # Search hashtag by name, most used first
+    filtered_hashtags = get_hashtag_trie().search(query, int(limit))
 
     hash_tags = HashtagSerializer(filtered_hashtags, many=True).data
-    return Response(hash_tags, status=status.HTTP_200_OK)
\ No newline at end of file
+    return Response(hash_tags, status=status.HTTP_200_OK)
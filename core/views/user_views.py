@@ -4,22 +4,32 @@ from rest_framework import status
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from ..serializers import CurrentUserSerializer, UserProfileSerializer, NotificationModelSerializer
+from ..authentication import CachedJWTAuthentication
+from ..serializers import CurrentUserSerializer, UserProfileSerializer
 from django.utils import timezone
 from datetime import datetime
 from ..utils import is_valid_utc_timestamp, get_page_response
 from ..models import User, Follow
+from ..timeline import backfill_timeline, prune_timeline
+from ..pagination import paginate
+from ..search_index import index_author
+from ..notifications import retract_notification
+from ..outbox import enqueue
+from ..images import generate_image_variants
+from ..counters import FOLLOW_COUNTER_FIELDS, increment_follow_counters
+from django.db import transaction
 from django.db.models import Q
 from django.core.paginator import Paginator
 
 class CurrentUser(GenericAPIView):
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     serializer_class = UserProfileSerializer
   
     def get(self, request):
         user = request.user
+        # the authenticated user may come from the cache, the counters change without saving it
+        user.refresh_from_db(fields=FOLLOW_COUNTER_FIELDS)
         serializer = self.get_serializer(user)
         
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -27,7 +37,7 @@ class CurrentUser(GenericAPIView):
 
 class UserView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   serializer_class = UserProfileSerializer
   lookjup_url_kwarg = 'username'
   
@@ -57,7 +67,9 @@ class UserView(GenericAPIView):
     if not serializer.is_valid():
       return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-    serializer.save()
+    user = serializer.save()
+    index_author(user)
+    generate_image_variants(getattr(user, field).name for field in ('profile_image', 'header_photo') if field in files)
     return Response(serializer.data, status=status.HTTP_200_OK)
       
   
@@ -75,7 +87,7 @@ class PublicQueryUser(GenericAPIView):
   
 class UserFollowView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'username'
   
   def post(self, request, username):
@@ -85,17 +97,13 @@ class UserFollowView(GenericAPIView):
     follow = Follow.objects.filter(follower=request.user, following=user).first()
     if follow is not None:
       return Response({'error': 'You are already following this user'}, status=status.HTTP_400_BAD_REQUEST)
-    follow = Follow(follower=request.user, following=user)
-    follow.save()
-      
-    noti_serializer = NotificationModelSerializer(data={
-      'recipient': user.id,
-      'type': 'follow',
-      'follow': follow.id,
-    })
-    
-    noti_serializer.is_valid(raise_exception=True)
-    noti_serializer.save()
+    with transaction.atomic():
+      follow = Follow(follower=request.user, following=user)
+      follow.save()
+      increment_follow_counters(request.user.id, user.id, 1)
+      enqueue('follow', follow_id=follow.id)
+    user.refresh_from_db(fields=FOLLOW_COUNTER_FIELDS)
+    backfill_timeline(request.user, user)
     
     serializer = UserProfileSerializer(user, context={'request': request})
     
@@ -106,47 +114,47 @@ class UserFollowView(GenericAPIView):
     follow = Follow.objects.filter(follower=request.user, following=user).first()
     if follow is None:
       return Response({'error': 'You are not following this user'}, status=status.HTTP_400_BAD_REQUEST)
-    follow.delete()
+    with transaction.atomic():
+      _, deleted_per_model = Follow.objects.filter(id=follow.id).delete()
+      if deleted_per_model.get(Follow._meta.label, 0) > 0:
+        increment_follow_counters(request.user.id, user.id, -1)
+    user.refresh_from_db(fields=FOLLOW_COUNTER_FIELDS)
+    retract_notification('follow', user.id, follow.created_at)
+    prune_timeline(request.user, user)
     
     serializer = UserProfileSerializer(user, context={'request': request})
     return Response(serializer.data, status=status.HTTP_200_OK)
   
 class UserFollowerListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'username'
   
   def get(self, request, username):
     user = get_object_or_404(User, username=username)
-    page = request.query_params.get('page', 1)
     timestamp_str = request.query_params.get('timestamp', None)
     if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
       return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
     timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-    follows = Follow.objects.filter(following=user, created_at__lt=timestamp).order_by('-created_at')
-    followers = [follow.follower for follow in follows]
-    paginator = Paginator(followers, 20)
-    current_page = paginator.get_page(page)
+    follows = Follow.objects.filter(following=user, created_at__lt=timestamp).select_related('follower')
+    current_page = paginate(request, follows, 20, transform=lambda follow: follow.follower)
     response = get_page_response(current_page, request, UserProfileSerializer)
     return Response(response, status=status.HTTP_200_OK)
   
 
 class UserFollowingListView(GenericAPIView):
   permission_classes = [IsAuthenticated]
-  authentication_classes = [JWTAuthentication]
+  authentication_classes = [CachedJWTAuthentication]
   lookup_url_kwarg = 'username'
   
   def get(self, request, username):
     user = get_object_or_404(User, username=username)
-    page = request.query_params.get('page', 1)
     timestamp_str = request.query_params.get('timestamp', None)
     if timestamp_str is not None and not is_valid_utc_timestamp(timestamp_str):
       return Response({'error': 'Invalid timestamp'}, status=status.HTTP_400_BAD_REQUEST)
     timestamp = timezone.now() if timestamp_str is None else datetime.utcfromtimestamp(float(timestamp_str))
-    follows = Follow.objects.filter(follower=user, created_at__lt=timestamp).order_by('-created_at')
-    following = [follow.following for follow in follows]
-    paginator = Paginator(following, 20)
-    current_page = paginator.get_page(page)
+    follows = Follow.objects.filter(follower=user, created_at__lt=timestamp).select_related('following')
+    current_page = paginate(request, follows, 20, transform=lambda follow: follow.following)
     response = get_page_response(current_page, request, UserProfileSerializer)
     return Response(response, status=status.HTTP_200_OK)
     
@@ -0,0 +1,126 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .counters import increment_post_counters
+from .models import VisitRecord
+
+# A visitor is counted at most once per post per day. Visits are collected in
+# memory, deduplicated per (visitor, post, day), and written in batches so the
+# request path does not pay for the lookup and insert. A daemon thread flushes
+# the buffer every VISIT_FLUSH_INTERVAL seconds, a request flushes it early
+# once it holds VISIT_BUFFER_SIZE visits, and whatever is left is flushed at exit.
+
+VISIT_WINDOW = timedelta(days=1)
+
+logger = logging.getLogger(__name__)
+
+
+def write_visits(pending: dict) -> int:
+    """
+    Writes visits keyed by (visitor_id, post_id, day) with their time, keeping
+    at most one record per visitor and post in any VISIT_WINDOW. Returns the
+    number of records written.
+    """
+    visits = {}
+    for (visitor_id, post_id, _), visited_at in pending.items():
+        visits.setdefault((visitor_id, post_id), []).append(visited_at)
+
+    earliest = min(pending.values())
+    recent = VisitRecord.objects.filter(
+        visitor_id__in={visitor_id for visitor_id, _ in visits},
+        post_id__in={post_id for _, post_id in visits},
+        created_at__gt=earliest - VISIT_WINDOW,
+    ).values_list('visitor_id', 'post_id', 'created_at')
+    last_recorded = {}
+    for visitor_id, post_id, created_at in recent:
+        key = (visitor_id, post_id)
+        if key in visits and (key not in last_recorded or created_at > last_recorded[key]):
+            last_recorded[key] = created_at
+
+    records = []
+    for (visitor_id, post_id), times in visits.items():
+        last = last_recorded.get((visitor_id, post_id))
+        for visited_at in sorted(times):
+            if last is None or visited_at - last >= VISIT_WINDOW:
+                records.append(VisitRecord(visitor_id=visitor_id, post_id=post_id, created_at=visited_at))
+                last = visited_at
+
+    view_counts = Counter(record.post_id for record in records)
+    with transaction.atomic():
+        VisitRecord.objects.bulk_create(records)
+        for post_id, count in view_counts.items():
+            increment_post_counters(post_id, view_count=count)
+    return len(records)
+
+
+class VisitBuffer:
+    def __init__(self, max_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = {}
+        self.worker = None
+
+    def record(self, visitor_id, post_id, visited_at: Optional[datetime] = None):
+        visited_at = visited_at or timezone.now()
+        with self.lock:
+            self.pending.setdefault((visitor_id, post_id, visited_at.date()), visited_at)
+            flush_now = len(self.pending) >= self.max_size
+        self.start_worker()
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            return write_visits(pending)
+
+    def start_worker(self):
+        # started lazily so each forked server process gets its own thread
+        if self.worker is not None and self.worker.is_alive():
+            return
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run_worker, name='visit-buffer', daemon=True)
+                self.worker.start()
+
+    def run_worker(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # keep the thread alive, the failed batch is lost like a dropped request would be
+                logger.exception('Failed to flush buffered visits')
+            finally:
+                connection.close()
+
+
+_visit_buffer = None
+_visit_buffer_lock = threading.Lock()
+
+
+def get_visit_buffer() -> VisitBuffer:
+    global _visit_buffer
+    if _visit_buffer is None:
+        with _visit_buffer_lock:
+            if _visit_buffer is None:
+                _visit_buffer = VisitBuffer(
+                    max_size=getattr(settings, 'VISIT_BUFFER_SIZE', 200),
+                    flush_interval=getattr(settings, 'VISIT_FLUSH_INTERVAL', 5),
+                )
+                atexit.register(_visit_buffer.flush)
+    return _visit_buffer
@@ -162,17 +162,35 @@ REST_FRAMEWORK = {
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# set where nginx serves MEDIA_ROOT from its internal /protected-media/ location
+MEDIA_ACCEL_REDIRECT = None
+
 if not os.path.exists(BASE_DIR / '.env.local'):
     MEDIA_ROOT = '/home/ubuntu/media'
+    MEDIA_ACCEL_REDIRECT = '/protected-media/'
 
 MEDIA_URL = '/media/'
 
+STORAGES = {
+    # uploads are deduplicated by content, see core.storage
+    'default': {
+        'BACKEND': 'core.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# live events reach the streams of every server process, see core.events
+EVENT_BROKER = 'core.events.PostgresBroker'
+
 AUTH_USER_MODEL = 'core.User'
 
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
     'ACCESS_TOKEN_LIFETIME': timedelta(days=10),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=20),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.authentication.VersionedTokenObtainPairSerializer',
 }
 
 USE_TZ = True
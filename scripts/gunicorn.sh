@@ -4,3 +4,8 @@ sudo cp /home/ubuntu/social-media-app-backend/gunicorn/gunicorn.service  /etc/sy
 
 sudo systemctl start gunicorn.service
 sudo systemctl enable gunicorn.service
+
+sudo cp /home/ubuntu/social-media-app-backend/gunicorn/outbox.service  /etc/systemd/system/outbox.service
+
+sudo systemctl start outbox.service
+sudo systemctl enable outbox.service
@@ -5,7 +5,9 @@ sed -i 's/\[]/\["54.144.250.113"]/' /home/ubuntu/social-media-app-backend/mysite
 python manage.py migrate 
 python manage.py makemigrations     
 python manage.py collectstatic
+python manage.py build_search_index
 sudo service gunicorn restart
+sudo service outbox restart
 sudo service nginx restart
 #sudo tail -f /var/log/nginx/error.log
 #sudo systemctl reload nginx